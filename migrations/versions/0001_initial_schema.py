@@ -0,0 +1,72 @@
+"""Initial schema, as created by Base.metadata.create_all before migrations
+
+Databases created by ENABLE_DB_INIT before migrations were introduced can be
+adopted with ``alembic stamp 0001_initial_schema`` followed by
+``alembic upgrade head``; later revisions add and backfill the newer columns.
+
+Revision ID: 0001_initial_schema
+Revises:
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "0001_initial_schema"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "personas",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column(
+            "occasion",
+            sa.Enum("birthday", "christmas", "valentine", "graduation", "wedding", "babyshower", "other", name="occasion"),
+            nullable=False,
+        ),
+        sa.Column("age", sa.Integer(), nullable=False),
+        sa.Column("budget", sa.Enum("under_25", "range_25_50", "range_50_100", "over_100", name="budgetrange"), nullable=True),
+        sa.Column("gender", sa.Enum("male", "female", "non_binary", name="gender"), nullable=True),
+        sa.Column(
+            "relationship",
+            sa.Enum("partner", "parent", "child", "sibling", "friend", "colleague", "acquaintance", "other", name="relationship"),
+            nullable=False,
+        ),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_table(
+        "questions",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("persona_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("personas.id"), nullable=False),
+        sa.Column("question_text", sa.Text(), nullable=False),
+        sa.Column("choices", postgresql.JSONB(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_table(
+        "answers",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("question_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("questions.id"), nullable=False),
+        sa.Column("selected_choice_text", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_table(
+        "message_history",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("persona_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("personas.id"), nullable=False),
+        sa.Column("messages_json", sa.LargeBinary(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("message_history")
+    op.drop_table("answers")
+    op.drop_table("questions")
+    op.drop_table("personas")
+    for enum_name in ("relationship", "gender", "budgetrange", "occasion"):
+        sa.Enum(name=enum_name).drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,38 @@
+"""Indexes for the persona-scoped hot queries
+
+Built with CREATE INDEX CONCURRENTLY on Postgres so populated tables stay
+writable while the indexes are created.
+
+Revision ID: 0002_persona_scoped_indexes
+Revises: 0001_initial_schema
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+
+
+revision: str = "0002_persona_scoped_indexes"
+down_revision: Union[str, None] = "0001_initial_schema"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (index name, table, columns)
+INDEXES = [
+    ("ix_questions_persona_id_created_at", "questions", ["persona_id", "created_at"]),
+    ("ix_answers_question_id", "answers", ["question_id"]),
+    # The message_history index needs the sequence column, see 0008_message_history_sequence
+]
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
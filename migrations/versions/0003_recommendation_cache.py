@@ -0,0 +1,33 @@
+"""Recommendation cache keyed by profile fingerprint
+
+Revision ID: 0003_recommendation_cache
+Revises: 0002_persona_scoped_indexes
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "0003_recommendation_cache"
+down_revision: Union[str, None] = "0002_persona_scoped_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "recommendation_cache",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("persona_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("personas.id"), nullable=False),
+        sa.Column("fingerprint", sa.String(length=64), nullable=False),
+        sa.Column("response", postgresql.JSONB(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_recommendation_cache_persona_id", "recommendation_cache", ["persona_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_recommendation_cache_persona_id", table_name="recommendation_cache")
+    op.drop_table("recommendation_cache")
@@ -0,0 +1,37 @@
+"""Recommendations shared across personas with matching normalized profiles
+
+Revision ID: 0004_shared_recommendation_cache
+Revises: 0003_recommendation_cache
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "0004_shared_recommendation_cache"
+down_revision: Union[str, None] = "0003_recommendation_cache"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "shared_recommendation_cache",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("demographic_key", sa.String(), nullable=False),
+        sa.Column("signature", sa.String(length=64), nullable=False),
+        sa.Column("choices", postgresql.JSONB(), nullable=False),
+        sa.Column("recommendations", postgresql.JSONB(), nullable=False),
+        sa.Column("hit_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_shared_recommendation_cache_demographic_key", "shared_recommendation_cache", ["demographic_key"])
+    op.create_index("ix_shared_recommendation_cache_signature", "shared_recommendation_cache", ["signature"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_shared_recommendation_cache_signature", table_name="shared_recommendation_cache")
+    op.drop_index("ix_shared_recommendation_cache_demographic_key", table_name="shared_recommendation_cache")
+    op.drop_table("shared_recommendation_cache")
@@ -0,0 +1,25 @@
+"""Requested count of cached recommendation responses
+
+Revision ID: 0006_recommendation_cache_count
+Revises: 0005_jobs
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0006_recommendation_cache_count"
+down_revision: Union[str, None] = "0005_jobs"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing entries were keyed by fingerprints that included the count and no longer match
+    op.add_column("recommendation_cache", sa.Column("requested_count", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("recommendation_cache") as batch_op:
+        batch_op.drop_column("requested_count")
@@ -0,0 +1,34 @@
+"""Persisted pages of additional recommendations
+
+Revision ID: 0007_recommendation_batches
+Revises: 0006_recommendation_cache_count
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "0007_recommendation_batches"
+down_revision: Union[str, None] = "0006_recommendation_cache_count"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "recommendation_batches",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("persona_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("personas.id"), nullable=False),
+        sa.Column("fingerprint", sa.String(length=64), nullable=False),
+        sa.Column("page", sa.Integer(), nullable=False),
+        sa.Column("recommendations", postgresql.JSONB(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_recommendation_batches_persona_id_page", "recommendation_batches", ["persona_id", "page"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_recommendation_batches_persona_id_page", table_name="recommendation_batches")
+    op.drop_table("recommendation_batches")
@@ -0,0 +1,51 @@
+"""Per-persona sequence numbers and snapshot rows for message history
+
+Existing rows are plain batches: each persona's rows are numbered in
+``created_at`` order with ``is_snapshot`` false. Databases that already have
+the columns (created by an earlier 0001) keep their values.
+
+Revision ID: 0008_message_history_sequence
+Revises: 0007_recommendation_batches
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0008_message_history_sequence"
+down_revision: Union[str, None] = "0007_recommendation_batches"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("message_history")}
+    if "sequence" not in columns:
+        op.add_column("message_history", sa.Column("sequence", sa.Integer(), nullable=False, server_default="0"))
+        op.add_column("message_history", sa.Column("is_snapshot", sa.Boolean(), nullable=False, server_default=sa.false()))
+        op.execute(
+            """
+            UPDATE message_history SET sequence = ranked.sequence
+            FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY persona_id ORDER BY created_at, id) AS sequence
+                FROM message_history
+            ) AS ranked
+            WHERE message_history.id = ranked.id
+            """
+        )
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_message_history_persona_id_sequence", "message_history", ["persona_id", "sequence", "created_at"],
+            postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_message_history_persona_id_sequence", table_name="message_history", postgresql_concurrently=True, if_exists=True)
+    with op.batch_alter_table("message_history") as batch_op:
+        batch_op.drop_column("is_snapshot")
+        batch_op.drop_column("sequence")
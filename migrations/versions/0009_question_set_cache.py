@@ -0,0 +1,38 @@
+"""Demographic-keyed cache of initial question sets
+
+Revision ID: 0009_question_set_cache
+Revises: 0008_message_history_sequence
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+revision: str = "0009_question_set_cache"
+down_revision: Union[str, None] = "0008_message_history_sequence"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Databases created by an earlier 0001 already have the table
+    if sa.inspect(op.get_bind()).has_table("question_set_cache"):
+        return
+
+    op.create_table(
+        "question_set_cache",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("cache_key", sa.String(), nullable=False),
+        sa.Column("questions", postgresql.JSONB(), nullable=False),
+        sa.Column("detective_comment", sa.Text(), nullable=False),
+        sa.Column("served_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+    )
+    op.create_index("ix_question_set_cache_cache_key", "question_set_cache", ["cache_key"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_question_set_cache_cache_key", table_name="question_set_cache")
+    op.drop_table("question_set_cache")
@@ -0,0 +1,34 @@
+"""Track when a question was served, so pre-generated rounds can wait for the next GET
+
+Questions that existed before this column were all served already, so
+``served_at`` is backfilled from ``created_at``; otherwise they would be
+returned again as a pending round.
+
+Revision ID: 0010_questions_served_at
+Revises: 0009_question_set_cache
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0010_questions_served_at"
+down_revision: Union[str, None] = "0009_question_set_cache"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Databases created by an earlier 0001 already have the column, possibly with pending rounds
+    columns = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("questions")}
+    if "served_at" in columns:
+        return
+
+    op.add_column("questions", sa.Column("served_at", sa.DateTime(), nullable=True))
+    op.execute("UPDATE questions SET served_at = created_at")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("questions") as batch_op:
+        batch_op.drop_column("served_at")
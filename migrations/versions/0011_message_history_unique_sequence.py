@@ -0,0 +1,43 @@
+"""Unique history sequence per persona
+
+Rows that concurrent writers gave the same sequence are renumbered first:
+every row of an affected persona moves past its current highest sequence,
+in (sequence, snapshot first, created_at) order, so versions never repeat.
+
+Revision ID: 0011_message_history_unique_sequence
+Revises: 0010_questions_served_at
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+
+
+revision: str = "0011_message_history_unique_sequence"
+down_revision: Union[str, None] = "0010_questions_served_at"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        UPDATE message_history SET sequence = renumbered.sequence
+        FROM (
+            SELECT id,
+                   MAX(sequence) OVER (PARTITION BY persona_id)
+                   + ROW_NUMBER() OVER (PARTITION BY persona_id ORDER BY sequence, is_snapshot DESC, created_at, id) AS sequence
+            FROM message_history
+            WHERE persona_id IN (
+                SELECT persona_id FROM message_history GROUP BY persona_id, sequence HAVING COUNT(*) > 1
+            )
+        ) AS renumbered
+        WHERE message_history.id = renumbered.id
+        """
+    )
+    with op.batch_alter_table("message_history") as batch_op:
+        batch_op.create_unique_constraint("uq_message_history_persona_id_sequence", ["persona_id", "sequence"])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("message_history") as batch_op:
+        batch_op.drop_constraint("uq_message_history_persona_id_sequence", type_="unique")
@@ -0,0 +1,40 @@
+"""Unique recommendation page per persona and fingerprint
+
+Pages that concurrent requests stored twice are reduced to the first one
+written before the constraint is added.
+
+Revision ID: 0012_recommendation_batches_unique_page
+Revises: 0011_message_history_unique_sequence
+Create Date: 2026-10-17
+"""
+from typing import Sequence, Union
+from alembic import op
+
+
+revision: str = "0012_recommendation_batches_unique_page"
+down_revision: Union[str, None] = "0011_message_history_unique_sequence"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        DELETE FROM recommendation_batches WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY persona_id, fingerprint, page ORDER BY created_at, id) AS position
+                FROM recommendation_batches
+            ) AS ranked
+            WHERE position > 1
+        )
+        """
+    )
+    with op.batch_alter_table("recommendation_batches") as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_recommendation_batches_persona_id_fingerprint_page", ["persona_id", "fingerprint", "page"]
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("recommendation_batches") as batch_op:
+        batch_op.drop_constraint("uq_recommendation_batches_persona_id_fingerprint_page", type_="unique")
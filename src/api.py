@@ -2,8 +2,12 @@ from fastapi import FastAPI
 from src.build_persona.controller import router as build_persona_router
 from src.questions.controller import router as questions_router
 from src.recommendations.controller import router as recommendations_router
+from src.jobs.controller import router as jobs_router
+from src.llm.controller import router as llm_router
 
 def register_routes(app: FastAPI):
     app.include_router(build_persona_router)
     app.include_router(questions_router)
-    app.include_router(recommendations_router)
\ No newline at end of file
+    app.include_router(recommendations_router)
+    app.include_router(jobs_router)
+    app.include_router(llm_router)
\ No newline at end of file
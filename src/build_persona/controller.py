@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, status
 from .models import PersonaRequest, PersonaResponse
 from .service import PersonaService, get_persona_service
+from ..rate_limiter import rate_limit
 
 router = APIRouter(
     prefix="/build-persona",
@@ -8,7 +9,7 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-@router.post("/", status_code=status.HTTP_201_CREATED, response_model=PersonaResponse)
+@router.post("/", status_code=status.HTTP_201_CREATED, response_model=PersonaResponse, dependencies=[Depends(rate_limit())])
 def create_persona(
     request: PersonaRequest,
     service: PersonaService = Depends(get_persona_service),
@@ -1,9 +1,8 @@
 from sqlalchemy import Column, DateTime, ForeignKey, Enum, Integer
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
-from datetime import datetime, timezone
 import enum
-from ..database.core import Base
+from ..database.core import Base, utcnow
 
 
 class Occasion(str, enum.Enum):
@@ -52,7 +51,7 @@ class Persona(Base):
 
     gender = Column(Enum(Gender), nullable=True)
     relationship = Column(Enum(Relationship), nullable=False)
-    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, nullable=False, default=utcnow)
 
     def __repr__(self):
         return f"<Persona(id='{self.id}')>"
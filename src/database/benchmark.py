@@ -0,0 +1,185 @@
+"""Query plans and latency of the persona-scoped hot queries at scale (Postgres only)
+
+Usage:
+    python -m src.database.benchmark [--personas 1000000] [--questions-per-persona 5]
+        [--history-per-persona 3] [--runs 200] [--keep]
+
+Seeds a throwaway ``pickaboo_benchmark`` schema in the configured database,
+then runs every hot query without and with the indexes from migration
+``0002_persona_scoped_indexes``, printing ``EXPLAIN (ANALYZE, BUFFERS)`` for
+one persona and p50/p95 latency over ``--runs`` random personas. The schema
+is dropped afterwards unless ``--keep`` is given.
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from typing import Callable, Dict, List
+from uuid import UUID
+from sqlalchemy import select, func, text, or_, and_
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection
+from .core import Base, ASYNC_DATABASE_URL
+from ..questions.entity import Question, Answer
+from ..messages.entity import MessageHistory
+
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_SCHEMA = "pickaboo_benchmark"
+
+# Indexes added by migrations/versions/0002_persona_scoped_indexes.py
+INDEXES = {
+    "ix_questions_persona_id_created_at": "questions (persona_id, created_at)",
+    "ix_answers_question_id": "answers (question_id)",
+    "ix_message_history_persona_id_sequence": "message_history (persona_id, sequence, created_at)",
+}
+
+
+def load_history_query(persona_id: UUID):
+    """MessageRepository.load_all_messages: latest snapshot plus the batches after it"""
+    snapshot_sequence = (
+        select(func.max(MessageHistory.sequence))
+        .where(MessageHistory.persona_id == persona_id, MessageHistory.is_snapshot.is_(True))
+        .scalar_subquery()
+    )
+    return (
+        select(MessageHistory.messages_json, MessageHistory.sequence)
+        .where(
+            MessageHistory.persona_id == persona_id,
+            or_(
+                snapshot_sequence.is_(None),
+                MessageHistory.sequence > snapshot_sequence,
+                and_(MessageHistory.is_snapshot.is_(True), MessageHistory.sequence == snapshot_sequence),
+            ),
+        )
+        .order_by(MessageHistory.sequence, MessageHistory.created_at)
+    )
+
+
+def history_version_query(persona_id: UUID):
+    """MessageRepository._get_sequences"""
+    return select(
+        func.coalesce(func.max(MessageHistory.sequence), 0),
+        func.max(MessageHistory.sequence).filter(MessageHistory.is_snapshot.is_(True)),
+    ).where(MessageHistory.persona_id == persona_id)
+
+
+def pending_questions_query(persona_id: UUID):
+    """QuestionService._take_pending_questions"""
+    return (
+        select(Question)
+        .where(Question.persona_id == persona_id, Question.served_at.is_(None))
+        .order_by(Question.created_at)
+    )
+
+
+def profile_answers_query(persona_id: UUID):
+    """RecommendationService._build_persona_profile"""
+    return (
+        select(Question, Answer)
+        .join(Answer, Question.id == Answer.question_id)
+        .where(Question.persona_id == persona_id)
+    )
+
+
+HOT_QUERIES: Dict[str, Callable[[UUID], object]] = {
+    "load_all_messages": load_history_query,
+    "history_version": history_version_query,
+    "pending_questions": pending_questions_query,
+    "profile_answers": profile_answers_query,
+}
+
+
+async def seed(conn: AsyncConnection, personas: int, questions_per_persona: int, history_per_persona: int) -> None:
+    """Fill the benchmark schema with synthetic personas, questions, answers and history"""
+    await conn.run_sync(Base.metadata.create_all)
+    for name in INDEXES:
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+    started = time.perf_counter()
+    await conn.execute(text(
+        "INSERT INTO personas (id, occasion, age, relationship, created_at) "
+        "SELECT gen_random_uuid(), 'birthday', 18 + g % 60, 'friend', now() "
+        "FROM generate_series(1, :n) AS g"
+    ), {"n": personas})
+    await conn.execute(text(
+        "INSERT INTO questions (id, persona_id, question_text, choices, served_at, created_at) "
+        "SELECT gen_random_uuid(), p.id, 'Question ' || q, '[\"Yes\", \"No\", \"Maybe\"]'::jsonb, now(), "
+        "now() + q * interval '1 microsecond' "
+        "FROM personas AS p CROSS JOIN generate_series(1, :q) AS q"
+    ), {"q": questions_per_persona})
+    await conn.execute(text(
+        "INSERT INTO answers (id, question_id, selected_choice_text, created_at) "
+        "SELECT gen_random_uuid(), id, 'Yes', now() FROM questions"
+    ))
+    await conn.execute(text(
+        "INSERT INTO message_history (id, persona_id, messages_json, sequence, is_snapshot, created_at) "
+        "SELECT gen_random_uuid(), p.id, convert_to('[]', 'UTF8'), s, false, now() "
+        "FROM personas AS p CROSS JOIN generate_series(1, :h) AS s"
+    ), {"h": history_per_persona})
+    await conn.execute(text("ANALYZE"))
+    logger.info("Seeded %d personas in %.1fs", personas, time.perf_counter() - started)
+
+
+async def measure(conn: AsyncConnection, persona_ids: List[UUID], label: str) -> None:
+    """Print the plan for the first persona and latency percentiles across all of them"""
+    for name, build in HOT_QUERIES.items():
+        statement = build(persona_ids[0]).compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        plan = await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {statement}"))
+        print(f"\n== {label}: {name}")
+        print("\n".join(row[0] for row in plan))
+
+        timings = []
+        for persona_id in persona_ids:
+            started = time.perf_counter()
+            await conn.execute(build(persona_id))
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+        print(f"-- {label}: {name} p50={statistics.median(timings):.2f}ms p95={p95:.2f}ms over {len(timings)} personas")
+
+
+async def main(args: argparse.Namespace) -> None:
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL,
+        connect_args={"server_settings": {"search_path": BENCHMARK_SCHEMA}},
+    )
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("The benchmark needs Postgres; point DATABASE_URL at a Postgres database")
+
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE"))
+            await conn.execute(text(f"CREATE SCHEMA {BENCHMARK_SCHEMA}"))
+        async with engine.begin() as conn:
+            await seed(conn, args.personas, args.questions_per_persona, args.history_per_persona)
+
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                text("SELECT id FROM personas ORDER BY random() LIMIT :runs"), {"runs": args.runs}
+            )
+            persona_ids = list(result.scalars())
+
+            await measure(conn, persona_ids, "without indexes")
+            for name, definition in INDEXES.items():
+                await conn.execute(text(f"CREATE INDEX {name} ON {definition}"))
+            await conn.execute(text("ANALYZE"))
+            await conn.commit()
+            await measure(conn, persona_ids, "with indexes")
+    finally:
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--personas", type=int, default=1_000_000)
+    parser.add_argument("--questions-per-persona", type=int, default=5)
+    parser.add_argument("--history-per-persona", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--keep", action="store_true", help="keep the seeded schema for manual EXPLAINs")
+    asyncio.run(main(parser.parse_args()))
@@ -1,8 +1,10 @@
 from typing import Annotated
 from fastapi import Depends
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 import os
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,18 +12,83 @@ load_dotenv()
 # Get DB URL from env (works with .env and docker-compose env)
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/cleanfastapi")
 
-engine = create_engine(DATABASE_URL)
+# Connection pool tuning (ignored for SQLite, which manages its own pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# asyncpg prepared statement cache; set to 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+
+def get_async_database_url(url: str) -> str:
+    """Map a sync database URL onto its async driver equivalent (asyncpg / aiosqlite)"""
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", get_async_database_url(DATABASE_URL))
+
+
+def get_engine_options(url: str) -> dict:
+    """Build engine keyword arguments for the given URL from the pool settings"""
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {"statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+engine = create_engine(DATABASE_URL, **get_engine_options(DATABASE_URL))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **get_engine_options(ASYNC_DATABASE_URL))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
+
+def utcnow() -> datetime:
+    """Naive UTC timestamp for DateTime columns (asyncpg rejects aware values for `timestamp without time zone`)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
-        
+
 DbSession = Annotated[Session, Depends(get_db)]
 
+
+def get_async_session_factory() -> async_sessionmaker:
+    """Factory for sessions that outlive the request's own (coalesced flights, prefetches, streams)"""
+    return AsyncSessionLocal
+
+AsyncSessionFactory = Annotated[async_sessionmaker, Depends(get_async_session_factory)]
+
+
+def session_factory_for(session: AsyncSession) -> async_sessionmaker:
+    """Factory for further sessions on the engine ``session`` is bound to"""
+    return async_sessionmaker(bind=session.bind, autoflush=False, expire_on_commit=False)
+
+
+async def get_async_db(session_factory: AsyncSessionFactory):
+    async with session_factory() as db:
+        yield db
+
+AsyncDbSession = Annotated[AsyncSession, Depends(get_async_db)]
@@ -1,3 +1,38 @@
-from fastapi import HTTPException
+from fastapi import HTTPException, status
 
 # Application-specific exceptions can be added here as needed
+
+
+class InvalidAnswerChoiceError(HTTPException):
+    """Raised when a submitted answer is not one of the question's stored choices"""
+
+    def __init__(self, invalid: dict):
+        super().__init__(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={
+                "message": "Answer choices must match the question's choices",
+                "invalid_answers": invalid,
+            },
+        )
+
+
+class ServiceOverloadedError(HTTPException):
+    """Raised when the LLM queue is saturated; clients should retry after ``retry_after`` seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The gift detective is busy, please retry shortly",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class RateLimitExceededError(HTTPException):
+    """Raised when a client or persona has spent its request budget"""
+
+    def __init__(self, retry_after: int, headers: dict):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please slow down",
+            headers={**headers, "Retry-After": str(retry_after)},
+        )
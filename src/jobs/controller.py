@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends, HTTPException
+from uuid import UUID
+from .models import JobResponse
+from .service import JobService, get_job_service
+
+router = APIRouter(
+    tags=["Jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(
+    job_id: UUID,
+    wait: float = 0,
+    service: JobService = Depends(get_job_service),
+):
+    """Return the job; with `wait` (seconds, capped below the proxy timeout) long-poll until it finishes"""
+    job = await service.wait(job_id, wait) if wait > 0 else await service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, DateTime, Text, Integer, Enum, Index
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+import uuid
+import enum
+from ..database.core import Base, utcnow
+
+
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class Job(Base):
+    """Background execution of an LLM-backed request, polled via GET /jobs/{id}"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Workers claim the oldest claimable job
+        Index('ix_jobs_status_created_at', 'status', 'created_at'),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(String, nullable=False)  # Handler name, see jobs/handlers.py
+    payload = Column(JSONB, nullable=False)
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.queued)
+    result = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Job(id='{self.id}', kind='{self.kind}', status='{self.status}')>"
@@ -0,0 +1,30 @@
+"""Job kinds and the service calls that execute them"""
+from typing import Any, Awaitable, Callable, Dict
+from uuid import UUID
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..questions.service import QuestionService
+from ..recommendations.service import RecommendationService
+from ..recommendations.models import RecommendationRequest, RECOMMENDATION_PROMPT_MODE
+
+
+async def run_questions_job(session: AsyncSession, payload: Dict[str, Any]) -> Any:
+    questions = await QuestionService(session).get_questions(UUID(payload["persona_id"]))
+    return jsonable_encoder(questions)
+
+
+async def run_recommendations_job(session: AsyncSession, payload: Dict[str, Any]) -> Any:
+    request = RecommendationRequest(
+        persona_id=payload["persona_id"],
+        max_recommendations=payload["max_recommendations"],
+        include_reasoning=payload["include_reasoning"],
+        prompt_mode=payload.get("prompt_mode", RECOMMENDATION_PROMPT_MODE),
+    )
+    response = await RecommendationService(session).get_recommendations(request, refresh=payload.get("refresh", False))
+    return response.model_dump(mode="json")
+
+
+JOB_HANDLERS: Dict[str, Callable[[AsyncSession, Dict[str, Any]], Awaitable[Any]]] = {
+    "questions": run_questions_job,
+    "recommendations": run_recommendations_job,
+}
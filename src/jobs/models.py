@@ -0,0 +1,20 @@
+from pydantic import BaseModel
+from typing import Any, Optional
+from uuid import UUID
+from datetime import datetime
+from .entity import JobStatus
+
+
+class JobResponse(BaseModel):
+    id: UUID
+    kind: str
+    status: JobStatus
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
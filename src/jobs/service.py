@@ -0,0 +1,88 @@
+"""Job queue for LLM-backed requests
+
+Endpoints that may outlive a proxy timeout enqueue a job and answer
+``202 Accepted``; clients poll ``GET /jobs/{id}`` (optionally long-polling
+with ``wait``) until the job has succeeded or failed.
+"""
+import asyncio
+import os
+from typing import Any, Dict, Optional, Set
+from uuid import UUID
+from sqlalchemy import select
+from ..database.core import AsyncDbSession
+from .entity import Job, JobStatus
+
+
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "0.5"))
+# Upper bound for GET /jobs/{id}?wait=..., kept below the 30s proxy timeout
+JOB_LONG_POLL_MAX_SECONDS = float(os.getenv("JOB_LONG_POLL_MAX_SECONDS", "25"))
+
+FINISHED_STATUSES = (JobStatus.succeeded, JobStatus.failed)
+
+
+class JobNotifier:
+    """Wakes long-polls in this process as soon as a local worker finishes their job
+
+    Jobs finished by another process are picked up by the periodic re-read.
+    """
+
+    def __init__(self):
+        self._waiters: Dict[UUID, Set[asyncio.Event]] = {}
+
+    async def wait(self, job_id: UUID, timeout: float) -> None:
+        event = asyncio.Event()
+        self._waiters.setdefault(job_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(job_id)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[job_id]
+
+    def notify(self, job_id: UUID) -> None:
+        for event in self._waiters.get(job_id, ()):
+            event.set()
+
+
+# Shared notifier for the process
+job_notifier = JobNotifier()
+
+
+class JobService:
+    def __init__(self, session, poll_interval: float = JOB_POLL_INTERVAL_SECONDS, notifier: JobNotifier = job_notifier):
+        self.session = session
+        self.poll_interval = poll_interval
+        self.notifier = notifier
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any]) -> Job:
+        job = Job(kind=kind, payload=payload, status=JobStatus.queued, attempts=0)
+        self.session.add(job)
+        await self.session.commit()
+        return job
+
+    async def get(self, job_id: UUID) -> Optional[Job]:
+        result = await self.session.execute(
+            select(Job).where(Job.id == job_id).execution_options(populate_existing=True)
+        )
+        return result.scalar_one_or_none()
+
+    async def wait(self, job_id: UUID, timeout: float) -> Optional[Job]:
+        """Return the job once it has finished or ``timeout`` seconds have passed"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(timeout, JOB_LONG_POLL_MAX_SECONDS)
+        while True:
+            job = await self.get(job_id)
+            remaining = deadline - loop.time()
+            if job is None or job.status in FINISHED_STATUSES or remaining <= 0:
+                return job
+            # End the read transaction so the next read sees the worker's commit
+            await self.session.rollback()
+            await self.notifier.wait(job_id, min(self.poll_interval, remaining))
+
+
+def get_job_service(session: AsyncDbSession) -> JobService:
+    return JobService(session)
@@ -0,0 +1,168 @@
+"""Worker loop executing queued jobs
+
+Usage:
+    python -m src.jobs.worker [--concurrency 2]
+
+Run at least one dedicated worker next to the API (the ``worker`` service in
+docker-compose.yml). Setting ``JOB_WORKER_ENABLED=true`` embeds workers in
+every API process instead, which suits single-process deployments. Jobs are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` on
+Postgres, so any number of workers can share the table. SQLite has no row
+locks; there the claim is a compare-and-set UPDATE on the job's status.
+Running jobs whose lease expired (crashed worker) are claimed again, or
+failed once they have used up ``JOB_MAX_ATTEMPTS``.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from sqlalchemy import select, update, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from ..database.core import AsyncSessionLocal, utcnow
+from ..llm.executor import run_in_lane, Lane
+from .entity import Job, JobStatus
+from .service import job_notifier, JobNotifier, JOB_POLL_INTERVAL_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_ENABLED = os.getenv("JOB_WORKER_ENABLED", "false").lower() == "true"
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "2"))
+# A running job not finished within the lease is considered abandoned and claimed again
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+Handler = Callable[[AsyncSession, Dict[str, Any]], Awaitable[Any]]
+
+
+class JobWorker:
+    def __init__(
+        self,
+        session_factory: async_sessionmaker = AsyncSessionLocal,
+        handlers: Optional[Dict[str, Handler]] = None,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        poll_interval: float = JOB_POLL_INTERVAL_SECONDS,
+        lease_seconds: int = JOB_LEASE_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        notifier: JobNotifier = job_notifier,
+    ):
+        if handlers is None:
+            from .handlers import JOB_HANDLERS
+            handlers = JOB_HANDLERS
+        self.session_factory = session_factory
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.notifier = notifier
+        self._tasks: List[asyncio.Task] = []
+
+    async def claim(self, session: AsyncSession) -> Optional[Job]:
+        """Mark the oldest claimable job as running and return it, or None
+
+        An idle poll is a single SELECT. Abandoned jobs that used up their
+        attempts are found by the same query and failed on the way.
+        """
+        while True:
+            now = utcnow()
+            claimable = or_(
+                Job.status == JobStatus.queued,
+                and_(Job.status == JobStatus.running, Job.started_at < now - self.lease),
+            )
+            query = (
+                select(Job.id, Job.status, Job.started_at, Job.attempts)
+                .where(claimable)
+                .order_by(Job.created_at)
+                .limit(1)
+            )
+            if session.bind.dialect.name == "postgresql":
+                query = query.with_for_update(skip_locked=True)
+
+            row = (await session.execute(query)).first()
+            if row is None:
+                return None
+
+            exhausted = row.status == JobStatus.running and row.attempts >= self.max_attempts
+            if exhausted:
+                values = dict(status=JobStatus.failed, error="Job lease expired", finished_at=now)
+            else:
+                values = dict(status=JobStatus.running, started_at=now, attempts=Job.attempts + 1)
+
+            # Compare-and-set, so without row locks (SQLite) only one worker wins the job
+            started_at = Job.started_at.is_(None) if row.started_at is None else Job.started_at == row.started_at
+            result = await session.execute(
+                update(Job).where(Job.id == row.id, Job.status == row.status, started_at).values(**values)
+            )
+            await session.commit()
+            if result.rowcount != 1:
+                return None
+            if not exhausted:
+                return await session.get(Job, row.id, populate_existing=True)
+            self.notifier.notify(row.id)
+
+    async def run_once(self) -> bool:
+        """Claim and execute one job; returns False when the queue is empty"""
+        async with self.session_factory() as session:
+            job = await self.claim(session)
+            if job is None:
+                return False
+            job_id, kind, payload = job.id, job.kind, job.payload
+
+        handler = self.handlers.get(kind)
+        values = {}
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {kind}")
+            # The handler gets its own session so a failure cannot leave the job row's session dirty
+            with run_in_lane(Lane.batch):
+                async with self.session_factory() as session:
+                    values["result"] = await handler(session, payload)
+            values["status"] = JobStatus.succeeded
+        except Exception as e:
+            logger.warning("Job %s (%s) failed: %r", job_id, kind, e)
+            values.update(status=JobStatus.failed, error=str(e) or e.__class__.__name__)
+
+        async with self.session_factory() as session:
+            await session.execute(update(Job).where(Job.id == job_id).values(finished_at=utcnow(), **values))
+            await session.commit()
+        self.notifier.notify(job_id)
+        return True
+
+    async def run(self) -> None:
+        """Process jobs until cancelled, sleeping ``poll_interval`` whenever the queue is empty"""
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker iteration failed")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self.run()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+async def main(args: argparse.Namespace) -> None:
+    worker = JobWorker(concurrency=args.concurrency)
+    worker.start()
+    try:
+        await asyncio.gather(*worker._tasks)
+    finally:
+        await worker.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,16 @@
+"""Admission control for routes that call the model
+
+A route depending on ``shed_load(lane)`` answers 503 with ``Retry-After``
+when the executor estimates that a new call in that lane would queue longer
+than the lane's shedding threshold.
+"""
+from ..exceptions import ServiceOverloadedError
+from .executor import llm_executor, Lane
+
+
+def shed_load(lane: Lane):
+    async def check_capacity() -> None:
+        retry_after = llm_executor.retry_after(lane)
+        if retry_after is not None:
+            raise ServiceOverloadedError(retry_after)
+    return check_capacity
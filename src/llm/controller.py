@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from .executor import llm_executor
+from .usage import llm_usage
+from ..messages.cache import history_cache
+
+router = APIRouter(
+    tags=["LLM"],
+)
+
+@router.get("/llm/metrics", response_model=dict)
+async def get_llm_metrics():
+    """Concurrency, queue depth and outcome counters per priority lane, token usage per agent and the history cache counters"""
+    return {**llm_executor.stats(), "usage": llm_usage.stats(), "history_cache": history_cache.stats()}
@@ -0,0 +1,252 @@
+"""Central executor for LLM calls: bounded concurrency, priority lanes and timeouts
+
+Every call to the model provider takes a slot from one process-wide pool.
+When the pool is full, waiting calls are admitted by lane priority
+(interactive questions, then recommendations, then batch work) and in
+arrival order within a lane. Each lane has a time budget that covers both
+queueing and execution.
+
+The executor also tracks recent call latency to estimate how long a new call
+would queue. Routes reject work whose estimated wait exceeds the lane's
+shedding threshold (see ``admission.py``) rather than accept requests that
+would only time out.
+"""
+import asyncio
+import enum
+import heapq
+import itertools
+import math
+import os
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+
+class Lane(enum.IntEnum):
+    """Priority lanes; a lower value is admitted first"""
+    interactive = 0  # A user is waiting on the next questions
+    recommendations = 1
+    batch = 2  # Prefetches and queued jobs
+
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_LANE_TIMEOUTS = {
+    Lane.interactive: float(os.getenv("LLM_TIMEOUT_INTERACTIVE_SECONDS", "30")),
+    Lane.recommendations: float(os.getenv("LLM_TIMEOUT_RECOMMENDATIONS_SECONDS", "60")),
+    Lane.batch: float(os.getenv("LLM_TIMEOUT_BATCH_SECONDS", "180")),
+}
+
+LLM_LOAD_SHEDDING_ENABLED = os.getenv("LLM_LOAD_SHEDDING_ENABLED", "true").lower() == "true"
+# Reject new work once its estimated queue wait exceeds the lane's threshold (defaults to the lane timeout)
+LLM_SHED_WAIT_SECONDS = {
+    lane: float(os.getenv(f"LLM_SHED_WAIT_{lane.name.upper()}_SECONDS", str(timeout)))
+    for lane, timeout in LLM_LANE_TIMEOUTS.items()
+}
+# Weight of the newest call in the moving average of call latency
+LLM_LATENCY_SMOOTHING = float(os.getenv("LLM_LATENCY_SMOOTHING", "0.2"))
+
+# Set by background callers so every LLM call they make runs in their lane
+_lane_override: ContextVar[Optional[Lane]] = ContextVar("llm_lane_override", default=None)
+
+
+@contextmanager
+def run_in_lane(lane: Lane):
+    """Route every LLM call made inside the block to ``lane``"""
+    token = _lane_override.set(lane)
+    try:
+        yield
+    finally:
+        _lane_override.reset(token)
+
+
+class LLMTimeoutError(asyncio.TimeoutError):
+    def __init__(self, lane: Lane, timeout: float):
+        super().__init__(f"LLM call in lane '{lane.name}' exceeded {timeout:g}s")
+        self.lane = lane
+
+
+@dataclass
+class LaneStats:
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    timed_out: int = 0
+    admitted: int = 0
+    shed: int = 0
+    wait_seconds: float = 0.0
+
+
+class LLMExecutor:
+    def __init__(
+        self,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeouts: Optional[Dict[Lane, float]] = None,
+        shed_wait_seconds: Optional[Dict[Lane, float]] = None,
+        load_shedding: bool = LLM_LOAD_SHEDDING_ENABLED,
+        latency_smoothing: float = LLM_LATENCY_SMOOTHING,
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeouts = {**LLM_LANE_TIMEOUTS, **(timeouts or {})}
+        self.shed_wait_seconds = {**LLM_SHED_WAIT_SECONDS, **(shed_wait_seconds or {})}
+        self.load_shedding = load_shedding
+        self.latency_smoothing = latency_smoothing
+        self._latency: Optional[float] = None
+        self._in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._stats = {lane: LaneStats() for lane in Lane}
+
+    @asynccontextmanager
+    async def slot(self, lane: Lane):
+        """Hold a slot of the pool for the block, e.g. around a streamed run
+
+        Only the wait for the slot is bounded by the lane timeout here, as a
+        stream is consumed outside this executor; use ``run`` for plain calls.
+        """
+        lane = _lane_override.get() or lane
+        await self._admit(lane, self.timeouts[lane])
+        stats = self._stats[lane]
+        stats.running += 1
+        started = asyncio.get_running_loop().time()
+        try:
+            yield lane
+        except BaseException:
+            stats.failed += 1
+            raise
+        else:
+            stats.completed += 1
+            self._observe(asyncio.get_running_loop().time() - started)
+        finally:
+            stats.running -= 1
+            self._release()
+
+    async def run(self, lane: Lane, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run ``fn`` in a slot of ``lane``, failing with LLMTimeoutError past the lane's budget"""
+        lane = _lane_override.get() or lane
+        timeout = self.timeouts[lane]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        await self._admit(lane, timeout)
+
+        stats = self._stats[lane]
+        stats.running += 1
+        started = loop.time()
+        try:
+            result = await asyncio.wait_for(fn(), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            stats.timed_out += 1
+            # A timed-out call still says the provider is at least this slow
+            self._observe(loop.time() - started)
+            raise LLMTimeoutError(lane, timeout) from None
+        except BaseException:
+            stats.failed += 1
+            raise
+        finally:
+            stats.running -= 1
+            self._release()
+        stats.completed += 1
+        self._observe(loop.time() - started)
+        return result
+
+    def estimate_wait(self, lane: Lane) -> float:
+        """Seconds a new call in ``lane`` would queue, from the call latency and the callers ahead of it"""
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            return 0.0
+        if self._latency is None:
+            return 0.0
+        # Every caller ahead needs a slot first; slots free up at max_concurrency per call latency
+        ahead = sum(1 for waiter_lane, _, waiter in self._waiters if waiter_lane <= lane and not waiter.done())
+        return (ahead + 1) * self._latency / self.max_concurrency
+
+    def retry_after(self, lane: Lane) -> Optional[int]:
+        """Seconds to tell the client to back off when ``lane`` is saturated, or None to accept the call"""
+        lane = _lane_override.get() or lane
+        if not self.load_shedding:
+            return None
+        wait = self.estimate_wait(lane)
+        if wait <= self.shed_wait_seconds[lane]:
+            return None
+        self._stats[lane].shed += 1
+        return max(1, math.ceil(wait))
+
+    def stats(self) -> Dict:
+        """Pool and per-lane counters, including current queue depth"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "queued": sum(stats.queued for stats in self._stats.values()),
+            "latency_ms": round(self._latency * 1000, 2) if self._latency is not None else None,
+            "load_shedding": self.load_shedding,
+            "lanes": {
+                lane.name: {
+                    "queued": stats.queued,
+                    "running": stats.running,
+                    "completed": stats.completed,
+                    "failed": stats.failed,
+                    "timed_out": stats.timed_out,
+                    "avg_wait_ms": round(stats.wait_seconds / stats.admitted * 1000, 2) if stats.admitted else 0.0,
+                    "shed": stats.shed,
+                    "timeout_seconds": self.timeouts[lane],
+                    "shed_wait_seconds": self.shed_wait_seconds[lane],
+                    "estimated_wait_seconds": round(self.estimate_wait(lane), 3),
+                }
+                for lane, stats in self._stats.items()
+            },
+        }
+
+    def _observe(self, duration: float) -> None:
+        if self._latency is None:
+            self._latency = duration
+        else:
+            self._latency += self.latency_smoothing * (duration - self._latency)
+
+    async def _admit(self, lane: Lane, timeout: float) -> None:
+        stats = self._stats[lane]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await asyncio.wait_for(self._acquire(lane), timeout)
+        except asyncio.TimeoutError:
+            stats.timed_out += 1
+            raise LLMTimeoutError(lane, timeout) from None
+        stats.admitted += 1
+        stats.wait_seconds += loop.time() - started
+
+    async def _acquire(self, lane: Lane) -> None:
+        if self._in_flight < self.max_concurrency and not self._waiters:
+            self._in_flight += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (lane, next(self._order), waiter))
+        stats = self._stats[lane]
+        stats.queued += 1
+        try:
+            await waiter
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as this caller gave up; pass it on
+                self._release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            stats.queued -= 1
+
+    def _release(self) -> None:
+        # Hand the slot straight to the highest-priority live waiter
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+
+# Shared executor for the process
+llm_executor = LLMExecutor()
@@ -0,0 +1,185 @@
+"""Model factory over one shared, keep-alive HTTP connection pool
+
+Agents built from a bare ``"huggingface:..."`` string each get their own
+inference client and HTTP client with library defaults. ``create_model``
+instead routes every agent through ``llm_http_pool``: a single tuned
+``httpx.AsyncClient`` (pool limits, keep-alive, timeouts, optional HTTP/2)
+that is opened at startup and closed on shutdown by the app lifespan, so
+warm TLS connections are reused across calls and agents.
+
+The Hugging Face router reports cached prompt tokens OpenAI-style in
+``usage.prompt_tokens_details.cached_tokens``; ``CacheAwareHuggingFaceModel``
+carries them into ``result.usage.cache_read_tokens``.
+"""
+import logging
+import os
+from typing import Any, AsyncIterable, Optional
+import httpx
+from huggingface_hub import AsyncInferenceClient
+from pydantic_ai.models import ModelRequestParameters, StreamedResponse
+from pydantic_ai.messages import ModelResponse
+from pydantic_ai.models.huggingface import HuggingFaceModel
+from pydantic_ai.providers.huggingface import HuggingFaceProvider
+
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Private to huggingface_hub (tested with 1.18, see requirements.txt)
+    from huggingface_hub.utils._http import async_hf_request_event_hook, async_hf_response_event_hook
+    HF_EVENT_HOOKS = {"request": [async_hf_request_event_hook], "response": [async_hf_response_event_hook]}
+except ImportError:
+    HF_EVENT_HOOKS = None
+
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "deepseek-ai/DeepSeek-V3.1")
+# Inference provider routing; "auto" is the Hugging Face default
+LLM_INFERENCE_PROVIDER = os.getenv("LLM_INFERENCE_PROVIDER", "auto")
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "32"))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "16"))
+LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS", "90"))
+LLM_HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT_SECONDS", "10"))
+# Per-read timeout; streamed responses may take longer in total. Call budgets are enforced by the executor
+LLM_HTTP_READ_TIMEOUT_SECONDS = float(os.getenv("LLM_HTTP_READ_TIMEOUT_SECONDS", "120"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "true").lower() == "true"
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class LLMHttpPool:
+    """Owns the process-wide HTTP client used for every model call"""
+
+    def __init__(
+        self,
+        max_connections: int = LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = LLM_HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        connect_timeout: float = LLM_HTTP_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = LLM_HTTP_READ_TIMEOUT_SECONDS,
+        http2: bool = LLM_HTTP2,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.http2 = http2
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared client, created on first use if the lifespan has not started it"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = self.http2
+        if http2 and not http2_available():
+            logger.warning("LLM_HTTP2 is enabled but the h2 package is missing; using HTTP/1.1")
+            http2 = False
+        return httpx.AsyncClient(
+            limits=self.limits,
+            timeout=self.timeout,
+            http2=http2,
+            transport=self.transport,
+            follow_redirects=True,
+            # Same hooks as huggingface_hub's default client (headers, error details)
+            event_hooks=HF_EVENT_HOOKS,
+        )
+
+    async def start(self) -> None:
+        """Open the client at startup rather than on the first model call"""
+        _ = self.client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Shared pool for the process, opened and closed by the app lifespan
+llm_http_pool = LLMHttpPool()
+
+
+class PooledInferenceClient(AsyncInferenceClient):
+    """Inference client that sends its requests over ``llm_http_pool`` instead of a private client"""
+
+    def __init__(self, *args, pool: LLMHttpPool = llm_http_pool, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+
+    async def _get_async_client(self) -> httpx.AsyncClient:
+        # Not entered into the client's exit stack: the pool outlives any single client
+        return self.pool.client
+
+
+def pooled_client_supported(client_class: type = AsyncInferenceClient) -> bool:
+    """Whether the installed huggingface_hub still has the private internals the pool relies on"""
+    return HF_EVENT_HOOKS is not None and callable(getattr(client_class, "_get_async_client", None))
+
+
+POOLED_CLIENT_SUPPORTED = pooled_client_supported()
+if not POOLED_CLIENT_SUPPORTED:
+    logger.warning(
+        "This huggingface_hub version lacks the internals llm_http_pool hooks into; "
+        "model calls use the library's default HTTP client"
+    )
+
+
+def cached_prompt_tokens(response: Any) -> int:
+    """Cached prompt tokens reported in a chat completion (or chunk) usage, 0 when absent"""
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None) if usage is not None else None
+    if isinstance(details, dict):
+        return details.get("cached_tokens") or 0
+    return getattr(details, "cached_tokens", None) or 0
+
+
+class CacheAwareHuggingFaceModel(HuggingFaceModel):
+    """HuggingFaceModel that keeps the cached prompt token count the base mapping drops"""
+
+    def _process_response(self, response) -> ModelResponse:
+        model_response = super()._process_response(response)
+        model_response.usage.cache_read_tokens += cached_prompt_tokens(response)
+        return model_response
+
+    async def _process_streamed_response(
+        self, response: AsyncIterable[Any], model_request_parameters: ModelRequestParameters
+    ) -> StreamedResponse:
+        streamed: Optional[StreamedResponse] = None
+        early = 0  # Seen while the base class peeks at the first chunk, before the response exists
+
+        async def counted():
+            nonlocal early
+            async for chunk in response:
+                cached = cached_prompt_tokens(chunk)
+                if streamed is None:
+                    early += cached
+                else:
+                    streamed._usage.cache_read_tokens += cached
+                yield chunk
+
+        streamed = await super()._process_streamed_response(counted(), model_request_parameters)
+        streamed._usage.cache_read_tokens += early
+        return streamed
+
+
+def create_model(model_name: str = LLM_MODEL_NAME, pool: LLMHttpPool = llm_http_pool) -> HuggingFaceModel:
+    """Hugging Face chat model whose requests share the process-wide connection pool"""
+    api_key = os.getenv("HF_TOKEN")
+    # An explicit provider lets the model resolve its base URL for response metadata
+    if POOLED_CLIENT_SUPPORTED:
+        client = PooledInferenceClient(api_key=api_key, provider=LLM_INFERENCE_PROVIDER, pool=pool)
+    else:
+        client = AsyncInferenceClient(api_key=api_key, provider=LLM_INFERENCE_PROVIDER)
+    provider = HuggingFaceProvider(hf_client=client, api_key=api_key)
+    return CacheAwareHuggingFaceModel(model_name, provider=provider)
@@ -0,0 +1,67 @@
+"""Token usage per agent, split into cached and uncached input tokens
+
+Agents record ``result.usage`` after every run. The cached share shows
+whether provider-side prompt prefix caching is hitting: the static
+instructions come first in every request, so repeat calls should report
+them as cache reads. Totals are exposed at ``GET /llm/metrics``.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Dict
+from pydantic_ai.usage import RunUsage
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AgentUsage:
+    runs: int = 0
+    requests: int = 0
+    input_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    output_tokens: int = 0
+
+
+class UsageRecorder:
+    def __init__(self):
+        self._agents: Dict[str, AgentUsage] = {}
+
+    def record(self, agent: str, usage: RunUsage) -> None:
+        if not isinstance(usage, RunUsage):
+            return  # Results without usage accounting (e.g. stand-in results)
+        totals = self._agents.setdefault(agent, AgentUsage())
+        totals.runs += 1
+        totals.requests += usage.requests
+        totals.input_tokens += usage.input_tokens
+        totals.cache_read_tokens += usage.cache_read_tokens
+        totals.cache_write_tokens += usage.cache_write_tokens
+        totals.output_tokens += usage.output_tokens
+        logger.debug(
+            "%s usage: input=%d cached=%d uncached=%d output=%d",
+            agent, usage.input_tokens, usage.cache_read_tokens,
+            usage.input_tokens - usage.cache_read_tokens, usage.output_tokens,
+        )
+
+    def stats(self) -> Dict:
+        return {
+            agent: {
+                "runs": totals.runs,
+                "requests": totals.requests,
+                "input_tokens": totals.input_tokens,
+                "cached_input_tokens": totals.cache_read_tokens,
+                "uncached_input_tokens": totals.input_tokens - totals.cache_read_tokens,
+                "cache_write_tokens": totals.cache_write_tokens,
+                "output_tokens": totals.output_tokens,
+                "cached_ratio": round(totals.cache_read_tokens / totals.input_tokens, 3) if totals.input_tokens else 0.0,
+            }
+            for agent, totals in self._agents.items()
+        }
+
+    def reset(self) -> None:
+        self._agents.clear()
+
+
+# Shared recorder for the process
+llm_usage = UsageRecorder()
@@ -1,16 +1,41 @@
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 import os
-from .database.core import engine, Base
+from .database.core import engine, async_engine, Base
 from .build_persona.entity import Persona # Import models to register them
-from .questions.entity import Question, Answer # Import models to register them
+from .questions.entity import Question, Answer, QuestionSetCache # Import models to register them
 from .messages.entity import MessageHistory # Import models to register them
+from .recommendations.entity import RecommendationCache, SharedRecommendationCache, RecommendationBatch # Import models to register them
+from .jobs.entity import Job # Import models to register them
+from .jobs.worker import JobWorker, JOB_WORKER_ENABLED
 from .api import register_routes
+from .rate_limiter import limiter, RateLimitHeadersMiddleware
+from .llm.provider import llm_http_pool
 from .logging import configure_logging, LogLevels
 
 
 configure_logging(LogLevels.info)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One keep-alive connection pool for every model call
+    await llm_http_pool.start()
+    # Embedded worker for queued jobs (run `python -m src.jobs.worker` for dedicated workers)
+    worker = JobWorker() if JOB_WORKER_ENABLED else None
+    if worker is not None:
+        worker.start()
+    yield
+    if worker is not None:
+        await worker.stop()
+    await limiter.close()
+    await llm_http_pool.aclose()
+    # Release pooled connections on shutdown
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RateLimitHeadersMiddleware)
 
 # Create tables only when explicitly enabled to avoid DB connection issues during tests
 if os.getenv("ENABLE_DB_INIT", "false").lower() == "true":
@@ -0,0 +1,103 @@
+"""Re-encode stored message history blobs with the configured codec
+
+Usage:
+    python -m src.messages.backfill [--codec zstd] [--train-dict PATH] [--batch-size 500]
+
+With ``--train-dict`` a zstd dictionary is first trained on a sample of the
+existing histories and written to PATH; point ``MESSAGE_CODEC_ZSTD_DICT`` at
+it so the app encodes with the new dictionary. A dictionary already at PATH
+is kept next to it as ``<name>.<dict_id>.zdict`` so rows and processes that
+still reference it by id keep decoding.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from typing import Optional
+from sqlalchemy import select
+from ..database.core import AsyncSessionLocal
+from ..build_persona.entity import Persona  # Import models to register them
+from .entity import MessageHistory
+from .codec import ZstdCodec, create_codec, decode_messages, load_zstd_dictionaries, MESSAGE_CODEC
+
+
+logger = logging.getLogger(__name__)
+
+
+async def train_zstd_dictionary(path: str, sample_size: int = 2000, dict_size: int = 112_640) -> bytes:
+    """Train a zstd dictionary on a sample of stored histories and write it to ``path``"""
+    import zstandard
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(MessageHistory.messages_json).limit(sample_size))
+        samples = [decode_messages(blob) for blob in result.scalars()]
+
+    dictionary = zstandard.train_dictionary(dict_size, samples).as_bytes()
+    if os.path.exists(path):
+        previous = archived_dictionary_path(path)
+        os.replace(path, previous)
+        logger.info("Kept previous zstd dictionary as %s", previous)
+    with open(path, "wb") as f:
+        f.write(dictionary)
+    logger.info("Trained zstd dictionary on %d samples -> %s", len(samples), path)
+    return dictionary
+
+
+def archived_dictionary_path(path: str) -> str:
+    """Where the dictionary currently at ``path`` is kept once a new one replaces it"""
+    import zstandard
+
+    with open(path, "rb") as f:
+        dict_id = zstandard.ZstdCompressionDict(f.read()).dict_id()
+    root, _ = os.path.splitext(path)
+    return f"{root}.{dict_id}.zdict"
+
+
+async def backfill(codec_name: str = MESSAGE_CODEC, batch_size: int = 500, dictionary: Optional[bytes] = None) -> int:
+    """Re-encode every row not already written with ``codec_name``; returns the number of rows updated"""
+    if codec_name == "zstd" and dictionary:
+        codec = ZstdCodec(dictionary=dictionary, dictionaries=load_zstd_dictionaries)
+    else:
+        codec = create_codec(codec_name)
+    updated = 0
+    last_id = None
+
+    async with AsyncSessionLocal() as session:
+        while True:
+            query = select(MessageHistory).order_by(MessageHistory.id).limit(batch_size)
+            if last_id is not None:
+                query = query.where(MessageHistory.id > last_id)
+            rows = (await session.execute(query)).scalars().all()
+            if not rows:
+                break
+
+            for row in rows:
+                blob = row.messages_json
+                # zstd rows written with an older dictionary are re-encoded too
+                if codec.is_current(blob):
+                    continue
+                row.messages_json = codec.encode(decode_messages(blob))
+                updated += 1
+
+            await session.commit()
+            last_id = rows[-1].id
+            logger.info("Re-encoded %d message history rows so far", updated)
+
+    return updated
+
+
+async def main(args: argparse.Namespace) -> None:
+    dictionary = None
+    if args.train_dict:
+        dictionary = await train_zstd_dictionary(args.train_dict)
+    updated = await backfill(args.codec, args.batch_size, dictionary)
+    logger.info("Backfill complete: %d rows re-encoded with %s", updated, args.codec)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codec", default=MESSAGE_CODEC, choices=["raw", "zlib", "zstd"])
+    parser.add_argument("--train-dict", metavar="PATH", help="train a zstd dictionary and write it to PATH")
+    parser.add_argument("--batch-size", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
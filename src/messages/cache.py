@@ -0,0 +1,103 @@
+"""In-process LRU cache of parsed message histories"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from uuid import UUID
+from pydantic_ai import ModelMessage, ModelMessagesTypeAdapter
+
+
+MESSAGE_HISTORY_CACHE_MAX_ENTRIES = int(os.getenv("MESSAGE_HISTORY_CACHE_MAX_ENTRIES", "1024"))
+MESSAGE_HISTORY_CACHE_MAX_BYTES = int(os.getenv("MESSAGE_HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+@dataclass
+class _CacheEntry:
+    version: int
+    messages: List[ModelMessage]
+    size: int  # Approximate size, measured as the serialized JSON length
+
+
+class HistoryCache:
+    """Bounded LRU of parsed ``List[ModelMessage]`` keyed by persona id and history version
+
+    One entry is kept per persona; a lookup with a different version than the
+    cached one is a miss. Entries are evicted least-recently-used first when
+    either the entry count or the approximate byte size exceeds its bound.
+    """
+
+    def __init__(self, max_entries: int = MESSAGE_HISTORY_CACHE_MAX_ENTRIES, max_bytes: int = MESSAGE_HISTORY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[UUID, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, persona_id: UUID, version: int) -> Optional[List[ModelMessage]]:
+        """Return a copy of the cached history if it matches ``version``"""
+        with self._lock:
+            entry = self._entries.get(persona_id)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(persona_id)
+            self.hits += 1
+            return list(entry.messages)
+
+    def put(self, persona_id: UUID, version: int, messages: List[ModelMessage], size: int) -> None:
+        """Cache the history of a persona at ``version``, replacing any older entry"""
+        if self.max_entries <= 0 or size > self.max_bytes:
+            self.invalidate(persona_id)
+            return
+        with self._lock:
+            self._remove(persona_id)
+            self._entries[persona_id] = _CacheEntry(version, list(messages), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+
+    def append(self, persona_id: UUID, previous_version: int, version: int, messages_json: bytes) -> None:
+        """Extend a cached history with a newly stored batch, or drop it if it is not at ``previous_version``"""
+        with self._lock:
+            entry = self._entries.get(persona_id)
+        if entry is None or entry.version != previous_version:
+            self.invalidate(persona_id)
+            return
+        batch = ModelMessagesTypeAdapter.validate_json(messages_json)
+        self.put(persona_id, version, entry.messages + batch, entry.size + len(messages_json))
+
+    def invalidate(self, persona_id: UUID) -> None:
+        """Drop the cached history of a persona"""
+        with self._lock:
+            self._remove(persona_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counters and current occupancy"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _remove(self, persona_id: UUID) -> None:
+        entry = self._entries.pop(persona_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+
+# Shared cache instance for the process
+history_cache = HistoryCache()
@@ -0,0 +1,167 @@
+"""Binary codecs for stored message history blobs
+
+Encoded blobs start with a one-byte header naming the codec. Rows written
+before compression was introduced hold raw JSON (which always starts with
+``[``) and are still decoded as-is.
+
+zstd frames record the id of the dictionary they were compressed with.
+Retraining writes a new dictionary and keeps the old ones as ``*.zdict``
+files in the same directory, so every row stays decodable by id; a
+process that meets an id it has not loaded rescans that directory once.
+"""
+import glob
+import os
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", "zlib")
+MESSAGE_CODEC_LEVEL = int(os.getenv("MESSAGE_CODEC_LEVEL", "6"))
+# Optional zstd dictionary trained on existing histories (see ``python -m src.messages.backfill``);
+# older dictionaries are kept as *.zdict files in the same directory for decoding
+MESSAGE_CODEC_ZSTD_DICT = os.getenv("MESSAGE_CODEC_ZSTD_DICT")
+
+HEADER_ZLIB = 0x01
+HEADER_ZSTD = 0x02
+
+
+class MessageCodec:
+    """Encodes serialized message JSON for storage and decodes it back"""
+    name = "raw"
+    header: Optional[int] = None
+
+    def encode(self, data: bytes) -> bytes:
+        return data
+
+    def decode(self, payload: bytes) -> bytes:
+        return payload
+
+    def is_current(self, blob: bytes) -> bool:
+        """Whether ``blob`` is already encoded exactly as this codec would encode it"""
+        return self.header is not None and blob[:1] == bytes([self.header])
+
+
+class ZlibCodec(MessageCodec):
+    name = "zlib"
+    header = HEADER_ZLIB
+
+    def __init__(self, level: int = MESSAGE_CODEC_LEVEL):
+        self.level = level
+
+    def encode(self, data: bytes) -> bytes:
+        return bytes([self.header]) + zlib.compress(data, self.level)
+
+    def decode(self, payload: bytes) -> bytes:
+        return zlib.decompress(payload)
+
+
+class ZstdCodec(MessageCodec):
+    """zstd codec, optionally primed with a dictionary trained on past histories
+
+    The prompts repeated in every persona's history compress far better with
+    a shared dictionary. Frames carry the dictionary id; ``dictionaries``
+    returns every dictionary that may still be referenced and is consulted
+    again when an unknown id is met. Requires the optional ``zstandard`` package.
+    """
+    name = "zstd"
+    header = HEADER_ZSTD
+
+    def __init__(
+        self,
+        level: int = MESSAGE_CODEC_LEVEL,
+        dictionary: Optional[bytes] = None,
+        dictionaries: Callable[[], Iterable[bytes]] = lambda: (),
+    ):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise RuntimeError("The zstd message codec requires the 'zstandard' package") from e
+
+        self._zstandard = zstandard
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        self.dict_id = dict_data.dict_id() if dict_data else 0
+        self._compressor = zstandard.ZstdCompressor(level=level, dict_data=dict_data, write_dict_id=True)
+        self._dictionaries = dictionaries
+        self._decompressors: Dict[int, "zstandard.ZstdDecompressor"] = {0: zstandard.ZstdDecompressor()}
+        if dict_data:
+            self._decompressors[self.dict_id] = zstandard.ZstdDecompressor(dict_data=dict_data)
+        self._load_dictionaries()
+
+    def encode(self, data: bytes) -> bytes:
+        return bytes([self.header]) + self._compressor.compress(data)
+
+    def decode(self, payload: bytes) -> bytes:
+        dict_id = self.frame_dict_id(payload)
+        if dict_id not in self._decompressors:
+            # Possibly retrained since this process started
+            self._load_dictionaries()
+        if dict_id not in self._decompressors:
+            raise ValueError(
+                f"Message history blob was compressed with unknown zstd dictionary id {dict_id}; "
+                "keep every previous dictionary as a *.zdict file next to MESSAGE_CODEC_ZSTD_DICT"
+            )
+        return self._decompressors[dict_id].decompress(payload)
+
+    def frame_dict_id(self, payload: bytes) -> int:
+        return self._zstandard.get_frame_parameters(payload).dict_id
+
+    def is_current(self, blob: bytes) -> bool:
+        return super().is_current(blob) and self.frame_dict_id(blob[1:]) == self.dict_id
+
+    def _load_dictionaries(self) -> None:
+        for dictionary in self._dictionaries():
+            dict_data = self._zstandard.ZstdCompressionDict(dictionary)
+            self._decompressors.setdefault(dict_data.dict_id(), self._zstandard.ZstdDecompressor(dict_data=dict_data))
+
+
+def load_zstd_dictionary(path: Optional[str] = MESSAGE_CODEC_ZSTD_DICT) -> Optional[bytes]:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def zstd_dictionary_paths(path: Optional[str] = MESSAGE_CODEC_ZSTD_DICT) -> List[str]:
+    """The current dictionary plus the previous ones kept next to it"""
+    if not path:
+        return []
+    paths = sorted(glob.glob(os.path.join(os.path.dirname(path) or ".", "*.zdict")))
+    return [path] + [other for other in paths if os.path.abspath(other) != os.path.abspath(path)]
+
+
+def load_zstd_dictionaries(path: Optional[str] = MESSAGE_CODEC_ZSTD_DICT) -> List[bytes]:
+    return [data for data in map(load_zstd_dictionary, zstd_dictionary_paths(path)) if data]
+
+
+def create_codec(name: str) -> MessageCodec:
+    """Build a codec by name ("raw", "zlib" or "zstd")"""
+    if name == "raw":
+        return MessageCodec()
+    if name == "zlib":
+        return ZlibCodec()
+    if name == "zstd":
+        return ZstdCodec(dictionary=load_zstd_dictionary(), dictionaries=load_zstd_dictionaries)
+    raise ValueError(f"Unknown message codec: {name}")
+
+
+_codecs: Dict[str, MessageCodec] = {}
+
+
+def get_codec(name: str = MESSAGE_CODEC) -> MessageCodec:
+    """Return the shared codec instance for ``name``"""
+    if name not in _codecs:
+        _codecs[name] = create_codec(name)
+    return _codecs[name]
+
+
+def decode_messages(blob: bytes) -> bytes:
+    """Decode a stored blob into message JSON, whatever codec it was written with"""
+    if not blob:
+        return blob
+    header = blob[0]
+    if header == HEADER_ZLIB:
+        return get_codec("zlib").decode(blob[1:])
+    if header == HEADER_ZSTD:
+        return get_codec("zstd").decode(blob[1:])
+    # Legacy rows hold the raw JSON
+    return blob
@@ -1,18 +1,25 @@
-from sqlalchemy import Column, DateTime, ForeignKey, LargeBinary
+from sqlalchemy import Column, DateTime, ForeignKey, LargeBinary, Integer, Boolean, Index, UniqueConstraint
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
-from datetime import datetime, timezone
-from ..database.core import Base
+from ..database.core import Base, utcnow
 
 
 class MessageHistory(Base):
     """Store raw Pydantic AI message history for each persona"""
     __tablename__ = 'message_history'
+    __table_args__ = (
+        # History loads and version checks filter by persona and order by sequence
+        Index('ix_message_history_persona_id_sequence', 'persona_id', 'sequence', 'created_at'),
+        # One row per version: concurrent writers or compactions must not share a sequence
+        UniqueConstraint('persona_id', 'sequence', name='uq_message_history_persona_id_sequence'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     persona_id = Column(UUID(as_uuid=True), ForeignKey('personas.id'), nullable=False)
     messages_json = Column(LargeBinary, nullable=False)  # Stores serialized messages
-    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    sequence = Column(Integer, nullable=False, default=0)  # Per-persona batch number, used as history version
+    is_snapshot = Column(Boolean, nullable=False, default=False)  # Folds every batch up to and including `sequence`
+    created_at = Column(DateTime, nullable=False, default=utcnow)
 
     def __repr__(self):
-        return f"<MessageHistory(persona_id='{self.persona_id}')>"
+        return f"<MessageHistory(persona_id='{self.persona_id}', sequence={self.sequence})>"
@@ -1,47 +1,203 @@
 """Repository for managing message history persistence"""
+import os
 from uuid import UUID
-from typing import List
-from sqlalchemy.orm import Session
+from typing import List, Optional, Tuple
+from sqlalchemy import select, delete, func, or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic_ai import ModelMessage, ModelMessagesTypeAdapter
+from ..build_persona.entity import Persona
 from .entity import MessageHistory
+from .cache import HistoryCache, history_cache
+from .codec import MessageCodec, get_codec, decode_messages
+
+
+# Fold the history into a snapshot once this many batches follow the last one (0 disables compaction)
+MESSAGE_HISTORY_COMPACT_AFTER = int(os.getenv("MESSAGE_HISTORY_COMPACT_AFTER", "4"))
 
 
 class MessageRepository:
-    """Handles storage and retrieval of Pydantic AI message history"""
-    
-    def __init__(self, session: Session):
+    """Handles storage and retrieval of Pydantic AI message history
+
+    Every stored batch gets the next per-persona ``sequence`` number, taken
+    under a row lock on the persona so concurrent writers (a prefetch racing
+    a GET, several workers) get distinct numbers; a unique constraint backs
+    this up where the lock is not available. When
+    compaction is enabled, batches are periodically folded into a single
+    snapshot row so a load reads at most one snapshot plus a short tail.
+    Parsed histories are kept in an in-process LRU keyed by that version.
+    Blobs are written with the configured codec; any codec can be read back.
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        compact_after: int = MESSAGE_HISTORY_COMPACT_AFTER,
+        cache: Optional[HistoryCache] = history_cache,
+        codec: Optional[MessageCodec] = None,
+    ):
         self.session = session
-    
-    async def store_messages(self, persona_id: UUID, messages_json: bytes) -> None:
-        """Store new messages for a persona"""
+        self.compact_after = compact_after
+        self.cache = cache
+        self.codec = codec or get_codec()
+        # Stored batches whose cache update and compaction wait for the transaction to commit
+        self._pending: List[Tuple[UUID, int, bytes, bool]] = []
+
+    async def store_messages(self, persona_id: UUID, messages_json: bytes, commit: bool = True, retry: bool = True) -> int:
+        """Store new messages for a persona and return the new history version
+
+        With ``commit=False`` the batch joins the caller's transaction; call
+        ``commit()`` on the repository to commit it together with other rows.
+        A committed batch whose sequence was taken concurrently is retried once.
+        """
+        await self._lock_persona(persona_id)
+        version, snapshot_sequence = await self._get_sequences(persona_id)
         message_history = MessageHistory(
             persona_id=persona_id,
-            messages_json=messages_json
+            messages_json=self.codec.encode(messages_json),
+            sequence=version + 1,
         )
         self.session.add(message_history)
-        self.session.commit()
-    
+
+        tail_length = version + 1 - (snapshot_sequence or 0)
+        needs_compaction = bool(self.compact_after) and tail_length >= self.compact_after
+        self._pending.append((persona_id, version, messages_json, needs_compaction))
+
+        if commit:
+            try:
+                await self.commit()
+            except IntegrityError:
+                await self.session.rollback()
+                self._pending.clear()
+                if not retry:
+                    raise
+                return await self.store_messages(persona_id, messages_json, retry=False)
+
+        return version + 1
+
+    async def commit(self) -> None:
+        """Commit the session, then bring the cache in step and compact where due"""
+        await self.session.commit()
+
+        pending, self._pending = self._pending, []
+        for persona_id, version, messages_json, needs_compaction in pending:
+            if self.cache is not None:
+                self.cache.append(persona_id, version, version + 1, messages_json)
+            if needs_compaction:
+                await self.compact_history(persona_id)
+
     async def load_all_messages(self, persona_id: UUID) -> List[ModelMessage]:
-        """Load all message history for a persona"""
-        records = self.session.query(MessageHistory).filter(
-            MessageHistory.persona_id == persona_id
-        ).order_by(MessageHistory.created_at).all()
-        
+        """Load all message history for a persona (latest snapshot plus the batches after it)"""
+        if self.cache is not None:
+            cached = self.cache.get(persona_id, await self.get_history_version(persona_id))
+            if cached is not None:
+                return cached
+
+        snapshot_sequence = (
+            select(func.max(MessageHistory.sequence))
+            .where(MessageHistory.persona_id == persona_id, MessageHistory.is_snapshot.is_(True))
+            .scalar_subquery()
+        )
+        result = await self.session.execute(
+            select(MessageHistory.messages_json, MessageHistory.sequence)
+            .where(
+                MessageHistory.persona_id == persona_id,
+                or_(
+                    snapshot_sequence.is_(None),
+                    MessageHistory.sequence > snapshot_sequence,
+                    and_(MessageHistory.is_snapshot.is_(True), MessageHistory.sequence == snapshot_sequence),
+                ),
+            )
+            .order_by(MessageHistory.sequence, MessageHistory.created_at)
+        )
+
         messages: List[ModelMessage] = []
-        for record in records:
+        version = size = 0
+        for blob, sequence in result:
             # Deserialize each batch of messages
-            batch = ModelMessagesTypeAdapter.validate_json(record.messages_json)
+            messages_json = decode_messages(blob)
+            batch = ModelMessagesTypeAdapter.validate_json(messages_json)
             messages.extend(batch)
-        
+            version = max(version, sequence)
+            size += len(messages_json)
+
+        if self.cache is not None:
+            self.cache.put(persona_id, version, messages, size)
+
         return messages
-    
+
+    async def get_history_version(self, persona_id: UUID) -> int:
+        """Return the sequence number of the latest stored batch (0 when there is no history)"""
+        version, _ = await self._get_sequences(persona_id)
+        return version
+
+    async def compact_history(self, persona_id: UUID) -> None:
+        """Fold the snapshot and all batches after it into a single new snapshot row"""
+        await self._lock_persona(persona_id)
+        version, snapshot_sequence = await self._get_sequences(persona_id)
+        if not version or snapshot_sequence == version:
+            # Nothing stored, or another compaction already folded everything
+            await self.session.commit()
+            return
+
+        messages = await self.load_all_messages(persona_id)
+        await self.session.execute(
+            delete(MessageHistory).where(
+                MessageHistory.persona_id == persona_id,
+                MessageHistory.sequence <= version,
+            )
+        )
+        self.session.add(MessageHistory(
+            persona_id=persona_id,
+            messages_json=self.codec.encode(ModelMessagesTypeAdapter.dump_json(messages)),
+            sequence=version,
+            is_snapshot=True,
+        ))
+        try:
+            await self.session.commit()
+        except IntegrityError:
+            # A concurrent compaction wrote the same snapshot first
+            await self.session.rollback()
+
     async def clear_history(self, persona_id: UUID) -> None:
-        """Clear all message history for a persona"""
-        self.session.query(MessageHistory).filter(
-            MessageHistory.persona_id == persona_id
-        ).delete()
-        self.session.commit()
+        """Clear all message history for a persona
+
+        The rows are replaced by an empty snapshot at the next sequence, so
+        versions keep increasing and no cache entry for an earlier version
+        (in this or another worker) can match again.
+        """
+        await self._lock_persona(persona_id)
+        version, _ = await self._get_sequences(persona_id)
+        await self.session.execute(
+            delete(MessageHistory).where(MessageHistory.persona_id == persona_id)
+        )
+        if version:
+            self.session.add(MessageHistory(
+                persona_id=persona_id,
+                messages_json=self.codec.encode(ModelMessagesTypeAdapter.dump_json([])),
+                sequence=version + 1,
+                is_snapshot=True,
+            ))
+        await self.session.commit()
+
+        if self.cache is not None:
+            self.cache.invalidate(persona_id)
+
+    async def _lock_persona(self, persona_id: UUID) -> None:
+        """Serialize history writers per persona until the transaction ends (a no-op on SQLite)"""
+        await self.session.execute(select(Persona.id).where(Persona.id == persona_id).with_for_update())
+
+    async def _get_sequences(self, persona_id: UUID) -> Tuple[int, Optional[int]]:
+        """Return (latest sequence, latest snapshot sequence) for a persona"""
+        result = await self.session.execute(
+            select(
+                func.coalesce(func.max(MessageHistory.sequence), 0),
+                func.max(MessageHistory.sequence).filter(MessageHistory.is_snapshot.is_(True)),
+            ).where(MessageHistory.persona_id == persona_id)
+        )
+        version, snapshot_sequence = result.one()
+        return version, snapshot_sequence
 
 
-def get_message_repository(session: Session) -> MessageRepository:
+def get_message_repository(session: AsyncSession) -> MessageRepository:
     return MessageRepository(session)
@@ -0,0 +1,146 @@
+"""Fit a persona's message history into a prompt token budget
+
+The stored history grows with every question round. Before it is sent to a
+model, ``shape_history`` keeps the initial profile turn and the most recent
+rounds verbatim and condenses the answers of older rounds into one compact
+summary message. Questions a condensed round asked but that have no answer
+yet are listed in the summary too, so the model neither loses nor repeats
+them. Storage is untouched; only the prompt is shaped.
+
+A turn starts at each user prompt and runs until the next one, so a tool call
+always stays together with its tool return. A round starts at every turn in
+which the detective asked questions (a tool call) and includes the answer
+turns that follow it. Tokens are estimated at roughly four characters each.
+"""
+import os
+from typing import List, Optional, Tuple
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, UserPromptPart, TextPart, ToolCallPart, ToolReturnPart
+
+
+# Approximate prompt tokens the history may use (0 sends the full history)
+MESSAGE_HISTORY_TOKEN_BUDGET = int(os.getenv("MESSAGE_HISTORY_TOKEN_BUDGET", "4000"))
+# Rounds always sent verbatim, even when they alone exceed the budget
+MESSAGE_HISTORY_MIN_RECENT_ROUNDS = int(os.getenv("MESSAGE_HISTORY_MIN_RECENT_ROUNDS", "1"))
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "Summary of earlier answers (older rounds condensed, most recent rounds follow verbatim):"
+UNANSWERED = "(not answered yet)"
+
+Turn = List[ModelMessage]
+
+
+def estimate_tokens(messages: List[ModelMessage]) -> int:
+    chars = 0
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, ToolCallPart):
+                chars += len(part.tool_name) + len(part.args_as_json_str())
+            else:
+                content = getattr(part, "content", "")
+                chars += len(content) if isinstance(content, str) else len(str(content))
+    return chars // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS * len(messages)
+
+
+def _starts_turn(message: ModelMessage) -> bool:
+    return (
+        isinstance(message, ModelRequest)
+        and any(isinstance(part, UserPromptPart) for part in message.parts)
+        and not any(isinstance(part, ToolReturnPart) for part in message.parts)
+    )
+
+
+def split_turns(messages: List[ModelMessage]) -> List[Turn]:
+    turns: List[Turn] = []
+    for message in messages:
+        if not turns or _starts_turn(message):
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _asks_questions(turn: Turn) -> bool:
+    return any(
+        isinstance(message, ModelResponse) and any(isinstance(part, ToolCallPart) for part in message.parts)
+        for message in turn
+    )
+
+
+def split_rounds(turns: List[Turn]) -> List[List[Turn]]:
+    rounds: List[List[Turn]] = []
+    for turn in turns:
+        if not rounds or _asks_questions(turn):
+            rounds.append([])
+        rounds[-1].append(turn)
+    return rounds
+
+
+def answer_pair(turn: Turn) -> Optional[Tuple[str, str]]:
+    """(question, answer) of an answer turn as stored by submit_bulk_answers, else None"""
+    if _asks_questions(turn):
+        return None
+    question = next((p.content for m in turn if isinstance(m, ModelRequest) for p in m.parts if isinstance(p, UserPromptPart)), None)
+    answer = next((p.content for m in turn if isinstance(m, ModelResponse) for p in m.parts if isinstance(p, TextPart)), None)
+    if not isinstance(question, str) or answer is None:
+        return None
+    return question, answer
+
+
+def asked_questions(turn: Turn) -> List[str]:
+    """Questions the detective asked through the output tool call of ``turn``"""
+    questions = []
+    for message in turn:
+        if not isinstance(message, ModelResponse):
+            continue
+        for part in message.parts:
+            if isinstance(part, ToolCallPart):
+                items = part.args_as_dict().get("questions") or []
+                questions += [item["question"] for item in items if isinstance(item, dict) and isinstance(item.get("question"), str)]
+    return questions
+
+
+def summarize_turns(turns: List[Turn]) -> Optional[ModelRequest]:
+    """One user message listing the question/answer pairs of ``turns`` and the questions still unanswered"""
+    pairs = [pair for pair in map(answer_pair, turns) if pair is not None]
+    answered = {question for question, _ in pairs}
+    lines = []
+    for turn in turns:
+        pair = answer_pair(turn)
+        if pair is not None:
+            lines.append(f"- {pair[0]} -> {pair[1]}")
+        lines += [f"- {question} -> {UNANSWERED}" for question in asked_questions(turn) if question not in answered]
+    if not lines:
+        return None
+    return ModelRequest(parts=[UserPromptPart(content="\n".join([SUMMARY_HEADER] + lines))])
+
+
+def shape_history(
+    messages: List[ModelMessage],
+    budget: int = MESSAGE_HISTORY_TOKEN_BUDGET,
+    min_recent_rounds: int = MESSAGE_HISTORY_MIN_RECENT_ROUNDS,
+) -> List[ModelMessage]:
+    """Return a prompt-ready history within ``budget`` tokens where possible; ``messages`` is not modified"""
+    if not budget or not messages or estimate_tokens(messages) <= budget:
+        return messages
+
+    turns = split_turns(messages)
+    head, rounds = turns[0], split_rounds(turns[1:])
+
+    # Condense the oldest remaining round until the result fits, keeping at least min_recent_rounds
+    shaped, kept = messages, len(rounds)
+    while kept > min_recent_rounds and estimate_tokens(shaped) > budget:
+        kept -= 1
+        shaped = _assemble(head, rounds[:len(rounds) - kept], rounds[len(rounds) - kept:])
+    return shaped
+
+
+def _assemble(head: Turn, condensed: List[List[Turn]], verbatim: List[List[Turn]]) -> List[ModelMessage]:
+    shaped = list(head)
+    summary = summarize_turns([turn for round_ in condensed for turn in round_])
+    if summary is not None:
+        shaped.append(summary)
+    for round_ in verbatim:
+        for turn in round_:
+            shaped.extend(turn)
+    return shaped
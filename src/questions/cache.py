@@ -0,0 +1,118 @@
+"""Demographic-keyed cache of initial question sets
+
+The first round of questions only depends on the persona's age, gender,
+occasion, relationship and budget. Once age is bucketed that is a small
+finite space, so generated sets are pooled per normalized profile and
+rotated across personas instead of calling the LLM every time.
+"""
+import os
+from datetime import timedelta
+from typing import List, Optional
+from sqlalchemy import select, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic_ai import ModelMessagesTypeAdapter
+from pydantic_ai.messages import ModelRequest, ModelResponse, UserPromptPart, TextPart
+from ..database.core import utcnow
+from ..questions_agent.models import GiftDependencies, GiftQuestions
+from .entity import QuestionSetCache
+
+
+QUESTION_CACHE_ENABLED = os.getenv("QUESTION_CACHE_ENABLED", "true").lower() == "true"
+# Lower bounds of the age buckets, e.g. "0,13,18,25,35,50,65" -> 0-12, 13-17, ..., 65+
+QUESTION_CACHE_AGE_BUCKETS = [int(age) for age in os.getenv("QUESTION_CACHE_AGE_BUCKETS", "0,13,18,25,35,50,65").split(",")]
+# Number of distinct question sets kept per key; the pool is filled by real LLM calls before it is served
+QUESTION_CACHE_VARIANTS = int(os.getenv("QUESTION_CACHE_VARIANTS", "3"))
+QUESTION_CACHE_TTL_SECONDS = int(os.getenv("QUESTION_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def bucket_age(age: int, buckets: List[int] = QUESTION_CACHE_AGE_BUCKETS) -> str:
+    """Map an age onto its bucket label, e.g. 29 -> "25-34" """
+    bounds = sorted(buckets)
+    for lower, upper in zip(bounds, bounds[1:]):
+        if lower <= age < upper:
+            return f"{lower}-{upper - 1}"
+    if age >= bounds[-1]:
+        return f"{bounds[-1]}+"
+    return f"<{bounds[0]}"
+
+
+def build_cache_key(deps: GiftDependencies, buckets: List[int] = QUESTION_CACHE_AGE_BUCKETS) -> str:
+    """Normalize the dependencies that shape the initial prompt into a cache key"""
+    return "|".join([
+        bucket_age(deps.age, buckets),
+        deps.gender.lower(),
+        deps.occasion.lower(),
+        deps.relationship.lower(),
+        (deps.budget or "any").lower(),
+    ])
+
+
+def build_cached_exchange_json(prompt: str, output: GiftQuestions) -> bytes:
+    """Synthesize the request/response pair a live agent run would have stored"""
+    return ModelMessagesTypeAdapter.dump_json([
+        ModelRequest(parts=[UserPromptPart(content=prompt)]),
+        ModelResponse(parts=[TextPart(content=output.model_dump_json())]),
+    ])
+
+
+class QuestionSetCacheRepository:
+    """Stores and rotates cached initial question sets
+
+    Changes are left pending in the session and committed with the caller's
+    transaction.
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        enabled: bool = QUESTION_CACHE_ENABLED,
+        variants: int = QUESTION_CACHE_VARIANTS,
+        ttl_seconds: int = QUESTION_CACHE_TTL_SECONDS,
+        age_buckets: List[int] = QUESTION_CACHE_AGE_BUCKETS,
+    ):
+        self.session = session
+        self.enabled = enabled
+        self.variants = variants
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.age_buckets = age_buckets
+
+    async def get(self, deps: GiftDependencies) -> Optional[GiftQuestions]:
+        """Return the least-served fresh variant once the key's pool is full, else None"""
+        if not self.enabled:
+            return None
+
+        cache_key = build_cache_key(deps, self.age_buckets)
+        await self.session.execute(
+            delete(QuestionSetCache).where(
+                QuestionSetCache.cache_key == cache_key,
+                QuestionSetCache.created_at < utcnow() - self.ttl,
+            )
+        )
+        result = await self.session.execute(
+            select(QuestionSetCache)
+            .where(QuestionSetCache.cache_key == cache_key)
+            .order_by(QuestionSetCache.served_count, QuestionSetCache.created_at)
+        )
+        pool = result.scalars().all()
+        if len(pool) < self.variants:
+            return None
+
+        variant = pool[0]
+        await self.session.execute(
+            update(QuestionSetCache)
+            .where(QuestionSetCache.id == variant.id)
+            .values(served_count=QuestionSetCache.served_count + 1)
+        )
+        return GiftQuestions(questions=variant.questions, detective_comment=variant.detective_comment)
+
+    async def put(self, deps: GiftDependencies, output: GiftQuestions) -> None:
+        """Add a freshly generated question set to the key's pool"""
+        if not self.enabled or not output.questions:
+            return
+
+        self.session.add(QuestionSetCache(
+            cache_key=build_cache_key(deps, self.age_buckets),
+            questions=[q.model_dump() for q in output.questions],
+            detective_comment=output.detective_comment,
+            served_count=1,
+        ))
@@ -1,24 +1,78 @@
-from fastapi import APIRouter, Depends, status
+from fastapi import APIRouter, Depends, HTTPException, Header, Response, status
+from sqlalchemy.exc import NoResultFound
 from .models import QuestionResponse, SuggestedQuestion, BulkAnswerRequest, BulkAnswerResponse
 from .service import QuestionService, get_question_service
+from .prefetch import FOLLOWUP_PREFETCH_ENABLED
+from ..streaming import event_stream_response
+from ..jobs.models import JobResponse
+from ..jobs.service import JobService, get_job_service
+from ..llm.admission import shed_load
+from ..llm.executor import Lane
+from ..rate_limiter import rate_limit, RATE_LIMIT_COST_QUESTIONS
 import uuid
-from typing import List
+from typing import List, Optional
 
 router = APIRouter(
     tags=["Questions"],
     responses={404: {"description": "Not found"}},
 )
 
-@router.get("/personas/{persona_id}/questions", response_model=List[SuggestedQuestion])
-def get_questions(
+@router.get(
+    "/personas/{persona_id}/questions",
+    response_model=List[SuggestedQuestion],
+    dependencies=[Depends(rate_limit(RATE_LIMIT_COST_QUESTIONS)), Depends(shed_load(Lane.interactive))],
+)
+async def get_questions(
+    persona_id: uuid.UUID,
+    service: QuestionService = Depends(get_question_service),
+):
+    return await service.get_questions(persona_id)
+
+@router.get(
+    "/personas/{persona_id}/questions/stream",
+    dependencies=[Depends(rate_limit(RATE_LIMIT_COST_QUESTIONS)), Depends(shed_load(Lane.interactive))],
+)
+async def stream_questions(
     persona_id: uuid.UUID,
+    accept: Optional[str] = Header(None),
     service: QuestionService = Depends(get_question_service),
 ):
-    return service.get_questions(persona_id)
+    """Stream the next round: a `question` event per item as soon as it is generated, then `done`.
+    New questions are `provisional` until `done` lists their committed ids.
+    Sends Server-Sent Events for `Accept: text/event-stream`, NDJSON otherwise."""
+    # The session dependency is only closed once the response has been sent, so it outlives the stream
+    try:
+        events = await service.stream_questions(persona_id)
+    except NoResultFound:
+        raise HTTPException(status_code=404, detail=f"Persona not found: {persona_id}")
 
-@router.post("/questions/answers", status_code=status.HTTP_201_CREATED, response_model=BulkAnswerResponse)
-def submit_answers(
+    return event_stream_response(events, accept)
+
+@router.post(
+    "/personas/{persona_id}/questions/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=JobResponse,
+    dependencies=[Depends(rate_limit(RATE_LIMIT_COST_QUESTIONS))],
+)
+async def enqueue_questions(
+    persona_id: uuid.UUID,
+    response: Response,
+    jobs: JobService = Depends(get_job_service),
+):
+    """Generate the next round in the background; poll GET /jobs/{id} for the questions"""
+    job = await jobs.enqueue("questions", {"persona_id": str(persona_id)})
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return job
+
+@router.post(
+    "/questions/answers",
+    status_code=status.HTTP_201_CREATED,
+    response_model=BulkAnswerResponse,
+    dependencies=[Depends(rate_limit())],
+)
+async def submit_answers(
     request: BulkAnswerRequest,
+    prefetch: bool = FOLLOWUP_PREFETCH_ENABLED,
     service: QuestionService = Depends(get_question_service),
 ):
-    return service.submit_bulk_answers(request)
\ No newline at end of file
+    return await service.submit_bulk_answers(request, prefetch=prefetch)
\ No newline at end of file
@@ -1,18 +1,22 @@
-from sqlalchemy import Column, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, String, DateTime, ForeignKey, Text, Integer, Index
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
-from datetime import datetime, timezone
-from ..database.core import Base
+from ..database.core import Base, utcnow
 from ..build_persona.entity import Persona
 
 class Question(Base):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # Persona-scoped lookups: pending/recent rounds and the recommendation profile join
+        Index('ix_questions_persona_id_created_at', 'persona_id', 'created_at'),
+    )
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     persona_id = Column(UUID(as_uuid=True), ForeignKey('personas.id'), nullable=False)
     question_text = Column(Text, nullable=False)
     choices = Column(JSONB, nullable=False)  # Store the available choices as JSONB array
-    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    served_at = Column(DateTime, nullable=True)  # Null while a pre-generated question waits for the next GET
+    created_at = Column(DateTime, nullable=False, default=utcnow)
 
     def __repr__(self):
         return f"<Question(id='{self.id}', question_text='{self.question_text}')>"
@@ -21,9 +25,24 @@ class Answer(Base):
     __tablename__ = 'answers'
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    question_id = Column(UUID(as_uuid=True), ForeignKey('questions.id'), nullable=False)
+    question_id = Column(UUID(as_uuid=True), ForeignKey('questions.id'), nullable=False, index=True)
     selected_choice_text = Column(Text, nullable=False)  # Store the actual choice text selected
-    created_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    created_at = Column(DateTime, nullable=False, default=utcnow)
 
     def __repr__(self):
         return f"<Answer(id='{self.id}', selected_choice='{self.selected_choice_text}')>"
+
+
+class QuestionSetCache(Base):
+    """Initial question set generated for a normalized demographic profile, reused across personas"""
+    __tablename__ = 'question_set_cache'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    cache_key = Column(String, nullable=False, index=True)  # Normalized GiftDependencies, see questions/cache.py
+    questions = Column(JSONB, nullable=False)  # [{"question": str, "choices": [str]}]
+    detective_comment = Column(Text, nullable=False)
+    served_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f"<QuestionSetCache(cache_key='{self.cache_key}', served_count={self.served_count})>"
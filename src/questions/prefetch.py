@@ -0,0 +1,54 @@
+"""Background pre-generation of follow-up questions"""
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable, Dict
+from uuid import UUID
+
+
+logger = logging.getLogger(__name__)
+
+# Start generating the next round as soon as answers are submitted
+FOLLOWUP_PREFETCH_ENABLED = os.getenv("FOLLOWUP_PREFETCH_ENABLED", "false").lower() == "true"
+
+
+class FollowupPrefetcher:
+    """Runs at most one background generation per persona and lets requests join it"""
+
+    def __init__(self):
+        self._tasks: Dict[UUID, asyncio.Task] = {}
+
+    def schedule(self, persona_id: UUID, generate: Callable[[], Awaitable[None]]) -> bool:
+        """Start ``generate`` in the background unless one is already running for the persona"""
+        task = self._tasks.get(persona_id)
+        if task is not None and not task.done():
+            return False
+
+        task = asyncio.create_task(generate())
+        self._tasks[persona_id] = task
+        task.add_done_callback(lambda t: self._on_done(persona_id, t))
+        return True
+
+    def is_running(self, persona_id: UUID) -> bool:
+        task = self._tasks.get(persona_id)
+        return task is not None and not task.done()
+
+    async def wait(self, persona_id: UUID) -> None:
+        """Wait for an in-flight generation of the persona, if any; its failure is not raised here"""
+        task = self._tasks.get(persona_id)
+        if task is None:
+            return
+        try:
+            await asyncio.shield(task)
+        except Exception:
+            pass
+
+    def _on_done(self, persona_id: UUID, task: asyncio.Task) -> None:
+        if self._tasks.get(persona_id) is task:
+            del self._tasks[persona_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Follow-up prefetch failed for persona %s: %r", persona_id, task.exception())
+
+
+# Shared prefetcher for the process
+followup_prefetcher = FollowupPrefetcher()
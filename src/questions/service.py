@@ -1,25 +1,154 @@
-from ..database.core import DbSession
+from ..database.core import AsyncDbSession, AsyncSessionFactory, session_factory_for, utcnow
 from ..build_persona.entity import Persona
 from .entity import Question, Answer
 from .models import QuestionResponse, AnswerResponse, BulkAnswerRequest, BulkAnswerResponse
 import uuid
-from typing import List, Dict
-import asyncio
+from datetime import timedelta
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
-from ..questions_agent.detective import gift_detective, get_initial_system_prompt, get_followup_prompt
-from ..questions_agent.models import GiftDependencies
+from ..questions_agent.detective import gift_detective, get_initial_system_prompt, get_followup_prompt, complete_question_items
+from ..questions_agent.models import GiftDependencies, GiftQuestions
 from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, UserPromptPart, TextPart
 from pydantic_ai import ModelMessagesTypeAdapter
 from ..messages.repository import MessageRepository
+from ..messages.shaping import shape_history
+from .cache import QuestionSetCacheRepository, build_cached_exchange_json
+from .prefetch import followup_prefetcher, FOLLOWUP_PREFETCH_ENABLED
+from ..singleflight import create_single_flight
+from ..exceptions import InvalidAnswerChoiceError
+from ..recommendations.cache import RecommendationCacheRepository, RecommendationBatchRepository
+from ..llm.executor import llm_executor, run_in_lane, Lane
+from ..llm.usage import llm_usage
+
+
+# Coalesces concurrent question requests for the same persona onto one generation
+question_flights = create_single_flight("questions")
 
 
 class QuestionService:
-    def __init__(self, session):
+    def __init__(self, session, session_factory: Optional[async_sessionmaker] = None):
         self.session = session
+        # Opens the sessions of coalesced flights and prefetches, which outlive the caller's
+        self.session_factory = session_factory or session_factory_for(session)
         self.message_repo = MessageRepository(session)
+        self.question_cache = QuestionSetCacheRepository(session)
+        self.recommendation_cache = RecommendationCacheRepository(session)
+        self.recommendation_batches = RecommendationBatchRepository(session)
+
+    async def get_questions(self, persona_id: uuid.UUID) -> List[Dict]:
+        # Double clicks and retries share one in-flight generation (and its result)
+        since = None
+        if question_flights.distributed:
+            since = await self._latest_question_time(persona_id)
+            await self.session.commit()
+        return await question_flights.do(persona_id, lambda: self._serve_in_own_session(persona_id, since))
+
+    async def _serve_in_own_session(self, persona_id: uuid.UUID, since) -> List[Dict]:
+        # The shielded flight outlives a cancelled leader request, so it must not share that request's session
+        async with self.session_factory() as db:
+            return await QuestionService(db, self.session_factory)._serve_questions(persona_id, since)
+
+    async def _serve_questions(self, persona_id: uuid.UUID, since) -> List[Dict]:
+        # Join a follow-up generation started by submit_bulk_answers, then serve what it stored
+        await followup_prefetcher.wait(persona_id)
+        pending = await self._take_pending_questions(persona_id)
+        if pending:
+            return pending
+
+        # Another worker generated a round while this request waited for the persona lock
+        if question_flights.distributed:
+            recent = await self._questions_created_after(persona_id, since)
+            if recent:
+                return recent
+
+        return await self.generate_questions(persona_id)
+
+    async def generate_questions(self, persona_id: uuid.UUID, served: bool = True) -> List[Dict]:
+        """Generate and persist the next round of questions; unserved rounds wait for the next GET"""
+        deps, prompt, message_history, output = await self._prepare_round(persona_id)
+
+        if output is not None:
+            # Served from the question-set cache: synthesize the exchange so follow-ups keep their context
+            new_messages_json = build_cached_exchange_json(prompt, output)
+        else:
+            # Use native Pydantic AI message_history parameter
+            result = await llm_executor.run(
+                Lane.interactive,
+                lambda: gift_detective.run(prompt, deps=deps, message_history=message_history),
+            )
+            output = result.output
+            new_messages_json = result.new_messages_json()
+            llm_usage.record("detective", result.usage)
+            if not message_history:
+                await self.question_cache.put(deps, output)
+
+        now = utcnow()
+        rows = [
+            self._question_row(persona_id, q, position, now, served)
+            for position, q in enumerate(output.questions)
+        ]
+        await self._persist_round(persona_id, new_messages_json, rows)
+
+        return [self._question_item(row) for row in rows]
+
+    async def stream_questions(self, persona_id: uuid.UUID) -> AsyncIterator[Tuple[str, Any]]:
+        """Return an event stream of the next round: one ``question`` event per item, then ``done``
 
-    def get_questions(self, persona_id: uuid.UUID) -> List[Dict]:
-        persona = self.session.query(Persona).filter(Persona.id == persona_id).one()
+        Pending rounds are replayed at once. A new round emits each question as
+        soon as the model has finished it and its choices are cleaned, marked
+        ``provisional`` because its id is not committed yet; ``done`` is sent
+        after the round is committed and lists the ids that now exist.
+        Streams are not coalesced across requests.
+        """
+        await followup_prefetcher.wait(persona_id)
+        pending = await self._take_pending_questions(persona_id)
+        if pending:
+            return self._replay_events(pending)
+
+        deps, prompt, message_history, output = await self._prepare_round(persona_id)
+        return self._stream_round_events(persona_id, deps, prompt, message_history, output)
+
+    async def _replay_events(self, questions: List[Dict]) -> AsyncIterator[Tuple[str, Any]]:
+        for question in questions:
+            yield "question", question
+        yield "done", {"count": len(questions)}
+
+    async def _stream_round_events(self, persona_id, deps, prompt, message_history, output) -> AsyncIterator[Tuple[str, Any]]:
+        now = utcnow()
+        rows = []
+
+        if output is not None:
+            new_messages_json = build_cached_exchange_json(prompt, output)
+        else:
+            async with llm_executor.slot(Lane.interactive):
+                async with gift_detective.run_stream(prompt, deps=deps, message_history=message_history) as result:
+                    async for response in result.stream_response(debounce_by=None):
+                        for q in complete_question_items(response)[len(rows):]:
+                            rows.append(self._question_row(persona_id, q, len(rows), now))
+                            yield "question", self._provisional_item(rows[-1])
+                    output = await result.get_output()
+            new_messages_json = result.new_messages_json()
+            llm_usage.record("detective", result.usage)
+            if not message_history:
+                await self.question_cache.put(deps, output)
+
+        for q in output.questions[len(rows):]:
+            rows.append(self._question_row(persona_id, q, len(rows), now))
+            yield "question", self._provisional_item(rows[-1])
+
+        await self._persist_round(persona_id, new_messages_json, rows)
+        yield "done", {
+            "count": len(rows),
+            "detective_comment": output.detective_comment,
+            "ids": [row["id"] for row in rows],
+        }
+
+    async def _prepare_round(self, persona_id: uuid.UUID) -> Tuple[GiftDependencies, str, List[ModelMessage], Optional[GiftQuestions]]:
+        """Load what the next round needs: dependencies, prompt, history and a cached initial set if any"""
+        result = await self.session.execute(select(Persona).where(Persona.id == persona_id))
+        persona = result.scalar_one()
 
         # Format budget for display
         budget_display = None
@@ -32,8 +161,8 @@ class QuestionService:
             }
             budget_display = budget_map.get(persona.budget.value, persona.budget.value)
 
-        # Load message history using the repository
-        message_history = asyncio.run(self.message_repo.load_all_messages(persona_id))
+        # Load message history using the repository, condensed to the prompt token budget
+        message_history = shape_history(await self.message_repo.load_all_messages(persona_id))
 
         deps = GiftDependencies(
             age=persona.age,
@@ -44,101 +173,190 @@ class QuestionService:
         )
 
         # Use different prompts based on whether we have message history
+        output = None
         if message_history:
             # Follow-up questions: history already contains context, just ask for more questions
             prompt = get_followup_prompt()
         else:
             # Initial questions: include full system prompt with profile
             prompt = get_initial_system_prompt(deps)
+            output = await self.question_cache.get(deps)
 
-        # Use native Pydantic AI message_history parameter
-        result = asyncio.run(
-            gift_detective.run(prompt, deps=deps, message_history=message_history)
-        )
+        # End the read transaction so no pooled connection is held while the model runs;
+        # _persist_round writes the round in a short transaction of its own
+        await self.session.commit()
+        return deps, prompt, message_history, output
 
-        # Store the new messages (both request and response)
-        asyncio.run(self.message_repo.store_messages(
-            persona_id, 
-            result.new_messages_json()
-        ))
-
-        # Save each question to DB and return structured items with choices
-        items: List[Dict] = []
-        for q in result.output.questions:
-            # q.question is the text, q.choices is List[str]
-            question = Question(
-                persona_id=persona_id,
-                question_text=q.question,
-                choices=q.choices,  # Save the choices as JSON
-            )
-            self.session.add(question)
-            self.session.commit()
-            self.session.refresh(question)
-
-            items.append({
-                "id": question.id,
-                "question": question.question_text,
-                "choices": q.choices,
-            })
+    def _question_row(self, persona_id: uuid.UUID, q, position: int, now, served: bool = True) -> Dict:
+        """Question row with a client-side id, so it can be handed out before the insert"""
+        return {
+            "id": uuid.uuid4(),
+            "persona_id": persona_id,
+            "question_text": q.question,
+            "choices": q.choices,  # Save the choices as JSON
+            "served_at": now if served else None,
+            "created_at": now + timedelta(microseconds=position),  # Keeps the round's order stable
+        }
+
+    def _question_item(self, row: Dict) -> Dict:
+        return {"id": row["id"], "question": row["question_text"], "choices": row["choices"]}
+
+    def _provisional_item(self, row: Dict) -> Dict:
+        # Streamed before the round is committed; answer it only once ``done`` confirms the id
+        return {**self._question_item(row), "provisional": True}
+
+    async def _persist_round(self, persona_id: uuid.UUID, new_messages_json: bytes, rows: List[Dict]) -> None:
+        """Store the exchange and bulk-insert the questions in one transaction"""
+        await self.message_repo.store_messages(persona_id, new_messages_json, commit=False)
+        if rows:
+            await self.session.execute(insert(Question), rows)
 
-        return items
+        # One commit for the history batch, the questions and any new question-set cache entry
+        await self.message_repo.commit()
 
-    def get_next_question(self, persona_id: uuid.UUID) -> List[Dict]:
+    async def get_next_question(self, persona_id: uuid.UUID) -> List[Dict]:
         """Backward-compatible alias for get_questions."""
-        return self.get_questions(persona_id)
+        return await self.get_questions(persona_id)
 
-    def submit_bulk_answers(self, request: BulkAnswerRequest) -> BulkAnswerResponse:
-        """Submit multiple answers for different questions in one operation"""
-        submitted_answers = []
-        user_messages: List[ModelMessage] = []
-        
+    async def _latest_question_time(self, persona_id: uuid.UUID):
+        result = await self.session.execute(
+            select(func.max(Question.created_at)).where(Question.persona_id == persona_id)
+        )
+        return result.scalar()
+
+    async def _questions_created_after(self, persona_id: uuid.UUID, since) -> List[Dict]:
+        query = select(Question).where(Question.persona_id == persona_id).order_by(Question.created_at)
+        if since is not None:
+            query = query.where(Question.created_at > since)
+        result = await self.session.execute(query)
+        return [
+            {"id": q.id, "question": q.question_text, "choices": q.choices}
+            for q in result.scalars()
+        ]
+
+    async def _take_pending_questions(self, persona_id: uuid.UUID) -> List[Dict]:
+        """Mark pre-generated questions as served and return them"""
+        result = await self.session.execute(
+            select(Question)
+            .where(Question.persona_id == persona_id, Question.served_at.is_(None))
+            .order_by(Question.created_at)
+        )
+        pending = result.scalars().all()
+        if not pending:
+            return []
+
+        await self.session.execute(
+            update(Question)
+            .where(Question.id.in_([q.id for q in pending]))
+            .values(served_at=utcnow())
+        )
+        await self.session.commit()
+
+        return [
+            {"id": q.id, "question": q.question_text, "choices": q.choices}
+            for q in pending
+        ]
+
+    async def submit_bulk_answers(self, request: BulkAnswerRequest, prefetch: bool = FOLLOWUP_PREFETCH_ENABLED) -> BulkAnswerResponse:
+        """Submit multiple answers for different questions in one operation
+
+        With ``prefetch`` the next round of questions is generated in the
+        background so the client's following GET is served immediately.
+        """
+        if not request.answers:
+            return BulkAnswerResponse(submitted_count=0, answers=[])
+
+        # One lookup for every referenced question
+        result = await self.session.execute(
+            select(Question.id, Question.persona_id, Question.question_text, Question.choices)
+            .where(Question.id.in_({item.question_id for item in request.answers}))
+        )
+        questions = {row.id: row for row in result}
+
+        # Validate choices against the stored options before writing anything
+        invalid = {
+            str(item.question_id): item.answer_choice
+            for item in request.answers
+            if item.question_id in questions
+            and questions[item.question_id].choices
+            and item.answer_choice not in questions[item.question_id].choices
+        }
+        if invalid:
+            raise InvalidAnswerChoiceError(invalid)
+
+        rows = []
+        user_messages: Dict[uuid.UUID, List[ModelMessage]] = {}
         for answer_item in request.answers:
-            # Verify the question exists
-            question = self.session.query(Question).filter(Question.id == answer_item.question_id).first()
+            question = questions.get(answer_item.question_id)
             if not question:
                 continue  # Skip invalid question IDs
-            
+
             # Get the selected choice text
             selected_text = answer_item.answer_choice
-            
+
             # Create message pair for history (agent asked, user answered)
-            user_messages.append(
-                ModelRequest(parts=[UserPromptPart(content=question.question_text)])
-            )
-            user_messages.append(
-                ModelResponse(parts=[TextPart(content=selected_text)])
-            )
-            
-            # Create and save the answer
-            answer = Answer(
-                question_id=answer_item.question_id,
-                selected_choice_text=selected_text
-            )
-            self.session.add(answer)
-            self.session.commit()
-            self.session.refresh(answer)
-            
-            submitted_answers.append(AnswerResponse(
-                id=answer.id,
-                selected_choice=answer.selected_choice_text
-            ))
-        
-        # Store the user's answers in message history
-        if user_messages:
-            # Get persona_id from the first question
-            first_question = self.session.query(Question).filter(
-                Question.id == request.answers[0].question_id
-            ).first()
-            if first_question:
-                asyncio.run(self.message_repo.store_messages(
-                    first_question.persona_id,
-                    ModelMessagesTypeAdapter.dump_json(user_messages)
-                ))
-        
+            user_messages.setdefault(question.persona_id, []).extend([
+                ModelRequest(parts=[UserPromptPart(content=question.question_text)]),
+                ModelResponse(parts=[TextPart(content=selected_text)]),
+            ])
+
+            rows.append({
+                "id": uuid.uuid4(),
+                "question_id": answer_item.question_id,
+                "selected_choice_text": selected_text,
+            })
+
+        if rows:
+            # One bulk insert for the answers and one history batch, committed together
+            await self.session.execute(insert(Answer), rows)
+            # Sorted so concurrent submissions lock the personas in the same order
+            for persona_id, messages in sorted(user_messages.items()):
+                await self.message_repo.store_messages(
+                    persona_id,
+                    ModelMessagesTypeAdapter.dump_json(messages),
+                    commit=False,
+                )
+            # New answers change the profile, so drop the personas' cached recommendations and pages too
+            await self.recommendation_cache.invalidate(user_messages.keys())
+            await self.recommendation_batches.invalidate(user_messages.keys())
+            await self.message_repo.commit()
+
+            if prefetch:
+                for persona_id in user_messages:
+                    followup_prefetcher.schedule(
+                        persona_id,
+                        lambda persona_id=persona_id: prefetch_followup_questions(persona_id, self.session_factory),
+                    )
+
         return BulkAnswerResponse(
-            submitted_count=len(submitted_answers),
-            answers=submitted_answers
+            submitted_count=len(rows),
+            answers=[
+                AnswerResponse(id=row["id"], selected_choice=row["selected_choice_text"])
+                for row in rows
+            ]
         )
-    
-def get_question_service(session: DbSession) -> QuestionService:
-    return QuestionService(session)
+
+async def prefetch_followup_questions(persona_id: uuid.UUID, session_factory: async_sessionmaker) -> None:
+    """Generate the next round in its own session, leaving it unserved for the next GET
+
+    The next GET joins this generation, so it runs in the interactive lane
+    rather than queueing behind batch work. It holds the persona's question
+    lock, so with the advisory backend a GET on another worker waits for it
+    too and serves the stored round.
+    """
+    since = utcnow()
+    with run_in_lane(Lane.interactive):
+        await question_flights.exclusive(
+            persona_id, lambda: _prefetch_in_own_session(persona_id, session_factory, since)
+        )
+
+async def _prefetch_in_own_session(persona_id: uuid.UUID, session_factory: async_sessionmaker, since) -> None:
+    async with session_factory() as session:
+        service = QuestionService(session, session_factory)
+        # A GET on another worker took the lock first and already generated the round
+        if question_flights.distributed and await service._questions_created_after(persona_id, since):
+            return
+        await service.generate_questions(persona_id, served=False)
+
+def get_question_service(session: AsyncDbSession, session_factory: AsyncSessionFactory) -> QuestionService:
+    return QuestionService(session, session_factory)
@@ -1,33 +1,48 @@
+import json
+from typing import List
+import pydantic_core
+from pydantic import ValidationError
 from pydantic_ai import Agent, RunContext
+from pydantic_ai.messages import ModelResponse, ToolCallPart, TextPart
 from .models import GiftDependencies, GiftQuestions
+from ..llm.provider import create_model
 
 
+# Static for every persona and round, so providers can cache it as a shared prompt prefix.
+# Per-request details go in the user prompts below, after the instructions.
+DETECTIVE_INSTRUCTIONS = (
+    "You are a Senior Gift Psychology Consultant and a super intelligent detective helping to find the perfect gift. "
+    "You ask questions that reveal the recipient's profile and preferences. "
+    "Be witty, clever, but clear. "
+    "Keep the questions short and always ask in the third person depending on the recipient's gender (he or she). "
+    "NEVER repeat or ask similar questions to what was already asked. "
+    "Return JSON that strictly matches this schema with NO extra commentary: "
+    "{ 'questions': [ { 'question': str, 'choices': [str, str, str, str] } ], 'detective_comment': str }. "
+    "- questions: exactly as many items as requested (no more, no less). "
+    "- question: concise, specific, third-person phrasing. "
+    "- choices: exactly 4 options - 3 specific choices PLUS 'None of the above' as the 4th option. "
+    "- detective_comment: one or two sentences explaining your reasoning."
+)
+
 gift_detective = Agent(
-    "huggingface:deepseek-ai/DeepSeek-V3.1",
+    create_model(),
     deps_type=GiftDependencies,
     output_type=GiftQuestions,
+    instructions=DETECTIVE_INSTRUCTIONS,
 )
 
 
 def get_initial_system_prompt(deps: GiftDependencies) -> str:
     """
-    Build the initial system prompt for the first interaction.
-    This is only used when there's no message history.
+    Build the prompt for the first interaction.
+    This is only used when there's no message history. The recipient
+    profile comes last so the text before it is shared by every persona.
     """
     return (
-        "You are a Senior Gift Psychology Consultant and a super intelligent detective helping to find the perfect gift. "
-        f"The recipient profile is: Age={deps.age}, Gender={deps.gender}, "
-        f"Occasion={deps.occasion}, Budget={deps.budget}, Relationship={deps.relationship}. "
         "Ask 5 GENERAL questions to understand the recipient's profile and preferences better. "
         "The questions should be broad but still tailored to the recipient's age, gender, occasion, and relationship. "
-        "Be witty, clever, but clear. "
-        "Keep the questions short and always ask in the third person depending on the recipient's gender (he or she). "
-        "Return JSON that strictly matches this schema with NO extra commentary: "
-        "{ 'questions': [ { 'question': str, 'choices': [str, str, str, str] } ], 'detective_comment': str }. "
-        "- questions: EXACTLY 5 items (no more, no less). "
-        "- question: concise, specific, third-person phrasing. "
-        "- choices: exactly 4 options - 3 specific choices PLUS 'None of the above' as the 4th option. "
-        "- detective_comment: one or two sentences explaining your reasoning."
+        f"The recipient profile is: Age={deps.age}, Gender={deps.gender}, "
+        f"Occasion={deps.occasion}, Budget={deps.budget}, Relationship={deps.relationship}."
     )
 
 
@@ -38,11 +53,40 @@ def get_followup_prompt() -> str:
     """
     return (
         "Based on the previous conversation, ask 3 DEEPER, more specific follow-up questions. "
-        "Pay special attention to any 'None of the above' answers - these indicate areas where you need to ask alternative questions to gather better information. "
-        "NEVER repeat or ask similar questions to what was already asked. "
-        "Be witty, clever, but clear. "
-        "Return JSON that strictly matches this schema: "
-        "{ 'questions': [ { 'question': str, 'choices': [str, str, str, str] } ], 'detective_comment': str }. "
-        "- questions: EXACTLY 3 items (no more, no less). "
-        "- choices: exactly 4 options - 3 specific choices PLUS 'None of the above' as the 4th option."
+        "Pay special attention to any 'None of the above' answers - these indicate areas where you need to ask alternative questions to gather better information."
     )
+
+
+def complete_question_items(response: ModelResponse) -> List[GiftQuestions.QuestionItem]:
+    """
+    Parse the questions the model has finished so far from a partial streamed response.
+    The last question only counts once a key after the questions array has started,
+    since its choices would otherwise be padded while still being generated.
+    """
+    raw = None
+    for part in response.parts:
+        if isinstance(part, ToolCallPart):
+            raw = part.args if isinstance(part.args, str) else json.dumps(part.args or {})
+        elif isinstance(part, TextPart) and "{" in part.content:
+            raw = part.content[part.content.index("{"):]
+    if not raw:
+        return []
+
+    try:
+        data = pydantic_core.from_json(raw, allow_partial="trailing-strings")
+    except ValueError:
+        return []
+    if not isinstance(data, dict) or not isinstance(data.get("questions"), list):
+        return []
+
+    questions = data["questions"]
+    if list(data)[-1] == "questions":
+        questions = questions[:-1]
+
+    items = []
+    for question in questions:
+        try:
+            items.append(GiftQuestions.QuestionItem.model_validate(question))
+        except ValidationError:
+            break
+    return items
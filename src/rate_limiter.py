@@ -1,5 +1,267 @@
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+"""Token-bucket rate limiting per client IP and per persona
 
+Every limited route spends tokens from the caller's IP bucket and, for
+persona routes, from the persona's bucket. Buckets refill continuously, so
+short bursts up to the capacity are allowed. LLM-backed routes cost more
+tokens than cheap writes such as ``POST /build-persona/``.
 
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+Buckets live in process memory by default. Multi-worker deployments should
+point ``RATE_LIMIT_STORAGE_URL`` at Redis (or any Redis-compatible server),
+where a Lua script updates each bucket atomically.
+"""
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+from fastapi import Request
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from .exceptions import RateLimitExceededError
+
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# "memory://" for a single process, "redis://host:6379/0" to share buckets across workers
+RATE_LIMIT_STORAGE_URL = os.getenv("RATE_LIMIT_STORAGE_URL", "memory://")
+RATE_LIMIT_IP_CAPACITY = int(os.getenv("RATE_LIMIT_IP_CAPACITY", "60"))
+RATE_LIMIT_IP_REFILL_PER_SECOND = float(os.getenv("RATE_LIMIT_IP_REFILL_PER_SECOND", "1"))
+RATE_LIMIT_PERSONA_CAPACITY = int(os.getenv("RATE_LIMIT_PERSONA_CAPACITY", "30"))
+RATE_LIMIT_PERSONA_REFILL_PER_SECOND = float(os.getenv("RATE_LIMIT_PERSONA_REFILL_PER_SECOND", "0.5"))
+
+# Tokens spent per request
+RATE_LIMIT_COST_DEFAULT = int(os.getenv("RATE_LIMIT_COST_DEFAULT", "1"))
+RATE_LIMIT_COST_QUESTIONS = int(os.getenv("RATE_LIMIT_COST_QUESTIONS", "5"))
+RATE_LIMIT_COST_RECOMMENDATIONS = int(os.getenv("RATE_LIMIT_COST_RECOMMENDATIONS", "10"))
+ROUTE_COSTS = {
+    "RATE_LIMIT_COST_DEFAULT": RATE_LIMIT_COST_DEFAULT,
+    "RATE_LIMIT_COST_QUESTIONS": RATE_LIMIT_COST_QUESTIONS,
+    "RATE_LIMIT_COST_RECOMMENDATIONS": RATE_LIMIT_COST_RECOMMENDATIONS,
+}
+
+
+@dataclass(frozen=True)
+class BucketRule:
+    capacity: int
+    refill_per_second: float
+
+    def __post_init__(self):
+        # Checked when the limits are loaded, so a bad setting fails at startup rather than per request
+        if self.capacity < 1 or not self.refill_per_second > 0:
+            raise ValueError(
+                f"Invalid rate limit bucket {self}: RATE_LIMIT_*_CAPACITY must be at least 1 "
+                "and RATE_LIMIT_*_REFILL_PER_SECOND greater than 0"
+            )
+
+
+def check_route_costs(costs: Dict[str, int], rules: Sequence[BucketRule]) -> None:
+    """Reject route costs no bucket can cover, since those routes would answer 429 forever"""
+    capacity = min(rule.capacity for rule in rules)
+    too_high = [f"{name}={cost}" for name, cost in costs.items() if cost > capacity]
+    if too_high:
+        raise ValueError(
+            f"Rate limit costs {', '.join(too_high)} exceed the smallest bucket capacity ({capacity}): "
+            "RATE_LIMIT_COST_* must not be larger than RATE_LIMIT_IP_CAPACITY or RATE_LIMIT_PERSONA_CAPACITY"
+        )
+
+
+def refill(tokens: float, elapsed: float, rule: BucketRule) -> float:
+    return min(rule.capacity, tokens + max(elapsed, 0) * rule.refill_per_second)
+
+
+Bucket = Tuple[str, BucketRule]
+
+
+class MemoryBucketBackend:
+    """Buckets in a dict; correct for a single process only"""
+
+    max_buckets = 100_000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float, BucketRule]] = {}
+
+    async def take(self, buckets: Sequence[Bucket], cost: int) -> Tuple[bool, List[float]]:
+        """Spend ``cost`` tokens from every bucket if all of them have enough
+
+        Returns (allowed, tokens left per bucket); nothing is spent unless allowed.
+        """
+        now = time.monotonic()
+        tokens = []
+        for key, rule in buckets:
+            left, updated, _ = self._buckets.get(key, (rule.capacity, now, rule))
+            tokens.append(refill(left, now - updated, rule))
+        allowed = all(left >= cost for left in tokens)
+        if allowed:
+            tokens = [left - cost for left in tokens]
+        for (key, rule), left in zip(buckets, tokens):
+            self._buckets[key] = (left, now, rule)
+        if len(self._buckets) > self.max_buckets:
+            self._prune(now)
+        return allowed, tokens
+
+    def _prune(self, now: float) -> None:
+        # A bucket that has refilled completely is the same as no bucket
+        full = [
+            key for key, (tokens, updated, rule) in self._buckets.items()
+            if refill(tokens, now - updated, rule) >= rule.capacity
+        ]
+        for key in full:
+            del self._buckets[key]
+
+    def reset(self) -> None:
+        self._buckets.clear()
+
+
+# Refill every bucket, then spend from all of them or none, atomically and on the
+# server clock so all workers agree on elapsed time. ARGV: cost, then capacity and
+# rate per key.
+TAKE_SCRIPT = """
+local cost = tonumber(ARGV[1])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = {}
+local allowed = 1
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'updated')
+    local current = tonumber(state[1]) or capacity
+    local updated = tonumber(state[2]) or now
+    tokens[i] = math.min(capacity, current + math.max(0, now - updated) * rate)
+    if tokens[i] < cost then
+        allowed = 0
+    end
+end
+local result = {allowed}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    if allowed == 1 then
+        tokens[i] = tokens[i] - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens[i]), 'updated', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil((capacity - tokens[i]) / rate * 1000) + 1000)
+    result[i + 1] = tostring(tokens[i])
+end
+return result
+"""
+
+
+class RedisBucketBackend:
+    """Buckets shared by every worker through Redis or a Redis-compatible server"""
+
+    def __init__(self, url: str, prefix: str = "pickaboo:ratelimit:"):
+        import redis.asyncio as redis  # Only needed when a Redis URL is configured
+
+        self.client = redis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(TAKE_SCRIPT)
+
+    async def take(self, buckets: Sequence[Bucket], cost: int) -> Tuple[bool, List[float]]:
+        args = [cost]
+        for _, rule in buckets:
+            args += [rule.capacity, rule.refill_per_second]
+        allowed, *tokens = await self._take(keys=[self.prefix + key for key, _ in buckets], args=args)
+        return bool(allowed), [float(left) for left in tokens]
+
+    def reset(self) -> None:
+        # Keys expire on their own once their bucket would be full again
+        pass
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def create_backend(url: str = RATE_LIMIT_STORAGE_URL):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBucketBackend(url)
+    return MemoryBucketBackend()
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        backend=None,
+        enabled: bool = RATE_LIMIT_ENABLED,
+        per_ip: BucketRule = BucketRule(RATE_LIMIT_IP_CAPACITY, RATE_LIMIT_IP_REFILL_PER_SECOND),
+        per_persona: BucketRule = BucketRule(RATE_LIMIT_PERSONA_CAPACITY, RATE_LIMIT_PERSONA_REFILL_PER_SECOND),
+    ):
+        self.backend = backend if backend is not None else create_backend()
+        self.enabled = enabled
+        self.per_ip = per_ip
+        self.per_persona = per_persona
+
+    async def hit(self, client: str, cost: int, persona_id: Optional[str] = None) -> Dict[str, str]:
+        """Spend ``cost`` from the caller's buckets and return the rate-limit headers
+
+        Raises RateLimitExceededError when a bucket cannot cover the cost.
+        The headers describe the bucket closest to running out.
+        """
+        buckets: List[Bucket] = [(f"ip:{client}", self.per_ip)]
+        if persona_id is not None:
+            buckets.append((f"persona:{persona_id}", self.per_persona))
+
+        # All buckets are checked before any is debited, so a rejection costs nothing
+        allowed, tokens = await self.backend.take(buckets, cost)
+        states = [(rule, left) for (_, rule), left in zip(buckets, tokens)]
+        if not allowed:
+            rule, left = max(
+                ((rule, left) for rule, left in states if left < cost),
+                key=lambda state: (cost - state[1]) / state[0].refill_per_second,
+            )
+            retry_after = max(1, math.ceil((cost - left) / rule.refill_per_second))
+            raise RateLimitExceededError(retry_after, self._headers(rule, left))
+        return self._headers(*min(states, key=lambda state: state[1]))
+
+    def _headers(self, rule: BucketRule, tokens: float) -> Dict[str, str]:
+        return {
+            "X-RateLimit-Limit": str(rule.capacity),
+            "X-RateLimit-Remaining": str(math.floor(tokens)),
+            "X-RateLimit-Reset": str(math.ceil((rule.capacity - tokens) / rule.refill_per_second)),
+        }
+
+    def reset(self) -> None:
+        self.backend.reset()
+
+    async def close(self) -> None:
+        if hasattr(self.backend, "close"):
+            await self.backend.close()
+
+
+# Shared limiter for the process; misconfigured costs fail the import, so the app refuses to start
+limiter = RateLimiter()
+check_route_costs(ROUTE_COSTS, [limiter.per_ip, limiter.per_persona])
+
+
+def client_address(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limit(cost: int = RATE_LIMIT_COST_DEFAULT):
+    """Route dependency spending ``cost`` tokens per request; persona routes also spend from the persona bucket"""
+    async def check_rate_limit(request: Request) -> None:
+        if not limiter.enabled:
+            return
+        persona_id = request.path_params.get("persona_id")
+        headers = await limiter.hit(client_address(request), cost, str(persona_id) if persona_id else None)
+        request.state.rate_limit_headers = headers
+    return check_rate_limit
+
+
+class RateLimitHeadersMiddleware:
+    """Add the headers recorded by ``rate_limit`` to the response, streaming responses included"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_with_headers(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = scope.get("state", {}).get("rate_limit_headers")
+                if headers:
+                    MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
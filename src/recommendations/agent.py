@@ -1,24 +1,26 @@
+from functools import lru_cache
+from pydantic import Field
 from pydantic_ai import Agent
-from typing import List
-from .models import PersonaProfile, GiftRecommendation, RecommendationResponse
+from typing import Annotated, AsyncIterator, Iterable, List, Optional, Sequence, Tuple
+from .models import PersonaProfile, GiftRecommendation, RecommendationResponse, PromptMode, DEFAULT_RECOMMENDATION_COUNT
 from pydantic_ai.messages import ModelMessage
+from ..llm.executor import llm_executor, Lane
+from ..llm.provider import create_model
+from ..llm.usage import llm_usage
 
-class GiftRecommendationAgent:
-    """Intelligent gift recommendation agent that maintains context about the recipient"""
-    
-    def __init__(self):
-        self.agent = Agent(
-            "huggingface:deepseek-ai/DeepSeek-V3.1",
-            output_type=List[GiftRecommendation],
-            retries=2,
-            system_prompt="""You are an expert gift recommendation specialist with years of experience in personalized gifting.
+
+NONE_OF_THE_ABOVE = "none of the above"
+
+# Static for every request, so providers can cache it as a shared prompt prefix;
+# the recipient details follow in the per-request prompt
+RECOMMENDATION_INSTRUCTIONS = """You are an expert gift recommendation specialist with years of experience in personalized gifting.
 
 You have been asking the user questions about the gift recipient to understand their preferences. 
-Now, based on ALL the conversation history (the questions you asked and the answers you received), 
+Now, based on ALL the answers you received (from the conversation history, or listed in the request), 
 recommend the most suitable gifts.
 
 KEY PRINCIPLES:
-1. Review the ENTIRE conversation history - every question and answer matters
+1. Review EVERY question and answer - each one matters
 2. The answers reveal specific interests, personality traits, and preferences
 3. When you see "None of the above" answers, pay attention - these tell you what the recipient is NOT interested in
 4. Match gifts to the recipient's lifestyle shown through their choices
@@ -35,7 +37,7 @@ CRITICAL: You must respond with a JSON array of gift recommendations. Each recom
 - title: string (short gift name)
 - description: string (detailed description)
 - price_range: string (e.g., "$20-50", "$100-200")
-- reasoning: string (why this fits based on what you learned from the conversation)
+- reasoning: string (why this fits based on what you learned from the answers)
 - confidence_score: float (between 0.0 and 1.0)
 - category: string (gift category like "books", "electronics", etc.)
 
@@ -51,27 +53,140 @@ Example format:
   }
 ]
 
-Remember: Use the conversation history to make truly personalized recommendations."""
+TASK: Generate exactly as many gift recommendations as the request asks for.
+- Never repeat a gift listed as already recommended, or a close variation of it
+- IMPORTANT: Ensure all price_range values respect the budget constraint
+- Reference specific answers in your reasoning
+
+Remember: Use everything you learned to make truly personalized recommendations."""
+
+
+@lru_cache(maxsize=None)
+def recommendation_list(count: int, exact: bool = True):
+    """Output type allowing exactly ``count`` items, or at most ``count`` when not ``exact``"""
+    return Annotated[List[GiftRecommendation], Field(min_length=count if exact else 0, max_length=count)]
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(title.lower().split())
+
+
+def exclude_duplicates(recommendations: Iterable[GiftRecommendation], existing: Iterable[GiftRecommendation]) -> List[GiftRecommendation]:
+    """``recommendations`` without titles already in ``existing`` (or repeated among themselves)"""
+    seen = {normalize_title(rec.title) for rec in existing}
+    unique = []
+    for recommendation in recommendations:
+        title = normalize_title(recommendation.title)
+        if title not in seen:
+            seen.add(title)
+            unique.append(recommendation)
+    return unique
+
+
+class GiftRecommendationAgent:
+    """Intelligent gift recommendation agent that maintains context about the recipient"""
+    
+    def __init__(self):
+        self.agent = Agent(
+            create_model(),
+            output_type=List[GiftRecommendation],
+            retries=2,
+            instructions=RECOMMENDATION_INSTRUCTIONS,
         )
     
     async def generate_recommendations(
         self, 
         profile: PersonaProfile, 
-        message_history: List[ModelMessage]
+        message_history: Optional[List[ModelMessage]],
+        prompt_mode: PromptMode = PromptMode.history,
+        count: int = DEFAULT_RECOMMENDATION_COUNT,
+        exclude: Sequence[GiftRecommendation] = (),
     ) -> List[GiftRecommendation]:
-        """Generate personalized gift recommendations using conversation history"""
+        """Generate ``count`` personalized gift recommendations using conversation history or the profile alone
+
+        ``exclude`` lists recommendations the client already has (top-up);
+        only new gifts are generated.
+        """
         
         # Build the request prompt
-        prompt = self._build_recommendation_prompt(profile)
+        prompt, message_history = self.build_request(profile, message_history, prompt_mode, count, exclude)
         
         # Use the message history from the question generation process
-        result = await self.agent.run(prompt, message_history=message_history)
+        result = await llm_executor.run(
+            Lane.recommendations,
+            lambda: self.agent.run(prompt, message_history=message_history, output_type=recommendation_list(count)),
+        )
+        llm_usage.record("recommendations", result.usage)
         return result.output
     
-    def _build_recommendation_prompt(self, profile: PersonaProfile) -> str:
-        """Build a prompt that references the conversation history"""
+    async def stream_recommendations(
+        self,
+        profile: PersonaProfile,
+        message_history: Optional[List[ModelMessage]],
+        prompt_mode: PromptMode = PromptMode.history,
+        count: int = DEFAULT_RECOMMENDATION_COUNT,
+        exclude: Sequence[GiftRecommendation] = (),
+    ) -> AsyncIterator[GiftRecommendation]:
+        """Yield each recommendation as soon as the model has finished generating it
+
+        The schema only caps the stream at ``count`` items: a minimum would
+        hold back every partial output until the list is complete.
+        """
+        
+        prompt, message_history = self.build_request(profile, message_history, prompt_mode, count, exclude)
+        emitted = 0
         
-        prompt = f"""Based on our conversation above about the gift recipient, generate exactly 5 gift recommendations as a JSON array.
+        async with llm_executor.slot(Lane.recommendations):
+            output_type = recommendation_list(count, exact=False)
+            async with self.agent.run_stream(prompt, message_history=message_history, output_type=output_type) as result:
+                async for partial in result.stream_output(debounce_by=None):
+                    # The last item may still be growing (partial output accepts truncated strings)
+                    while emitted < len(partial) - 1:
+                        yield partial[emitted]
+                        emitted += 1
+                output = await result.get_output()
+                llm_usage.record("recommendations", result.usage)
+        
+        for recommendation in output[emitted:]:
+            yield recommendation
+    
+    def build_request(
+        self,
+        profile: PersonaProfile,
+        message_history: Optional[List[ModelMessage]],
+        prompt_mode: PromptMode,
+        count: int = DEFAULT_RECOMMENDATION_COUNT,
+        exclude: Sequence[GiftRecommendation] = (),
+    ) -> Tuple[str, Optional[List[ModelMessage]]]:
+        """Prompt and history to send for ``prompt_mode``; profile mode sends no history"""
+        if prompt_mode == PromptMode.profile:
+            prompt, message_history = self._build_profile_prompt(profile, count), None
+        else:
+            prompt = self._build_recommendation_prompt(profile, count)
+        return prompt + self._build_exclusions(exclude), message_history
+    
+    def _build_exclusions(self, exclude: Sequence[GiftRecommendation]) -> str:
+        """Already recommended titles, appended last so the rest of the prompt stays the same"""
+        if not exclude:
+            return ""
+        titles = "\n".join(f"- {rec.title}" for rec in exclude)
+        return f"""
+ALREADY RECOMMENDED (the recipient has these suggestions; recommend different gifts):
+{titles}
+"""
+    
+    def _build_profile_prompt(self, profile: PersonaProfile, count: int = DEFAULT_RECOMMENDATION_COUNT) -> str:
+        """Build a self-contained prompt from the structured profile, replacing the conversation replay"""
+        
+        answers = []
+        exclusions = []
+        for insight in profile.question_insights:
+            answers.append(f"- [{insight.insight_category}] {insight.question} -> {insight.selected_choice}")
+            if insight.selected_choice.strip().lower() == NONE_OF_THE_ABOVE:
+                rejected = [choice for choice in insight.available_choices if choice.strip().lower() != NONE_OF_THE_ABOVE]
+                exclusions.append(f"- {insight.question} (rejected: {', '.join(rejected) or 'all options'})")
+        
+        prompt = f"""There is no conversation history for this request: everything learned about the gift recipient is listed below. Generate exactly {count} gift recommendations as a JSON array.
 
 RECIPIENT SUMMARY:
 - Age: {profile.age}
@@ -80,10 +195,26 @@ RECIPIENT SUMMARY:
 - Your Relationship: {profile.relationship}
 - Budget: {profile.budget if profile.budget else "flexible budget"}
 
-TASK: Generate 5 gift recommendations based on what you learned from asking questions.
-- Each recommendation must include: title, description, price_range, reasoning, confidence_score (0.0-1.0), category
-- IMPORTANT: Ensure all price_range values respect the budget constraint
-- Reference specific answers from our conversation in your reasoning
+ANSWERS (question -> selected choice):
+{chr(10).join(answers) if answers else "- No questions answered yet"}
+
+NOT INTERESTED IN ("None of the above" answers; avoid these topics):
+{chr(10).join(exclusions) if exclusions else "- None"}
+"""
+        
+        return prompt
+    
+    def _build_recommendation_prompt(self, profile: PersonaProfile, count: int = DEFAULT_RECOMMENDATION_COUNT) -> str:
+        """Build a prompt that references the conversation history; the task rules are in the instructions"""
+        
+        prompt = f"""Based on our conversation above about the gift recipient, generate exactly {count} gift recommendations as a JSON array.
+
+RECIPIENT SUMMARY:
+- Age: {profile.age}
+- Gender: {profile.gender}
+- Occasion: {profile.occasion}
+- Your Relationship: {profile.relationship}
+- Budget: {profile.budget if profile.budget else "flexible budget"}
 """
         
         return prompt
@@ -0,0 +1,127 @@
+"""Prompt size and latency of the recommendation prompt modes
+
+Usage:
+    python -m src.recommendations.benchmark [--rounds 3] [--questions-per-round 5]
+        [--runs 5] [--live]
+
+Builds a synthetic persona with ``--rounds`` answered question rounds and
+sends the recommendation request once per prompt mode: ``history`` replays
+the (shaped) conversation, ``profile`` renders the prompt from the
+``PersonaProfile`` alone. Offline, the request is captured by a local
+function model and its prompt tokens are estimated. With ``--live`` the
+configured model is called ``--runs`` times per mode and the reported input
+tokens and p50/p95 latency are printed (needs ``HF_TOKEN``).
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Dict, List, Tuple
+from uuid import uuid4
+from pydantic_ai import ModelMessagesTypeAdapter
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, UserPromptPart, TextPart, ToolCallPart, ToolReturnPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from ..messages.shaping import estimate_tokens, shape_history
+from .agent import gift_recommendation_agent
+from .models import PersonaProfile, QuestionInsight, PromptMode
+
+
+CHOICES = ["Outdoors and sports", "Books and culture", "Cooking and food", "None of the above"]
+
+SAMPLE_RECOMMENDATION = {
+    "title": "Sample gift",
+    "description": "A placeholder recommendation returned by the offline benchmark model.",
+    "price_range": "€25-€50",
+    "reasoning": "Matches the recipient's answers.",
+    "confidence_score": 0.8,
+    "category": "experiences",
+}
+
+
+def build_persona(rounds: int, questions_per_round: int) -> Tuple[PersonaProfile, List[ModelMessage]]:
+    """Synthetic profile plus the history the question flow would have stored for it"""
+    insights: List[QuestionInsight] = []
+    history: List[ModelMessage] = []
+    for round_number in range(rounds):
+        questions = [
+            f"Round {round_number + 1}, question {i + 1}: how does the recipient prefer to spend a free afternoon?"
+            for i in range(questions_per_round)
+        ]
+        prompt = "Recipient profile: Age=34, Gender=female, Occasion=birthday, Budget=€25-€50, Relationship=friend. Ask 5 general questions." if round_number == 0 else "Ask 5 more specific follow-up questions."
+        history += [
+            ModelRequest(parts=[UserPromptPart(content=prompt)]),
+            ModelResponse(parts=[ToolCallPart(
+                tool_name="final_result",
+                args={"questions": [{"question": q, "choices": CHOICES} for q in questions], "detective_comment": "Narrowing it down."},
+                tool_call_id=f"round-{round_number}",
+            )]),
+            ModelRequest(parts=[ToolReturnPart(tool_name="final_result", content="Final result processed.", tool_call_id=f"round-{round_number}")]),
+        ]
+        for i, question in enumerate(questions):
+            answer = CHOICES[(round_number + i) % len(CHOICES)]
+            history += [
+                ModelRequest(parts=[UserPromptPart(content=question)]),
+                ModelResponse(parts=[TextPart(content=answer)]),
+            ]
+            insights.append(QuestionInsight(question=question, selected_choice=answer, available_choices=CHOICES, insight_category="preferences"))
+
+    profile = PersonaProfile(
+        persona_id=uuid4(),
+        age=34,
+        gender="female",
+        occasion="birthday",
+        relationship="friend",
+        budget="€25-€50",
+        question_insights=insights,
+    )
+    # Round-trip through storage so the history looks exactly like a loaded one
+    return profile, ModelMessagesTypeAdapter.validate_json(ModelMessagesTypeAdapter.dump_json(history))
+
+
+async def measure_offline(mode: PromptMode, profile: PersonaProfile, history: List[ModelMessage]) -> Dict:
+    sent: List[ModelMessage] = []
+
+    def respond(messages: List[ModelMessage], info: AgentInfo) -> ModelResponse:
+        sent.extend(messages)
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"response": [SAMPLE_RECOMMENDATION] * 5})])
+
+    prompt, message_history = gift_recommendation_agent.build_request(profile, shape_history(history), mode)
+    with gift_recommendation_agent.agent.override(model=FunctionModel(respond)):
+        await gift_recommendation_agent.agent.run(prompt, message_history=message_history)
+    return {"messages": len(sent), "prompt_tokens": estimate_tokens(sent)}
+
+
+async def measure_live(mode: PromptMode, profile: PersonaProfile, history: List[ModelMessage], runs: int) -> Dict:
+    prompt, message_history = gift_recommendation_agent.build_request(profile, shape_history(history), mode)
+    timings, input_tokens = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = await gift_recommendation_agent.agent.run(prompt, message_history=message_history)
+        timings.append((time.perf_counter() - started) * 1000)
+        input_tokens.append(result.usage.input_tokens)
+    timings.sort()
+    return {
+        "prompt_tokens": round(statistics.mean(input_tokens)),
+        "p50_ms": round(statistics.median(timings)),
+        "p95_ms": round(timings[max(0, int(len(timings) * 0.95) - 1)]),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    profile, history = build_persona(args.rounds, args.questions_per_round)
+    print(f"{args.rounds} rounds, {len(profile.question_insights)} answers, raw history ~{estimate_tokens(history)} tokens")
+    for mode in PromptMode:
+        if args.live:
+            stats = await measure_live(mode, profile, history, args.runs)
+        else:
+            stats = await measure_offline(mode, profile, history)
+        print(f"-- {mode.value}: " + " ".join(f"{key}={value}" for key, value in stats.items()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--questions-per-round", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--live", action="store_true", help="call the configured model and measure latency")
+    asyncio.run(main(parser.parse_args()))
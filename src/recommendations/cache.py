@@ -0,0 +1,268 @@
+"""Persisted cache of generated recommendations
+
+Recommendations only depend on the persona profile (persona fields plus the
+ordered question/answer pairs), the conversation history and the request
+options. Those are hashed into a fingerprint; a repeat call with the same
+fingerprint is answered from the stored response instead of the agent.
+The requested count is stored next to the response rather than hashed, so
+a call asking for fewer items is served from a larger response and one
+asking for more only generates the missing items (top-up).
+Submitting answers drops the persona's entries in the same transaction.
+
+Pages served by ``recommendations/next`` are persisted per persona and
+fingerprint, so each page only asks the model for new items and an
+already generated page is returned again without a model call.
+
+The shared cache works across personas: a profile is normalized to its
+bucketed demographics plus the sorted set of selected choices, and the
+recommendations of a stored profile with the same demographics are reused
+when the choice sets match exactly or are similar enough (Jaccard index).
+"""
+import hashlib
+import json
+import os
+from datetime import timedelta
+from typing import Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+from sqlalchemy import select, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database.core import utcnow
+from ..questions.cache import bucket_age
+from .entity import RecommendationCache, SharedRecommendationCache, RecommendationBatch
+from .models import PersonaProfile, RecommendationRequest, RecommendationResponse, GiftRecommendation
+
+
+RECOMMENDATION_CACHE_ENABLED = os.getenv("RECOMMENDATION_CACHE_ENABLED", "true").lower() == "true"
+RECOMMENDATION_CACHE_TTL_SECONDS = int(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", str(24 * 3600)))
+
+RECOMMENDATION_SHARED_CACHE_ENABLED = os.getenv("RECOMMENDATION_SHARED_CACHE_ENABLED", "true").lower() == "true"
+# Minimum Jaccard similarity of the choice sets for a near match (1.0 only reuses exact matches)
+RECOMMENDATION_SHARED_SIMILARITY = float(os.getenv("RECOMMENDATION_SHARED_SIMILARITY", "0.8"))
+# Most-reused profiles of the same demographics compared per lookup
+RECOMMENDATION_SHARED_CANDIDATES = int(os.getenv("RECOMMENDATION_SHARED_CANDIDATES", "50"))
+RECOMMENDATION_SHARED_TTL_SECONDS = int(os.getenv("RECOMMENDATION_SHARED_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def build_fingerprint(profile: PersonaProfile, history_version: int, request: RecommendationRequest) -> str:
+    """Hash everything that shapes a recommendation response, except the requested count"""
+    payload = {
+        "profile": profile.model_dump(mode="json"),
+        "history_version": history_version,
+        "include_reasoning": request.include_reasoning,
+        "prompt_mode": request.prompt_mode.value,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def normalize_choice(choice: str) -> str:
+    return " ".join(choice.lower().split())
+
+
+def build_demographic_key(profile: PersonaProfile) -> str:
+    """Normalize the demographic fields of a profile, with age bucketed"""
+    return "|".join([
+        bucket_age(profile.age),
+        profile.gender.lower(),
+        profile.occasion.lower(),
+        profile.relationship.lower(),
+        (profile.budget or "any").lower(),
+    ])
+
+
+def profile_choices(profile: PersonaProfile) -> List[str]:
+    """Sorted, de-duplicated, normalized selected choices of a profile"""
+    return sorted({normalize_choice(insight.selected_choice) for insight in profile.question_insights})
+
+
+def build_profile_signature(demographic_key: str, choices: List[str]) -> str:
+    """Canonical signature of a normalized profile"""
+    return hashlib.sha256(json.dumps([demographic_key, choices]).encode()).hexdigest()
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class RecommendationCacheRepository:
+    """Stores and looks up cached recommendation responses
+
+    Changes are left pending in the session and committed with the caller's
+    transaction.
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        enabled: bool = RECOMMENDATION_CACHE_ENABLED,
+        ttl_seconds: int = RECOMMENDATION_CACHE_TTL_SECONDS,
+    ):
+        self.session = session
+        self.enabled = enabled
+        self.ttl = timedelta(seconds=ttl_seconds)
+
+    async def get(self, persona_id: UUID, fingerprint: str) -> Optional[Tuple[RecommendationResponse, int]]:
+        """Return the fresh cached response for the fingerprint and the count it was generated for, if any"""
+        if not self.enabled:
+            return None
+
+        result = await self.session.execute(
+            select(RecommendationCache.response, RecommendationCache.requested_count).where(
+                RecommendationCache.persona_id == persona_id,
+                RecommendationCache.fingerprint == fingerprint,
+                RecommendationCache.created_at >= utcnow() - self.ttl,
+            )
+        )
+        row = result.first()
+        if row is None:
+            return None
+        return RecommendationResponse.model_validate(row.response), row.requested_count
+
+    async def put(self, persona_id: UUID, fingerprint: str, response: RecommendationResponse, requested_count: int) -> None:
+        """Replace the cached response for the fingerprint"""
+        if not self.enabled:
+            return
+
+        await self.session.execute(
+            delete(RecommendationCache).where(
+                RecommendationCache.persona_id == persona_id,
+                RecommendationCache.fingerprint == fingerprint,
+            )
+        )
+        self.session.add(RecommendationCache(
+            persona_id=persona_id,
+            fingerprint=fingerprint,
+            response=response.model_dump(mode="json"),
+            requested_count=requested_count,
+        ))
+
+    async def invalidate(self, persona_ids: Iterable[UUID]) -> None:
+        """Drop every cached response of the given personas"""
+        persona_ids = list(persona_ids)
+        if not self.enabled or not persona_ids:
+            return
+
+        await self.session.execute(
+            delete(RecommendationCache).where(RecommendationCache.persona_id.in_(persona_ids))
+        )
+
+
+class SharedRecommendationCacheRepository:
+    """Reuses recommendation lists across personas with matching normalized profiles
+
+    Changes are left pending in the session and committed with the caller's
+    transaction.
+    """
+
+    def __init__(
+        self,
+        session: AsyncSession,
+        enabled: bool = RECOMMENDATION_SHARED_CACHE_ENABLED,
+        similarity: float = RECOMMENDATION_SHARED_SIMILARITY,
+        candidates: int = RECOMMENDATION_SHARED_CANDIDATES,
+        ttl_seconds: int = RECOMMENDATION_SHARED_TTL_SECONDS,
+    ):
+        self.session = session
+        self.enabled = enabled
+        self.similarity = similarity
+        self.candidates = candidates
+        self.ttl = timedelta(seconds=ttl_seconds)
+
+    async def find(self, profile: PersonaProfile) -> Optional[List[GiftRecommendation]]:
+        """Return the recommendations of an exact or close enough stored profile, if any"""
+        if not self.enabled:
+            return None
+
+        demographic_key = build_demographic_key(profile)
+        choices = profile_choices(profile)
+        signature = build_profile_signature(demographic_key, choices)
+        fresh = SharedRecommendationCache.created_at >= utcnow() - self.ttl
+
+        result = await self.session.execute(
+            select(SharedRecommendationCache)
+            .where(SharedRecommendationCache.signature == signature, fresh)
+            .limit(1)
+        )
+        match = result.scalars().first()
+
+        if match is None and self.similarity < 1.0:
+            result = await self.session.execute(
+                select(SharedRecommendationCache)
+                .where(SharedRecommendationCache.demographic_key == demographic_key, fresh)
+                .order_by(SharedRecommendationCache.hit_count.desc())
+                .limit(self.candidates)
+            )
+            wanted = set(choices)
+            best = 0.0
+            for candidate in result.scalars():
+                score = jaccard(wanted, set(candidate.choices))
+                if score >= self.similarity and score > best:
+                    match, best = candidate, score
+
+        if match is None:
+            return None
+
+        await self.session.execute(
+            update(SharedRecommendationCache)
+            .where(SharedRecommendationCache.id == match.id)
+            .values(hit_count=SharedRecommendationCache.hit_count + 1)
+        )
+        return [GiftRecommendation.model_validate(item) for item in match.recommendations]
+
+    async def put(self, profile: PersonaProfile, recommendations: List[GiftRecommendation]) -> None:
+        """Store freshly generated recommendations under the profile's signature"""
+        if not self.enabled or not recommendations:
+            return
+
+        demographic_key = build_demographic_key(profile)
+        choices = profile_choices(profile)
+        signature = build_profile_signature(demographic_key, choices)
+        await self.session.execute(
+            delete(SharedRecommendationCache).where(SharedRecommendationCache.signature == signature)
+        )
+        self.session.add(SharedRecommendationCache(
+            demographic_key=demographic_key,
+            signature=signature,
+            choices=choices,
+            recommendations=[rec.model_dump(mode="json") for rec in recommendations],
+        ))
+
+
+class RecommendationBatchRepository:
+    """Stores the pages of additional recommendations generated for a persona
+
+    Changes are left pending in the session and committed with the caller's
+    transaction.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def list_pages(self, persona_id: UUID, fingerprint: str) -> List[List[GiftRecommendation]]:
+        """Every stored page for the fingerprint, in page order"""
+        result = await self.session.execute(
+            select(RecommendationBatch.recommendations).where(
+                RecommendationBatch.persona_id == persona_id,
+                RecommendationBatch.fingerprint == fingerprint,
+            ).order_by(RecommendationBatch.page)
+        )
+        return [[GiftRecommendation.model_validate(item) for item in page] for page in result.scalars()]
+
+    async def add(self, persona_id: UUID, fingerprint: str, page: int, recommendations: List[GiftRecommendation]) -> None:
+        self.session.add(RecommendationBatch(
+            persona_id=persona_id,
+            fingerprint=fingerprint,
+            page=page,
+            recommendations=[rec.model_dump(mode="json") for rec in recommendations],
+        ))
+
+    async def invalidate(self, persona_ids: Iterable[UUID]) -> None:
+        """Drop every stored page of the given personas"""
+        persona_ids = list(persona_ids)
+        if not persona_ids:
+            return
+
+        await self.session.execute(
+            delete(RecommendationBatch).where(RecommendationBatch.persona_id.in_(persona_ids))
+        )
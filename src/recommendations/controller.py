@@ -1,18 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException
-from ..database.core import get_db
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response, status
+from typing import Optional
+from ..streaming import event_stream_response
+from ..jobs.models import JobResponse
+from ..jobs.service import JobService, get_job_service
+from ..llm.admission import shed_load
+from ..llm.executor import Lane
+from ..rate_limiter import rate_limit, RATE_LIMIT_COST_RECOMMENDATIONS
 from .service import get_recommendation_service, RecommendationService
-from .models import RecommendationRequest, RecommendationResponse
+from .models import RecommendationRequest, RecommendationResponse, RecommendationPage, PromptMode, RECOMMENDATION_PROMPT_MODE, RECOMMENDATION_MAX_COUNT, DEFAULT_RECOMMENDATION_COUNT
 from uuid import UUID
-import asyncio
 
 router = APIRouter()
 
-@router.post("/personas/{persona_id}/recommendations", response_model=RecommendationResponse)
+@router.post(
+    "/personas/{persona_id}/recommendations",
+    response_model=RecommendationResponse,
+    dependencies=[Depends(rate_limit(RATE_LIMIT_COST_RECOMMENDATIONS)), Depends(shed_load(Lane.recommendations))],
+)
 async def get_gift_recommendations(
     persona_id: UUID,
-    max_recommendations: int = 5,
+    max_recommendations: int = Query(DEFAULT_RECOMMENDATION_COUNT, ge=1, le=RECOMMENDATION_MAX_COUNT),
     include_reasoning: bool = True,
-    session = Depends(get_db)
+    refresh: bool = False,
+    prompt_mode: PromptMode = RECOMMENDATION_PROMPT_MODE,
+    service: RecommendationService = Depends(get_recommendation_service),
 ):
     """
     Generate personalized gift recommendations based on persona and question answers.
@@ -21,17 +32,23 @@ async def get_gift_recommendations(
     - Persona details (age, gender, occasion, budget, relationship)
     - All question-answer pairs to understand recipient's personality and interests
     - Provides intelligent, contextual gift suggestions with reasoning
+    
+    Exactly `max_recommendations` gifts are generated. Repeat calls with an
+    unchanged profile return the cached result, and asking for more than was
+    cached only generates the missing gifts; pass `refresh=true` to force a
+    new generation. `prompt_mode=profile` renders the
+    prompt from the collected answers alone instead of replaying the conversation.
     """
     try:
-        service = get_recommendation_service(session)
         request = RecommendationRequest(
             persona_id=persona_id,
             max_recommendations=max_recommendations,
-            include_reasoning=include_reasoning
+            include_reasoning=include_reasoning,
+            prompt_mode=prompt_mode,
         )
         
         # Generate recommendations (this maintains full context)
-        recommendations = await service.get_recommendations(request)
+        recommendations = await service.get_recommendations(request, refresh=refresh)
         
         return recommendations
         
@@ -40,10 +57,107 @@ async def get_gift_recommendations(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate recommendations: {str(e)}")
 
-@router.get("/personas/{persona_id}/profile", response_model=dict)
+@router.post(
+    "/personas/{persona_id}/recommendations/stream",
+    dependencies=[Depends(rate_limit(RATE_LIMIT_COST_RECOMMENDATIONS)), Depends(shed_load(Lane.recommendations))],
+)
+async def stream_gift_recommendations(
+    persona_id: UUID,
+    max_recommendations: int = Query(DEFAULT_RECOMMENDATION_COUNT, ge=1, le=RECOMMENDATION_MAX_COUNT),
+    include_reasoning: bool = True,
+    refresh: bool = False,
+    prompt_mode: PromptMode = RECOMMENDATION_PROMPT_MODE,
+    accept: Optional[str] = Header(None),
+    service: RecommendationService = Depends(get_recommendation_service),
+):
+    """
+    Streaming variant of the recommendations endpoint.
+    
+    Emits a `recommendation` event per gift as soon as it is generated, then a
+    final `summary` event with `recipient_summary` and `confidence_level`.
+    Sends Server-Sent Events for `Accept: text/event-stream`, NDJSON otherwise.
+    """
+    # The session dependency is only closed once the response has been sent, so it outlives the stream
+    try:
+        request = RecommendationRequest(
+            persona_id=persona_id,
+            max_recommendations=max_recommendations,
+            include_reasoning=include_reasoning,
+            prompt_mode=prompt_mode,
+        )
+        events = await service.stream_recommendations(request, refresh=refresh)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate recommendations: {str(e)}")
+    
+    return event_stream_response(events, accept)
+
+@router.post(
+    "/personas/{persona_id}/recommendations/next",
+    response_model=RecommendationPage,
+    dependencies=[Depends(rate_limit(RATE_LIMIT_COST_RECOMMENDATIONS)), Depends(shed_load(Lane.recommendations))],
+)
+async def get_next_gift_recommendations(
+    persona_id: UUID,
+    max_recommendations: int = Query(DEFAULT_RECOMMENDATION_COUNT, ge=1, le=RECOMMENDATION_MAX_COUNT),
+    page: Optional[int] = Query(None, ge=1),
+    include_reasoning: bool = True,
+    prompt_mode: PromptMode = RECOMMENDATION_PROMPT_MODE,
+    service: RecommendationService = Depends(get_recommendation_service),
+):
+    """
+    Get a page of additional gift recommendations for the same profile.
+    
+    Only `max_recommendations` new gifts are generated, excluding everything
+    already recommended for the unchanged profile. Pages are stored: omit
+    `page` for the next new one, or pass an earlier `page` to read it again
+    without a new generation. New answers start the pages over.
+    """
+    try:
+        request = RecommendationRequest(
+            persona_id=persona_id,
+            max_recommendations=max_recommendations,
+            include_reasoning=include_reasoning,
+            prompt_mode=prompt_mode,
+        )
+        return await service.get_next_recommendations(request, page=page)
+        
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate recommendations: {str(e)}")
+
+@router.post(
+    "/personas/{persona_id}/recommendations/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=JobResponse,
+    dependencies=[Depends(rate_limit(RATE_LIMIT_COST_RECOMMENDATIONS))],
+)
+async def enqueue_gift_recommendations(
+    persona_id: UUID,
+    response: Response,
+    max_recommendations: int = Query(DEFAULT_RECOMMENDATION_COUNT, ge=1, le=RECOMMENDATION_MAX_COUNT),
+    include_reasoning: bool = True,
+    refresh: bool = False,
+    prompt_mode: PromptMode = RECOMMENDATION_PROMPT_MODE,
+    jobs: JobService = Depends(get_job_service),
+):
+    """Generate recommendations in the background; poll GET /jobs/{id} for the result"""
+    job = await jobs.enqueue("recommendations", {
+        "persona_id": str(persona_id),
+        "max_recommendations": max_recommendations,
+        "include_reasoning": include_reasoning,
+        "refresh": refresh,
+        "prompt_mode": prompt_mode.value,
+    })
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return job
+
+@router.get("/personas/{persona_id}/profile", response_model=dict, dependencies=[Depends(rate_limit())])
 async def get_persona_profile_summary(
     persona_id: UUID,
-    session = Depends(get_db)
+    service: RecommendationService = Depends(get_recommendation_service),
 ):
     """
     Get a complete summary of the persona profile including all collected insights.
@@ -51,9 +165,8 @@ async def get_persona_profile_summary(
     This is useful for debugging or showing users what information has been collected.
     """
     try:
-        service = get_recommendation_service(session)
         # Build the profile (same as used for recommendations)
-        profile = service._build_persona_profile(persona_id)
+        profile = await service._build_persona_profile(persona_id)
         
         return {
             "persona_details": {
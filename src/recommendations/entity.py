@@ -0,0 +1,56 @@
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+import uuid
+from ..database.core import Base, utcnow
+from ..build_persona.entity import Persona
+
+
+class RecommendationCache(Base):
+    """Last generated recommendations for a persona, keyed by the fingerprint of what produced them"""
+    __tablename__ = 'recommendation_cache'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    persona_id = Column(UUID(as_uuid=True), ForeignKey('personas.id'), nullable=False, index=True)
+    fingerprint = Column(String(64), nullable=False)  # See recommendations/cache.py
+    response = Column(JSONB, nullable=False)  # Serialized RecommendationResponse
+    requested_count = Column(Integer, nullable=False, default=0)  # max_recommendations the response was generated for
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f"<RecommendationCache(persona_id='{self.persona_id}', fingerprint='{self.fingerprint}')>"
+
+
+class SharedRecommendationCache(Base):
+    """Recommendations reused across personas whose normalized profiles match or nearly match"""
+    __tablename__ = 'shared_recommendation_cache'
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    demographic_key = Column(String, nullable=False, index=True)  # Bucketed age, gender, occasion, relationship, budget
+    signature = Column(String(64), nullable=False, index=True)  # Hash of demographic_key + sorted choices
+    choices = Column(JSONB, nullable=False)  # Sorted, normalized selected choices
+    recommendations = Column(JSONB, nullable=False)  # [GiftRecommendation]
+    hit_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f"<SharedRecommendationCache(demographic_key='{self.demographic_key}', hit_count={self.hit_count})>"
+
+
+class RecommendationBatch(Base):
+    """One page of additional recommendations served by POST /personas/{id}/recommendations/next"""
+    __tablename__ = 'recommendation_batches'
+    __table_args__ = (
+        Index('ix_recommendation_batches_persona_id_page', 'persona_id', 'page'),
+        # Concurrent requests for the next page race on the same number; one of them wins
+        UniqueConstraint('persona_id', 'fingerprint', 'page', name='uq_recommendation_batches_persona_id_fingerprint_page'),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    persona_id = Column(UUID(as_uuid=True), ForeignKey('personas.id'), nullable=False)
+    fingerprint = Column(String(64), nullable=False)  # Profile state the page was generated for, see recommendations/cache.py
+    page = Column(Integer, nullable=False)  # 1-based within the persona and fingerprint
+    recommendations = Column(JSONB, nullable=False)  # [GiftRecommendation]
+    created_at = Column(DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f"<RecommendationBatch(persona_id='{self.persona_id}', page={self.page})>"
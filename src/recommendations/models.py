@@ -1,7 +1,21 @@
-from pydantic import BaseModel
+import os
+from enum import Enum
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from uuid import UUID
 
+
+class PromptMode(str, Enum):
+    """How the recommendation prompt conveys what was learned about the recipient"""
+    history = "history"  # Replay the (shaped) question conversation before the prompt
+    profile = "profile"  # Render the prompt from the PersonaProfile alone, without history
+
+
+RECOMMENDATION_PROMPT_MODE = PromptMode(os.getenv("RECOMMENDATION_PROMPT_MODE", PromptMode.history.value))
+# Upper bound for max_recommendations; the model generates exactly the requested count
+RECOMMENDATION_MAX_COUNT = int(os.getenv("RECOMMENDATION_MAX_COUNT", "10"))
+DEFAULT_RECOMMENDATION_COUNT = 5
+
 class PersonaProfile(BaseModel):
     """Complete profile including persona details and question answers"""
     persona_id: UUID
@@ -34,8 +48,9 @@ class GiftRecommendation(BaseModel):
 class RecommendationRequest(BaseModel):
     """Request for gift recommendations"""
     persona_id: UUID
-    max_recommendations: int = 5
+    max_recommendations: int = Field(DEFAULT_RECOMMENDATION_COUNT, ge=1, le=RECOMMENDATION_MAX_COUNT)
     include_reasoning: bool = True
+    prompt_mode: PromptMode = RECOMMENDATION_PROMPT_MODE
 
 class RecommendationResponse(BaseModel):
     """Response containing gift recommendations"""
@@ -45,5 +60,12 @@ class RecommendationResponse(BaseModel):
     total_recommendations: int
     confidence_level: str  # "high", "medium", "low"
 
+class RecommendationPage(BaseModel):
+    """One page of additional, non-duplicate gift recommendations"""
+    persona_id: UUID
+    page: int  # 1-based
+    recommendations: List[GiftRecommendation]
+    total_recommendations: int  # Distinct recommendations served so far, including this page
+
 # Update forward references
 PersonaProfile.model_rebuild()
\ No newline at end of file
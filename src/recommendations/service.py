@@ -1,4 +1,4 @@
-from ..database.core import DbSession
+from ..database.core import AsyncDbSession, AsyncSessionFactory, session_factory_for
 from ..build_persona.entity import Persona
 from ..questions.entity import Question, Answer
 from .models import (
@@ -6,38 +6,220 @@ from .models import (
     QuestionInsight, 
     RecommendationRequest, 
     RecommendationResponse,
-    GiftRecommendation
+    GiftRecommendation,
+    PromptMode,
+    RecommendationPage,
 )
-from .agent import gift_recommendation_agent
-from typing import List, Dict
+from .agent import gift_recommendation_agent, exclude_duplicates
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
+from pydantic_ai.messages import ModelMessage
 from uuid import UUID
-import asyncio
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from ..messages.repository import MessageRepository
+from ..messages.shaping import shape_history
+from ..singleflight import create_single_flight
+from .cache import RecommendationCacheRepository, SharedRecommendationCacheRepository, RecommendationBatchRepository, build_fingerprint
+
+
+# Coalesces concurrent identical recommendation requests onto one agent call
+recommendation_flights = create_single_flight("recommendations")
 
 class RecommendationService:
     """Service to generate personalized gift recommendations"""
     
-    def __init__(self, session: DbSession):
+    def __init__(self, session: AsyncDbSession, session_factory: Optional[async_sessionmaker] = None):
         self.session = session
+        # Opens the sessions of coalesced flights, which outlive the caller's
+        self.session_factory = session_factory or session_factory_for(session)
         self.message_repo = MessageRepository(session)
+        self.recommendation_cache = RecommendationCacheRepository(session)
+        self.shared_cache = SharedRecommendationCacheRepository(session)
+        self.batches = RecommendationBatchRepository(session)
     
-    async def get_recommendations(self, request: RecommendationRequest) -> RecommendationResponse:
-        """Generate gift recommendations for a persona based on all collected data"""
-        
+    async def get_recommendations(self, request: RecommendationRequest, refresh: bool = False) -> RecommendationResponse:
+        """Generate gift recommendations for a persona based on all collected data
+
+        Unchanged profiles and histories are answered from the recommendation
+        cache; asking for more items than were cached only generates the
+        missing ones. ``refresh`` forces a new generation.
+        """
+        key = (request.persona_id, request.max_recommendations, request.include_reasoning, request.prompt_mode, refresh)
+        return await recommendation_flights.do(
+            key, lambda: self._in_own_session(lambda service: service._generate_recommendations(request, refresh))
+        )
+
+    async def _in_own_session(self, generate):
+        # The shielded flight outlives a cancelled leader request, so it must not share that request's session
+        async with self.session_factory() as db:
+            return await generate(RecommendationService(db, self.session_factory))
+    
+    async def _generate_recommendations(self, request: RecommendationRequest, refresh: bool = False) -> RecommendationResponse:
         # 1. Build complete profile from persona + question answers
-        profile = self._build_persona_profile(request.persona_id)
+        profile = await self._build_persona_profile(request.persona_id)
+        
+        # Serve the previous response when nothing that shapes it has changed
+        history_version = await self.message_repo.get_history_version(request.persona_id)
+        fingerprint = build_fingerprint(profile, history_version, request)
+        recommendations, cached = await self._find_existing(request, profile, fingerprint, refresh)
+        if cached:
+            return self._build_response(request, profile, recommendations)
+        
+        missing = request.max_recommendations - len(recommendations)
+        if missing > 0:
+            # 2. Load message history from repository, condensed to the prompt token budget
+            message_history = await self._load_prompt_history(request)
+            # End the read transaction so no pooled connection is held while the model runs
+            await self.session.commit()
+            
+            # 3. Generate only the missing recommendations using the AI agent with conversation context
+            generated = await gift_recommendation_agent.generate_recommendations(
+                profile, message_history, request.prompt_mode, count=missing, exclude=recommendations,
+            )
+            recommendations = recommendations + exclude_duplicates(generated, recommendations)
+            await self.shared_cache.put(profile, recommendations)
         
-        # 2. Load message history from repository
-        message_history = await self.message_repo.load_all_messages(request.persona_id)
+        # 4-5. Limit, score and summarize
+        response = self._build_response(request, profile, recommendations)
         
-        # 3. Generate recommendations using the AI agent with conversation context
-        recommendations = await gift_recommendation_agent.generate_recommendations(profile, message_history)
+        # 6. Cache the response under the profile fingerprint
+        await self.recommendation_cache.put(request.persona_id, fingerprint, response, request.max_recommendations)
+        await self.session.commit()
         
-        # 4. Limit to requested number and calculate confidence
+        return response
+    
+    async def _find_existing(
+        self, request: RecommendationRequest, profile: PersonaProfile, fingerprint: str, refresh: bool
+    ) -> Tuple[List[GiftRecommendation], bool]:
+        """Recommendations already available for the request, and whether they are the persona's cached answer
+
+        A cached response generated for at least the requested count answers
+        the request even when the model returned fewer items. Otherwise its
+        items (or those of a matching profile in the shared cache) are reused
+        and only the missing ones are generated.
+        """
+        if refresh:
+            return [], False
+        
+        cached = await self.recommendation_cache.get(request.persona_id, fingerprint)
+        if cached is not None:
+            response, requested_count = cached
+            if requested_count >= request.max_recommendations:
+                return response.recommendations[:request.max_recommendations], True
+            if response.recommendations:
+                return response.recommendations, False
+        
+        # Popular profiles reuse the recommendations of a matching persona instead of calling the agent
+        shared = await self.shared_cache.find(profile) or []
+        return shared[:request.max_recommendations], False
+    
+    async def stream_recommendations(self, request: RecommendationRequest, refresh: bool = False) -> AsyncIterator[Tuple[str, Any]]:
+        """Return an event stream of the recommendations followed by a summary event
+
+        The profile is built before the stream is returned, so an unknown
+        persona raises ``ValueError`` while a status code can still be sent.
+        Each ``recommendation`` event is emitted as soon as the agent has
+        finished that item; cached items come first when topping up.
+        Streams are not coalesced across requests.
+        """
+        profile = await self._build_persona_profile(request.persona_id)
+        return self._stream_recommendation_events(request, profile, refresh)
+    
+    async def _stream_recommendation_events(self, request: RecommendationRequest, profile: PersonaProfile, refresh: bool) -> AsyncIterator[Tuple[str, Any]]:
+        history_version = await self.message_repo.get_history_version(request.persona_id)
+        fingerprint = build_fingerprint(profile, history_version, request)
+        
+        existing, cached = await self._find_existing(request, profile, fingerprint, refresh)
+        missing = request.max_recommendations - len(existing)
+        generate = not cached and missing > 0
+        message_history = await self._load_prompt_history(request) if generate else None
+        # End the read transaction before writing to the client or calling the model
+        await self.session.commit()
+        for recommendation in existing:
+            yield "recommendation", recommendation
+        
+        recommendations = list(existing)
+        if generate:
+            generated = gift_recommendation_agent.stream_recommendations(
+                profile, message_history, request.prompt_mode, count=missing, exclude=existing,
+            )
+            async for recommendation in generated:
+                if len(recommendations) < request.max_recommendations and exclude_duplicates([recommendation], recommendations):
+                    yield "recommendation", recommendation
+                    recommendations.append(recommendation)
+            await self.shared_cache.put(profile, recommendations)
+        
+        response = self._build_response(request, profile, recommendations)
+        if not cached:
+            await self.recommendation_cache.put(request.persona_id, fingerprint, response, request.max_recommendations)
+            await self.session.commit()
+        yield "summary", self._summary_event(response)
+    
+    async def get_next_recommendations(self, request: RecommendationRequest, page: Optional[int] = None) -> RecommendationPage:
+        """Return ``page`` of additional recommendations, or the next new page when ``page`` is None
+
+        Each new page asks the agent for ``max_recommendations`` gifts only,
+        excluding everything already served for the unchanged profile (the
+        cached recommendations and all earlier pages). Stored pages are
+        returned again without calling the agent.
+        """
+        key = ("next", request.persona_id, page, request.max_recommendations, request.include_reasoning, request.prompt_mode)
+        return await recommendation_flights.do(
+            key, lambda: self._in_own_session(lambda service: service._generate_next_recommendations(request, page))
+        )
+    
+    async def _generate_next_recommendations(self, request: RecommendationRequest, page: Optional[int]) -> RecommendationPage:
+        profile = await self._build_persona_profile(request.persona_id)
+        history_version = await self.message_repo.get_history_version(request.persona_id)
+        fingerprint = build_fingerprint(profile, history_version, request)
+        
+        pages = await self.batches.list_pages(request.persona_id, fingerprint)
+        cached = await self.recommendation_cache.get(request.persona_id, fingerprint)
+        served = (cached[0].recommendations if cached is not None else []) + [rec for stored in pages for rec in stored]
+        
+        if page is not None and page <= len(pages):
+            served_through = len(served) - sum(len(stored) for stored in pages[page:])
+            return RecommendationPage(
+                persona_id=request.persona_id, page=page, recommendations=pages[page - 1], total_recommendations=served_through,
+            )
+        if page is not None and page != len(pages) + 1:
+            raise ValueError(f"Recommendation page {page} not found; the next page is {len(pages) + 1}")
+        
+        message_history = await self._load_prompt_history(request)
+        # End the read transaction so no pooled connection is held while the model runs
+        await self.session.commit()
+        generated = await gift_recommendation_agent.generate_recommendations(
+            profile, message_history, request.prompt_mode, count=request.max_recommendations, exclude=served,
+        )
+        recommendations = exclude_duplicates(generated, served)
+        
+        await self.batches.add(request.persona_id, fingerprint, len(pages) + 1, recommendations)
+        try:
+            await self.session.commit()
+        except IntegrityError:
+            # A concurrent request stored this page first; serve its recommendations instead
+            await self.session.rollback()
+            return await self._generate_next_recommendations(request, len(pages) + 1)
+        return RecommendationPage(
+            persona_id=request.persona_id,
+            page=len(pages) + 1,
+            recommendations=recommendations,
+            total_recommendations=len(served) + len(recommendations),
+        )
+    
+    async def _load_prompt_history(self, request: RecommendationRequest) -> Optional[List[ModelMessage]]:
+        """History replayed before the prompt; profile mode renders the prompt from the profile instead"""
+        if request.prompt_mode == PromptMode.profile:
+            return None
+        return shape_history(await self.message_repo.load_all_messages(request.persona_id))
+    
+    def _build_response(self, request: RecommendationRequest, profile: PersonaProfile, recommendations: List[GiftRecommendation]) -> RecommendationResponse:
+        # Limit to requested number and calculate confidence
         limited_recommendations = recommendations[:request.max_recommendations]
         confidence_level = self._calculate_confidence_level(limited_recommendations, len(profile.question_insights))
         
-        # 5. Build recipient summary
+        # Build recipient summary
         recipient_summary = self._build_recipient_summary(profile)
         
         return RecommendationResponse(
@@ -48,18 +230,30 @@ class RecommendationService:
             confidence_level=confidence_level
         )
     
-    def _build_persona_profile(self, persona_id: UUID) -> PersonaProfile:
+    def _summary_event(self, response: RecommendationResponse) -> Dict:
+        return {
+            "persona_id": response.persona_id,
+            "recipient_summary": response.recipient_summary,
+            "total_recommendations": response.total_recommendations,
+            "confidence_level": response.confidence_level,
+        }
+    
+    async def _build_persona_profile(self, persona_id: UUID) -> PersonaProfile:
         """Build complete persona profile including question insights"""
         
         # Get persona details
-        persona = self.session.query(Persona).filter(Persona.id == persona_id).first()
+        persona = await self.session.get(Persona, persona_id)
         if not persona:
             raise ValueError(f"Persona not found: {persona_id}")
         
         # Get all questions and answers for this persona
-        questions_with_answers = self.session.query(Question, Answer).join(
-            Answer, Question.id == Answer.question_id
-        ).filter(Question.persona_id == persona_id).all()
+        result = await self.session.execute(
+            select(Question, Answer).join(
+                Answer, Question.id == Answer.question_id
+            ).where(Question.persona_id == persona_id)
+            .order_by(Question.created_at, Answer.created_at)  # Stable order keeps the profile fingerprint stable
+        )
+        questions_with_answers = result.all()
         
         # Build question insights
         question_insights = []
@@ -150,5 +344,5 @@ class RecommendationService:
         
         return base_summary
 
-def get_recommendation_service(session: DbSession) -> RecommendationService:
-    return RecommendationService(session)
\ No newline at end of file
+def get_recommendation_service(session: AsyncDbSession, session_factory: AsyncSessionFactory) -> RecommendationService:
+    return RecommendationService(session, session_factory)
\ No newline at end of file
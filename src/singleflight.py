@@ -0,0 +1,93 @@
+"""Single-flight coalescing of concurrent identical calls
+
+Double clicks and client retries would otherwise start one LLM call each.
+Calls sharing a key join the call already in flight and receive its result.
+The advisory-lock variant additionally serializes leaders across workers
+with a Postgres advisory lock, so a request on another worker waits for the
+first one and can pick up what it stored instead of calling the model again.
+"""
+import asyncio
+import hashlib
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from .database.core import async_engine
+
+
+T = TypeVar("T")
+
+# "memory" (single worker) or "advisory" (Postgres advisory locks across workers)
+SINGLEFLIGHT_BACKEND = os.getenv("SINGLEFLIGHT_BACKEND", "memory")
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one in-flight call and its result"""
+    distributed = False
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run ``fn`` unless a call for ``key`` is already in flight, and return the shared result"""
+        task = self._calls.get(key)
+        if task is None:
+            # Run as a task so a cancelled leader does not cancel the call its followers wait on
+            task = asyncio.ensure_future(self._run(key, fn))
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    async def exclusive(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run ``fn`` under the key's cross-worker lock without offering its result to callers of ``do``"""
+        return await self._run(key, fn)
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        return await fn()
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Mark as retrieved when nobody is left waiting
+
+
+def advisory_lock_id(namespace: str, key: Any) -> int:
+    """Map a namespaced key onto a signed 64-bit advisory lock id"""
+    digest = hashlib.blake2b(f"{namespace}:{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class AdvisoryLockSingleFlight(SingleFlight):
+    """Single-flight that also holds a Postgres advisory lock per key while the call runs
+
+    The lock is taken on a dedicated pooled connection for the duration of the
+    call. On other databases (SQLite in tests) it behaves like ``SingleFlight``.
+    """
+    distributed = True
+
+    def __init__(self, namespace: str, engine: Optional[AsyncEngine] = None):
+        super().__init__(namespace)
+        self.engine = engine or async_engine
+
+    async def _run(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        if self.engine.dialect.name != "postgresql":
+            return await fn()
+
+        lock_id = advisory_lock_id(self.namespace, key)
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT pg_advisory_lock(:lock_id)"), {"lock_id": lock_id})
+            try:
+                return await fn()
+            finally:
+                await conn.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": lock_id})
+
+
+def create_single_flight(namespace: str, backend: str = SINGLEFLIGHT_BACKEND) -> SingleFlight:
+    if backend == "advisory":
+        return AdvisoryLockSingleFlight(namespace)
+    return SingleFlight(namespace)
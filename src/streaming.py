@@ -0,0 +1,51 @@
+"""Incremental responses as NDJSON (default) or Server-Sent Events
+
+Streaming services yield ``(event, data)`` pairs. Clients sending
+``Accept: text/event-stream`` receive SSE frames, everyone else one JSON
+object per line. A failure after the first byte can no longer change the
+status code, so it is reported as a final ``error`` event instead.
+"""
+import json
+import logging
+from typing import Any, AsyncIterator, Optional, Tuple
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+def wants_sse(accept: Optional[str]) -> bool:
+    return bool(accept) and SSE_MEDIA_TYPE in accept
+
+
+def encode_event(event: str, data: Any, sse: bool = False) -> bytes:
+    payload = json.dumps(jsonable_encoder(data))
+    if sse:
+        return f"event: {event}\ndata: {payload}\n\n".encode()
+    return f'{{"event": {json.dumps(event)}, "data": {payload}}}\n'.encode()
+
+
+def event_stream_response(
+    events: AsyncIterator[Tuple[str, Any]],
+    accept: Optional[str] = None,
+) -> StreamingResponse:
+    """Wrap an event iterator in a streaming response"""
+    sse = wants_sse(accept)
+
+    async def body():
+        try:
+            async for event, data in events:
+                yield encode_event(event, data, sse)
+        except Exception as e:
+            logger.exception("Streaming response failed")
+            yield encode_event("error", {"detail": str(e)}, sse)
+
+    return StreamingResponse(
+        body(),
+        media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # Keep proxies from buffering events
+    )
@@ -4,7 +4,13 @@ from datetime import datetime, timezone
 from uuid import uuid4
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from src.database.core import Base
+from src.build_persona.entity import Persona  # Import models to register them
+from src.questions.entity import Question, Answer, QuestionSetCache  # Import models to register them
+from src.messages.entity import MessageHistory  # Import models to register them
+from src.recommendations.entity import RecommendationCache, SharedRecommendationCache, RecommendationBatch  # Import models to register them
+from src.jobs.entity import Job  # Import models to register them
 from src.rate_limiter import limiter
 
 
@@ -27,9 +33,22 @@ def db_session():
 
 
 @pytest.fixture(scope="function")
-def client(db_session):
+async def async_db_session():
+    # In-memory aiosqlite database shared by the async services
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+    TestingAsyncSessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+    await engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def client(db_session, async_db_session):
     from src.main import app
-    from src.database.core import get_db
+    from src.database.core import get_db, get_async_db, get_async_session_factory, session_factory_for
     
     # Disable rate limiting for tests
     limiter.reset()
@@ -40,7 +59,16 @@ def client(db_session):
         finally:
             db_session.close()
             
+    async def override_get_async_db():
+        yield async_db_session
+
+    def override_get_async_session_factory():
+        # Flights, prefetches and streams open their sessions on the test engine
+        return session_factory_for(async_db_session)
+
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_session_factory] = override_get_async_session_factory
     
     from fastapi.testclient import TestClient
     with TestClient(app) as test_client:
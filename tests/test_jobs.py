@@ -0,0 +1,164 @@
+import pytest
+import asyncio
+from datetime import timedelta
+from uuid import uuid4
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.database.core import utcnow
+from src.jobs.entity import Job, JobStatus
+from src.jobs.service import JobService, JobNotifier
+from src.jobs.worker import JobWorker
+
+
+@pytest.fixture
+def session_factory(async_db_session):
+    """Sessions on the same in-memory database as async_db_session"""
+    return async_sessionmaker(bind=async_db_session.bind, autoflush=False, expire_on_commit=False)
+
+
+def make_worker(session_factory, handlers, notifier=None, **kwargs):
+    return JobWorker(session_factory=session_factory, handlers=handlers, notifier=notifier or JobNotifier(), **kwargs)
+
+
+class TestJobWorker:
+    """Test claiming and executing queued jobs"""
+
+    async def test_runs_job_and_stores_result(self, async_db_session, session_factory):
+        """Test that a queued job is claimed once, executed and marked succeeded"""
+        calls = []
+
+        async def handler(session, payload):
+            calls.append(payload)
+            return {"echo": payload["value"]}
+
+        job = await JobService(async_db_session).enqueue("echo", {"value": 42})
+        worker = make_worker(session_factory, {"echo": handler})
+
+        assert await worker.run_once() is True
+        assert await worker.run_once() is False
+
+        stored = await JobService(async_db_session).get(job.id)
+        assert calls == [{"value": 42}]
+        assert stored.status == JobStatus.succeeded
+        assert stored.result == {"echo": 42}
+        assert stored.attempts == 1
+        assert stored.started_at is not None and stored.finished_at is not None
+
+    async def test_failure_is_recorded(self, async_db_session, session_factory):
+        """Test that handler errors and unknown kinds mark the job failed"""
+        async def handler(session, payload):
+            raise RuntimeError("model unavailable")
+
+        service = JobService(async_db_session)
+        failing = await service.enqueue("flaky", {})
+        unknown = await service.enqueue("missing", {})
+        worker = make_worker(session_factory, {"flaky": handler})
+
+        await worker.run_once()
+        await worker.run_once()
+
+        assert (await service.get(failing.id)).error == "model unavailable"
+        assert (await service.get(unknown.id)).status == JobStatus.failed
+
+    async def test_concurrent_workers_claim_distinct_jobs(self, async_db_session, session_factory):
+        """Test that the compare-and-set claim hands each job to exactly one worker"""
+        seen = []
+
+        async def handler(session, payload):
+            seen.append(payload["n"])
+            await asyncio.sleep(0)
+
+        service = JobService(async_db_session)
+        for n in range(4):
+            await service.enqueue("count", {"n": n})
+        workers = [make_worker(session_factory, {"count": handler}) for _ in range(3)]
+
+        while any(await asyncio.gather(*(worker.run_once() for worker in workers))):
+            pass
+
+        assert sorted(seen) == [0, 1, 2, 3]
+
+    async def test_expired_lease_is_reclaimed(self, async_db_session, session_factory):
+        """Test that a job abandoned by a crashed worker runs again"""
+        async def handler(session, payload):
+            return "done"
+
+        service = JobService(async_db_session)
+        job = await service.enqueue("work", {})
+        await async_db_session.execute(
+            update(Job).where(Job.id == job.id).values(
+                status=JobStatus.running, attempts=1, started_at=utcnow() - timedelta(seconds=600)
+            )
+        )
+        await async_db_session.commit()
+
+        await make_worker(session_factory, {"work": handler}, lease_seconds=300).run_once()
+
+        stored = await service.get(job.id)
+        assert stored.status == JobStatus.succeeded
+        assert stored.attempts == 2
+
+    async def test_exhausted_lease_fails_and_claim_moves_on(self, async_db_session, session_factory):
+        """Test that an abandoned job out of attempts is failed by the claim, which then takes the next job"""
+        async def handler(session, payload):
+            return "done"
+
+        service = JobService(async_db_session)
+        abandoned = await service.enqueue("work", {})
+        queued = await service.enqueue("work", {})
+        await async_db_session.execute(
+            update(Job).where(Job.id == abandoned.id).values(
+                status=JobStatus.running, attempts=3, started_at=utcnow() - timedelta(seconds=600)
+            )
+        )
+        await async_db_session.commit()
+
+        worker = make_worker(session_factory, {"work": handler}, lease_seconds=300, max_attempts=3)
+        assert await worker.run_once() is True
+        assert await worker.run_once() is False
+
+        failed = await service.get(abandoned.id)
+        assert failed.status == JobStatus.failed
+        assert failed.error == "Job lease expired"
+        assert failed.attempts == 3
+        assert (await service.get(queued.id)).status == JobStatus.succeeded
+
+
+class TestJobLongPoll:
+    """Test waiting for job completion"""
+
+    async def test_wait_returns_when_worker_finishes(self, async_db_session, session_factory):
+        """Test that a long-poll is woken by the local worker instead of waiting out the timeout"""
+        notifier = JobNotifier()
+        release = asyncio.Event()
+
+        async def handler(session, payload):
+            await release.wait()
+            return "ready"
+
+        job = await JobService(async_db_session).enqueue("slow", {})
+        worker = make_worker(session_factory, {"slow": handler}, notifier=notifier)
+        running = asyncio.create_task(worker.run_once())
+
+        async with session_factory() as session:
+            waiting = asyncio.create_task(JobService(session, poll_interval=5, notifier=notifier).wait(job.id, 10))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+
+            release.set()
+            finished = await asyncio.wait_for(waiting, 2)
+        await running
+
+        assert finished.status == JobStatus.succeeded
+        assert finished.result == "ready"
+
+    async def test_wait_times_out_with_current_state(self, async_db_session):
+        """Test that an unfinished job is returned as-is after the timeout"""
+        service = JobService(async_db_session, poll_interval=0.01, notifier=JobNotifier())
+        job = await service.enqueue("never", {})
+
+        result = await service.wait(job.id, 0.05)
+
+        assert result.status == JobStatus.queued
+        assert await service.wait(uuid4(), 0.05) is None
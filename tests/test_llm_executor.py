@@ -0,0 +1,182 @@
+import pytest
+import asyncio
+from unittest.mock import patch
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from src.llm.admission import shed_load
+from src.llm.executor import LLMExecutor, LLMTimeoutError, Lane, run_in_lane
+
+
+async def hold(release: asyncio.Event, log: list, label):
+    log.append(label)
+    await release.wait()
+    return label
+
+
+class TestLLMExecutor:
+    """Test bounded concurrency, lane priority and timeouts"""
+
+    async def test_concurrency_is_bounded(self):
+        """Test that no more than max_concurrency calls run at once"""
+        executor = LLMExecutor(max_concurrency=2)
+        release = asyncio.Event()
+        started = []
+
+        tasks = [asyncio.create_task(executor.run(Lane.interactive, lambda i=i: hold(release, started, i))) for i in range(5)]
+        await asyncio.sleep(0.01)
+
+        assert len(started) == 2
+        assert executor.stats()["queued"] == 3
+
+        release.set()
+        assert sorted(await asyncio.gather(*tasks)) == [0, 1, 2, 3, 4]
+        assert executor.stats()["in_flight"] == 0
+        assert executor.stats()["lanes"]["interactive"]["completed"] == 5
+
+    async def test_waiters_are_admitted_by_lane_priority(self):
+        """Test that interactive calls overtake queued recommendations and batch calls"""
+        executor = LLMExecutor(max_concurrency=1)
+        release = asyncio.Event()
+        order = []
+
+        blocker = asyncio.create_task(executor.run(Lane.batch, lambda: hold(release, order, "running")))
+        await asyncio.sleep(0.01)
+        queued = []
+        for lane in (Lane.batch, Lane.recommendations, Lane.interactive, Lane.recommendations):
+            queued.append(asyncio.create_task(executor.run(lane, lambda lane=lane: hold(release, order, lane.name))))
+            await asyncio.sleep(0.01)
+
+        assert executor.stats()["lanes"]["recommendations"]["queued"] == 2
+        release.set()
+        await asyncio.gather(blocker, *queued)
+
+        assert order == ["running", "interactive", "recommendations", "recommendations", "batch"]
+
+    async def test_lane_timeout_covers_queueing_and_execution(self):
+        """Test that both a slow call and a call stuck in the queue fail with LLMTimeoutError"""
+        executor = LLMExecutor(max_concurrency=1, timeouts={Lane.recommendations: 0.05, Lane.batch: 0.05})
+        release = asyncio.Event()
+
+        with pytest.raises(LLMTimeoutError):
+            await executor.run(Lane.recommendations, lambda: hold(release, [], "slow"))
+
+        blocker = asyncio.create_task(executor.run(Lane.interactive, lambda: hold(release, [], "blocker")))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LLMTimeoutError):
+            await executor.run(Lane.batch, lambda: hold(release, [], "queued"))
+
+        release.set()
+        await blocker
+        stats = executor.stats()
+        assert stats["lanes"]["recommendations"]["timed_out"] == 1
+        assert stats["lanes"]["batch"]["timed_out"] == 1
+        assert stats["in_flight"] == 0
+
+    async def test_run_in_lane_overrides_caller_lane(self):
+        """Test that background callers are routed to their lane"""
+        executor = LLMExecutor(max_concurrency=1)
+
+        async def call():
+            return "ok"
+
+        with run_in_lane(Lane.batch):
+            await executor.run(Lane.interactive, call)
+            async with executor.slot(Lane.recommendations) as lane:
+                assert lane == Lane.batch
+
+        lanes = executor.stats()["lanes"]
+        assert lanes["batch"]["completed"] == 2
+        assert lanes["interactive"]["completed"] == 0
+
+    async def test_failed_call_releases_slot(self):
+        """Test that an exception frees the slot for the next caller"""
+        executor = LLMExecutor(max_concurrency=1)
+
+        async def boom():
+            raise RuntimeError("provider down")
+
+        with pytest.raises(RuntimeError):
+            await executor.run(Lane.interactive, boom)
+
+        async def ok():
+            return 1
+
+        assert await executor.run(Lane.interactive, ok) == 1
+        assert executor.stats()["lanes"]["interactive"]["failed"] == 1
+
+
+class TestLoadShedding:
+    """Test queue-wait estimates and 503 admission control"""
+
+    async def test_estimated_wait_sheds_saturated_lanes_only(self):
+        """Test that a lane is shed once its estimated wait passes its threshold"""
+        executor = LLMExecutor(max_concurrency=1, shed_wait_seconds={Lane.interactive: 1.5, Lane.batch: 1.5})
+        executor._latency = 1.0
+        release = asyncio.Event()
+
+        assert executor.retry_after(Lane.batch) is None
+
+        blocker = asyncio.create_task(executor.run(Lane.interactive, lambda: hold(release, [], "running")))
+        await asyncio.sleep(0.01)
+        assert executor.estimate_wait(Lane.batch) == 1.0
+        assert executor.retry_after(Lane.batch) is None
+
+        waiter = asyncio.create_task(executor.run(Lane.batch, lambda: hold(release, [], "queued")))
+        await asyncio.sleep(0.01)
+
+        # The queued batch call is ahead of a new batch call, but not of an interactive one
+        assert executor.estimate_wait(Lane.interactive) == 1.0
+        assert executor.retry_after(Lane.interactive) is None
+        assert executor.estimate_wait(Lane.batch) == 2.0
+        assert executor.retry_after(Lane.batch) == 2
+        assert executor.stats()["lanes"]["batch"]["shed"] == 1
+
+        release.set()
+        await asyncio.gather(blocker, waiter)
+        assert executor.estimate_wait(Lane.batch) == 0.0
+
+    async def test_latency_is_a_moving_average(self):
+        """Test that call durations feed the latency estimate"""
+        executor = LLMExecutor(latency_smoothing=0.5)
+
+        async def call():
+            await asyncio.sleep(0.02)
+
+        assert executor.stats()["latency_ms"] is None
+        await executor.run(Lane.interactive, call)
+        first = executor._latency
+        assert first >= 0.02
+
+        executor._latency = 1.0
+        await executor.run(Lane.interactive, call)
+        assert 0.5 < executor._latency < 0.6
+
+    async def test_disabled_load_shedding_accepts_everything(self):
+        """Test that LLM_LOAD_SHEDDING_ENABLED=false never rejects"""
+        executor = LLMExecutor(max_concurrency=1, shed_wait_seconds={Lane.interactive: 0}, load_shedding=False)
+        executor._latency = 10.0
+        executor._in_flight = 1
+
+        assert executor.retry_after(Lane.interactive) is None
+
+    def test_route_answers_503_with_retry_after(self):
+        """Test that a shed request is rejected before the handler runs"""
+        app = FastAPI()
+        handled = []
+
+        @app.get("/work", dependencies=[Depends(shed_load(Lane.interactive))])
+        async def work():
+            handled.append(True)
+            return {"ok": True}
+
+        client = TestClient(app)
+        with patch("src.llm.admission.llm_executor.retry_after", return_value=7):
+            response = client.get("/work")
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "7"
+        assert handled == []
+
+        with patch("src.llm.admission.llm_executor.retry_after", return_value=None):
+            assert client.get("/work").status_code == 200
@@ -0,0 +1,74 @@
+import httpx
+from huggingface_hub import AsyncInferenceClient
+
+from src.llm.provider import LLMHttpPool, PooledInferenceClient, create_model, pooled_client_supported
+from src.questions_agent.detective import gift_detective
+from src.recommendations.agent import gift_recommendation_agent
+
+
+def make_pool(requests):
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"ok": True})
+    return LLMHttpPool(max_connections=4, max_keepalive_connections=2, http2=False, transport=httpx.MockTransport(handler))
+
+
+class TestLLMHttpPool:
+    """Test the shared model provider HTTP client"""
+
+    async def test_clients_share_one_http_client(self):
+        """Test that every inference client sends its requests through the pool's client"""
+        requests = []
+        pool = make_pool(requests)
+        first = PooledInferenceClient(api_key="hf_x", pool=pool)
+        second = PooledInferenceClient(api_key="hf_x", pool=pool)
+
+        assert await first._get_async_client() is await second._get_async_client() is pool.client
+
+        response = await pool.client.post("https://router.example/v1/chat/completions", json={})
+        assert response.json() == {"ok": True}
+        assert len(requests) == 1
+
+        # Closing an inference client must not close the shared pool
+        await first.close()
+        assert not pool.client.is_closed
+        await pool.aclose()
+
+    async def test_lifespan_start_and_close(self):
+        """Test that the client is opened by start, closed by aclose and reopened on demand"""
+        pool = make_pool([])
+        await pool.start()
+        client = pool.client
+        assert client.timeout.connect == pool.timeout.connect
+
+        await pool.aclose()
+        assert client.is_closed
+        assert pool._client is None
+        assert pool.client is not client
+        await pool.aclose()
+
+    async def test_missing_h2_falls_back_to_http1(self, monkeypatch):
+        """Test that LLM_HTTP2 without the h2 package still yields a working client"""
+        monkeypatch.setattr("src.llm.provider.http2_available", lambda: False)
+        pool = LLMHttpPool(http2=True)
+        assert not pool.client.is_closed
+        await pool.aclose()
+
+    def test_agents_use_pooled_models(self):
+        """Test that both agents are built over the pooled inference client"""
+        model = create_model("some/model", pool=make_pool([]))
+        assert model.model_name == "some/model"
+        assert isinstance(model.client, PooledInferenceClient)
+
+        for agent in (gift_detective, gift_recommendation_agent.agent):
+            assert isinstance(agent.model.client, PooledInferenceClient)
+
+    def test_missing_client_internals_fall_back_to_default_client(self, monkeypatch):
+        """Test that a huggingface_hub without the private hooks still yields a working model"""
+        assert pooled_client_supported()
+        assert not pooled_client_supported(type("OldInferenceClient", (), {}))
+
+        monkeypatch.setattr("src.llm.provider.POOLED_CLIENT_SUPPORTED", False)
+        model = create_model("some/model", pool=make_pool([]))
+        assert isinstance(model.client, AsyncInferenceClient)
+        assert not isinstance(model.client, PooledInferenceClient)
@@ -0,0 +1,112 @@
+import pytest
+from huggingface_hub import ChatCompletionOutput, ChatCompletionStreamOutput
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models import ModelRequestParameters
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+from pydantic_ai.usage import RunUsage
+
+from src.llm.provider import create_model, cached_prompt_tokens
+from src.llm.usage import UsageRecorder
+from src.questions_agent.detective import DETECTIVE_INSTRUCTIONS, gift_detective, get_initial_system_prompt
+from src.questions_agent.models import GiftDependencies
+
+
+USAGE = {"prompt_tokens": 100, "completion_tokens": 5, "total_tokens": 105, "prompt_tokens_details": {"cached_tokens": 80}}
+
+
+def completion(usage=USAGE):
+    return ChatCompletionOutput.parse_obj_as_instance({
+        "id": "chat-1", "created": 1, "model": "some/model", "system_fingerprint": "fp",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "Hello"}}],
+        "usage": usage,
+    })
+
+
+def chunk(content, usage=None):
+    data = {
+        "id": "chat-1", "created": 1, "model": "some/model", "system_fingerprint": "fp",
+        "choices": [{"index": 0, "delta": {"role": "assistant", "content": content}}],
+    }
+    if usage is not None:
+        data["choices"][0]["finish_reason"] = "stop"
+        data["usage"] = usage
+    return ChatCompletionStreamOutput.parse_obj_as_instance(data)
+
+
+class TestCachedTokens:
+    """Test that cached prompt tokens reported by the provider reach the run usage"""
+
+    def test_cached_prompt_tokens(self):
+        """Test reading cached tokens from responses with and without usage details"""
+        assert cached_prompt_tokens(completion()) == 80
+        assert cached_prompt_tokens(completion({"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11})) == 0
+        assert cached_prompt_tokens(chunk("Hi")) == 0
+
+    def test_response_usage_includes_cached_tokens(self):
+        """Test that a non-streamed response keeps its cached token count"""
+        response = create_model("some/model")._process_response(completion())
+        assert response.usage.input_tokens == 100
+        assert response.usage.cache_read_tokens == 80
+
+    async def test_streamed_usage_includes_cached_tokens(self):
+        """Test that the final chunk's cached token count is added to the streamed usage"""
+        async def chunks():
+            yield chunk("Hel")
+            yield chunk("lo", usage=USAGE)
+
+        streamed = await create_model("some/model")._process_streamed_response(chunks(), ModelRequestParameters())
+        async for _ in streamed:
+            pass
+        assert streamed.usage.input_tokens == 100
+        assert streamed.usage.cache_read_tokens == 80
+
+
+class TestUsageRecorder:
+    """Test the per-agent usage totals"""
+
+    def test_stats_split_cached_and_uncached(self):
+        """Test that totals accumulate per agent with the cached share"""
+        recorder = UsageRecorder()
+        recorder.record("detective", RunUsage(requests=1, input_tokens=100, cache_read_tokens=80, output_tokens=10))
+        recorder.record("detective", RunUsage(requests=1, input_tokens=100, cache_read_tokens=0, output_tokens=10))
+        recorder.record("recommendations", RunUsage(requests=1, input_tokens=50, output_tokens=20))
+
+        stats = recorder.stats()
+        assert stats["detective"]["runs"] == 2
+        assert stats["detective"]["cached_input_tokens"] == 80
+        assert stats["detective"]["uncached_input_tokens"] == 120
+        assert stats["detective"]["cached_ratio"] == 0.4
+        assert stats["recommendations"]["cached_ratio"] == 0.0
+
+        recorder.reset()
+        assert recorder.stats() == {}
+
+    def test_ignores_results_without_usage(self):
+        """Test that values other than RunUsage are skipped"""
+        recorder = UsageRecorder()
+        recorder.record("detective", None)
+        assert recorder.stats() == {}
+
+
+class TestPromptLayout:
+    """Test that the static instructions lead every detective request"""
+
+    @pytest.mark.parametrize("age,gender", [(25, "male"), (60, "female")])
+    async def test_instructions_precede_profile(self, age, gender):
+        """Test that the request starts with the shared instructions and ends with the recipient profile"""
+        captured = {}
+
+        def respond(messages, info: AgentInfo) -> ModelResponse:
+            captured["instructions"] = info.instructions
+            captured["prompt"] = messages[-1].parts[-1].content
+            questions = [{"question": "Q?", "choices": ["A", "B", "C", "None of the above"]}] * 5
+            return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"questions": questions, "detective_comment": "Hmm."})])
+
+        deps = GiftDependencies(age=age, gender=gender, occasion="birthday", relationship="friend")
+        with gift_detective.override(model=FunctionModel(respond)):
+            await gift_detective.run(get_initial_system_prompt(deps), deps=deps)
+
+        assert captured["instructions"] == DETECTIVE_INSTRUCTIONS
+        assert captured["prompt"].endswith("Relationship=friend.")
+        assert f"Age={age}, Gender={gender}" in captured["prompt"]
+        assert f"Age={age}" not in DETECTIVE_INSTRUCTIONS
@@ -0,0 +1,308 @@
+import pytest
+from uuid import uuid4
+from pydantic_ai import ModelMessagesTypeAdapter
+from pydantic_ai.messages import ModelRequest, ModelResponse, UserPromptPart, TextPart
+
+from sqlalchemy import select, func
+
+from src.messages.entity import MessageHistory
+from src.messages.repository import MessageRepository
+from src.messages.cache import HistoryCache
+from src.messages.codec import MessageCodec, ZstdCodec, create_codec, decode_messages, load_zstd_dictionaries
+
+
+def train_dictionary(seed: str) -> bytes:
+    """Train a small zstd dictionary on synthetic histories"""
+    import zstandard
+
+    samples = [make_batch(f"{seed} question {i}: does she like {i * 7} things?", f"{seed} answer {i}") for i in range(400)]
+    return zstandard.train_dictionary(2048, samples).as_bytes()
+
+
+def make_batch(question: str, answer: str) -> bytes:
+    """Serialize one question/answer round the same way the services do"""
+    return ModelMessagesTypeAdapter.dump_json([
+        ModelRequest(parts=[UserPromptPart(content=question)]),
+        ModelResponse(parts=[TextPart(content=answer)]),
+    ])
+
+
+class TestMessageRepository:
+    """Test message history persistence against an async SQLite session"""
+
+    async def test_store_and_load_messages(self, async_db_session):
+        """Test that stored batches are loaded back in order"""
+        repo = MessageRepository(async_db_session)
+        persona_id = uuid4()
+
+        await repo.store_messages(persona_id, make_batch("Q1?", "A1"))
+        await repo.store_messages(persona_id, make_batch("Q2?", "A2"))
+
+        messages = await repo.load_all_messages(persona_id)
+
+        assert len(messages) == 4
+        assert messages[0].parts[0].content == "Q1?"
+        assert messages[3].parts[0].content == "A2"
+
+    async def test_load_messages_is_scoped_to_persona(self, async_db_session):
+        """Test that history of other personas is not returned"""
+        repo = MessageRepository(async_db_session)
+        persona_id = uuid4()
+
+        await repo.store_messages(persona_id, make_batch("Q1?", "A1"))
+        await repo.store_messages(uuid4(), make_batch("Other?", "Other"))
+
+        messages = await repo.load_all_messages(persona_id)
+
+        assert len(messages) == 2
+
+    async def test_clear_history(self, async_db_session):
+        """Test clearing history for a persona"""
+        repo = MessageRepository(async_db_session)
+        persona_id = uuid4()
+
+        await repo.store_messages(persona_id, make_batch("Q1?", "A1"))
+        await repo.clear_history(persona_id)
+
+        assert await repo.load_all_messages(persona_id) == []
+
+    async def test_versions_stay_monotonic_across_clears(self, async_db_session):
+        """Test that a cleared history never reuses a version another worker may have cached"""
+        other_worker = HistoryCache(max_entries=10, max_bytes=1_000_000)
+        repo = MessageRepository(async_db_session, compact_after=0, cache=None)
+        persona_id = uuid4()
+
+        await repo.store_messages(persona_id, make_batch("Q1?", "A1"))
+        other_worker.put(persona_id, 1, await repo.load_all_messages(persona_id), 100)
+
+        await repo.clear_history(persona_id)
+        assert await repo.get_history_version(persona_id) == 2
+        assert await repo.store_messages(persona_id, make_batch("Q2?", "A2")) == 3
+
+        assert other_worker.get(persona_id, await repo.get_history_version(persona_id)) is None
+        assert [m.parts[0].content for m in await repo.load_all_messages(persona_id)] == ["Q2?", "A2"]
+
+    async def test_history_version_increments(self, async_db_session):
+        """Test that each stored batch bumps the history version"""
+        repo = MessageRepository(async_db_session, compact_after=0)
+        persona_id = uuid4()
+
+        assert await repo.get_history_version(persona_id) == 0
+        assert await repo.store_messages(persona_id, make_batch("Q1?", "A1")) == 1
+        assert await repo.store_messages(persona_id, make_batch("Q2?", "A2")) == 2
+        assert await repo.get_history_version(persona_id) == 2
+
+
+    async def test_concurrent_sequence_is_retried(self, async_db_session, monkeypatch):
+        """Test that a batch whose sequence was taken by another writer is stored under the next one"""
+        repo = MessageRepository(async_db_session, compact_after=0)
+        persona_id = uuid4()
+        await repo.store_messages(persona_id, make_batch("Q1?", "A1"))
+
+        # The racing writer read the sequences before the first batch was committed
+        get_sequences = repo._get_sequences
+        stale = [(0, None)]
+        async def racing_get_sequences(persona_id):
+            return stale.pop() if stale else await get_sequences(persona_id)
+        monkeypatch.setattr(repo, "_get_sequences", racing_get_sequences)
+
+        assert await repo.store_messages(persona_id, make_batch("Q2?", "A2")) == 2
+        messages = await repo.load_all_messages(persona_id)
+        assert [m.parts[0].content for m in messages[::2]] == ["Q1?", "Q2?"]
+
+
+class TestHistoryCompaction:
+    """Test folding history batches into snapshot rows"""
+
+    async def count_rows(self, session, persona_id):
+        result = await session.execute(
+            select(func.count()).select_from(MessageHistory).where(MessageHistory.persona_id == persona_id)
+        )
+        return result.scalar_one()
+
+    async def test_compaction_keeps_rows_bounded(self, async_db_session):
+        """Test that stored rows stay bounded while the loaded history is unchanged"""
+        repo = MessageRepository(async_db_session, compact_after=3)
+        persona_id = uuid4()
+
+        for i in range(10):
+            await repo.store_messages(persona_id, make_batch(f"Q{i}?", f"A{i}"))
+
+        messages = await repo.load_all_messages(persona_id)
+
+        assert len(messages) == 20
+        assert [m.parts[0].content for m in messages[::2]] == [f"Q{i}?" for i in range(10)]
+        assert await self.count_rows(async_db_session, persona_id) <= 3
+        assert await repo.get_history_version(persona_id) == 10
+
+    async def test_manual_compaction(self, async_db_session):
+        """Test compacting on demand folds everything into one snapshot"""
+        repo = MessageRepository(async_db_session, compact_after=0)
+        persona_id = uuid4()
+
+        for i in range(4):
+            await repo.store_messages(persona_id, make_batch(f"Q{i}?", f"A{i}"))
+        await repo.compact_history(persona_id)
+        await repo.store_messages(persona_id, make_batch("Q4?", "A4"))
+
+        messages = await repo.load_all_messages(persona_id)
+
+        assert len(messages) == 10
+        assert messages[-1].parts[0].content == "A4"
+        assert await self.count_rows(async_db_session, persona_id) == 2
+
+    async def test_repeated_compaction_keeps_one_snapshot(self, async_db_session):
+        """Test that compacting an already compacted history does not add another snapshot"""
+        repo = MessageRepository(async_db_session, compact_after=0)
+        persona_id = uuid4()
+
+        for i in range(3):
+            await repo.store_messages(persona_id, make_batch(f"Q{i}?", f"A{i}"))
+        await repo.compact_history(persona_id)
+        await repo.compact_history(persona_id)
+
+        assert await self.count_rows(async_db_session, persona_id) == 1
+        assert len(await repo.load_all_messages(persona_id)) == 6
+
+
+class TestDatabaseConfig:
+    """Test async driver and pool configuration helpers"""
+
+    def test_async_database_url_mapping(self):
+        """Test sync URLs are mapped onto asyncpg / aiosqlite"""
+        from src.database.core import get_async_database_url
+
+        assert get_async_database_url("postgresql://u:p@db:5432/app") == "postgresql+asyncpg://u:p@db:5432/app"
+        assert get_async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+        assert get_async_database_url("postgresql+asyncpg://u:p@db/app") == "postgresql+asyncpg://u:p@db/app"
+
+    def test_engine_options(self):
+        """Test pool settings apply to Postgres but not SQLite"""
+        from src.database.core import get_engine_options
+
+        pg_options = get_engine_options("postgresql+asyncpg://u:p@db/app")
+        assert "pool_size" in pg_options
+        assert pg_options["pool_pre_ping"] in (True, False)
+        assert "statement_cache_size" in pg_options["connect_args"]
+
+        sqlite_options = get_engine_options("sqlite+aiosqlite:///:memory:")
+        assert "pool_size" not in sqlite_options
+
+
+class TestHistoryCache:
+    """Test the in-process LRU of parsed histories"""
+
+    def test_get_requires_matching_version(self):
+        """Test that a lookup at another version is a miss"""
+        cache = HistoryCache(max_entries=10, max_bytes=10_000)
+        persona_id = uuid4()
+        messages = ModelMessagesTypeAdapter.validate_json(make_batch("Q1?", "A1"))
+
+        cache.put(persona_id, 1, messages, 100)
+
+        assert cache.get(persona_id, 1) == messages
+        assert cache.get(persona_id, 2) is None
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_evicts_by_entry_count_and_bytes(self):
+        """Test least-recently-used eviction under both bounds"""
+        cache = HistoryCache(max_entries=2, max_bytes=250)
+        first, second, third = uuid4(), uuid4(), uuid4()
+
+        cache.put(first, 1, [], 100)
+        cache.put(second, 1, [], 100)
+        cache.get(first, 1)
+        cache.put(third, 1, [], 100)
+
+        assert cache.get(second, 1) is None
+        assert cache.get(first, 1) == []
+        assert cache.stats()["evictions"] == 1
+
+        cache.put(second, 1, [], 200)
+
+        assert cache.stats()["bytes"] <= 250
+        assert cache.stats()["evictions"] == 3
+
+    async def test_repository_serves_from_cache(self, async_db_session):
+        """Test that repeated loads hit the cache and stores keep it coherent"""
+        cache = HistoryCache(max_entries=10, max_bytes=1_000_000)
+        repo = MessageRepository(async_db_session, compact_after=0, cache=cache)
+        persona_id = uuid4()
+
+        await repo.store_messages(persona_id, make_batch("Q1?", "A1"))
+        await repo.load_all_messages(persona_id)
+        await repo.store_messages(persona_id, make_batch("Q2?", "A2"))
+        messages = await repo.load_all_messages(persona_id)
+
+        assert len(messages) == 4
+        assert cache.stats()["hits"] == 1
+
+        await repo.clear_history(persona_id)
+
+        assert await repo.load_all_messages(persona_id) == []
+
+
+    async def test_stats_are_exposed_with_llm_metrics(self):
+        """Test that the history cache counters are reported by GET /llm/metrics"""
+        from src.llm.controller import get_llm_metrics
+        from src.messages.cache import history_cache
+
+        metrics = await get_llm_metrics()
+
+        assert metrics["history_cache"].keys() == history_cache.stats().keys()
+
+
+class TestMessageCodec:
+    """Test the binary codecs used for stored history blobs"""
+
+    @pytest.mark.parametrize("name", ["zlib", "zstd"])
+    def test_round_trip(self, name):
+        """Test that encoded blobs carry a header and decode back to the JSON"""
+        data = make_batch("Does she like tea?", "Yes")
+        codec = create_codec(name)
+
+        blob = codec.encode(data)
+
+        assert blob[0] == codec.header
+        assert decode_messages(blob) == data
+
+    def test_legacy_raw_rows_are_readable(self):
+        """Test that uncompressed JSON written before codecs still decodes"""
+        data = make_batch("Q?", "A")
+
+        assert decode_messages(data) == data
+
+    def test_previous_zstd_dictionary_stays_decodable(self, tmp_path):
+        """Test that rows written with a retrained-away dictionary decode by their frame's id"""
+        data = make_batch("Q?", "A")
+        old, new = train_dictionary("old"), train_dictionary("new")
+        (tmp_path / "messages.1.zdict").write_bytes(old)
+        (tmp_path / "messages.zdict").write_bytes(new)
+        blob = ZstdCodec(dictionary=old).encode(data)
+
+        codec = ZstdCodec(dictionary=new, dictionaries=lambda: load_zstd_dictionaries(str(tmp_path / "messages.zdict")))
+
+        assert codec.decode(blob[1:]) == data
+        assert not codec.is_current(blob)
+        assert codec.is_current(codec.encode(data))
+
+    def test_unknown_zstd_dictionary_is_rejected(self):
+        """Test that a frame naming a dictionary that is not loaded fails clearly"""
+        blob = ZstdCodec(dictionary=train_dictionary("old")).encode(make_batch("Q?", "A"))
+
+        with pytest.raises(ValueError, match="unknown zstd dictionary id"):
+            ZstdCodec(dictionary=train_dictionary("new")).decode(blob[1:])
+
+    async def test_repository_reads_mixed_codecs(self, async_db_session):
+        """Test that a history written with different codecs loads as one"""
+        persona_id = uuid4()
+        raw_repo = MessageRepository(async_db_session, compact_after=0, cache=None, codec=MessageCodec())
+        zlib_repo = MessageRepository(async_db_session, compact_after=0, cache=None, codec=create_codec("zlib"))
+
+        await raw_repo.store_messages(persona_id, make_batch("Q1?", "A1"))
+        await zlib_repo.store_messages(persona_id, make_batch("Q2?", "A2"))
+
+        messages = await zlib_repo.load_all_messages(persona_id)
+
+        assert [m.parts[0].content for m in messages] == ["Q1?", "A1", "Q2?", "A2"]
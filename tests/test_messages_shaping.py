@@ -0,0 +1,106 @@
+from pydantic_ai.messages import ModelRequest, ModelResponse, UserPromptPart, TextPart, ToolCallPart, ToolReturnPart
+
+from src.messages.shaping import SUMMARY_HEADER, UNANSWERED, estimate_tokens, shape_history, split_rounds, split_turns
+
+
+def detective_turn(prompt: str, questions):
+    """A question round as stored by QuestionService: prompt, output tool call, tool return"""
+    return [
+        ModelRequest(parts=[UserPromptPart(content=prompt)]),
+        ModelResponse(parts=[ToolCallPart(
+            tool_name="final_result",
+            args={"questions": [{"question": q, "choices": ["A", "B", "C", "None of the above"]} for q in questions], "detective_comment": "Hmm."},
+            tool_call_id="call-1",
+        )]),
+        ModelRequest(parts=[ToolReturnPart(tool_name="final_result", content="Final result processed.", tool_call_id="call-1")]),
+    ]
+
+
+def answer_turn(question: str, answer: str):
+    return [
+        ModelRequest(parts=[UserPromptPart(content=question)]),
+        ModelResponse(parts=[TextPart(content=answer)]),
+    ]
+
+
+def make_history(rounds: int):
+    questions = [[f"Round {r} question {i}: does the recipient enjoy activity number {i}?" for i in range(5)] for r in range(rounds)]
+    messages = detective_turn("Recipient profile: Age=30, Occasion=birthday. Ask 5 questions.", questions[0])
+    for r in range(rounds):
+        if r:
+            messages += detective_turn("Ask 5 more specific questions.", questions[r])
+        for i, question in enumerate(questions[r]):
+            messages += answer_turn(question, f"Answer {r}.{i}")
+    return messages
+
+
+class TestHistoryShaping:
+    """Test token-budgeted windowing of the prompt history"""
+
+    def test_turns_and_rounds(self):
+        """Test that tool calls stay with their return and rounds start at each question turn"""
+        turns = split_turns(make_history(3))
+
+        assert len(turns) == 3 + 3 * 5
+        assert len(turns[0]) == 3
+        rounds = split_rounds(turns[1:])
+        # Answers of the first round, then a question turn plus its answers per later round
+        assert [len(r) for r in rounds] == [5, 6, 6]
+
+    def test_history_within_budget_is_unchanged(self):
+        """Test that a history within budget, or a disabled budget, is passed through as is"""
+        messages = make_history(2)
+        assert shape_history(messages, budget=estimate_tokens(messages)) is messages
+        assert shape_history(messages, budget=0) is messages
+
+    def test_old_rounds_are_summarized(self):
+        """Test that the profile turn and latest round stay verbatim and older answers are condensed"""
+        messages = make_history(4)
+        original = list(messages)
+        budget = estimate_tokens(messages) * 3 // 4
+
+        shaped = shape_history(messages, budget=budget, min_recent_rounds=1)
+
+        assert messages == original  # The stored history is not modified
+        assert estimate_tokens(shaped) <= budget
+        assert shaped[:3] == messages[:3]
+        summary = shaped[3].parts[0].content
+        assert summary.startswith(SUMMARY_HEADER)
+        assert "- Round 0 question 0: does the recipient enjoy activity number 0? -> Answer 0.0" in summary
+        assert shaped[-2:] == messages[-2:]
+        # The kept rounds come after the summary, whole and in order
+        assert shaped[4:] == messages[len(messages) - len(shaped) + 4:]
+        assert "Answer 3.4" not in summary
+
+    def test_recent_rounds_are_kept_over_budget(self):
+        """Test that min_recent_rounds wins over a budget too small for them"""
+        messages = make_history(3)
+
+        shaped = shape_history(messages, budget=10, min_recent_rounds=2)
+
+        summary = shaped[3].parts[0].content
+        assert "Answer 0.4" in summary
+        assert "Answer 1.0" not in summary
+        assert shaped[4:] == messages[3 + 5 * 2:]
+
+    def test_single_round_is_never_cut(self):
+        """Test that the profile turn and its answers are never condensed"""
+        messages = make_history(1)
+        assert shape_history(messages, budget=10) is messages
+
+    def test_unanswered_questions_are_carried_into_summary(self):
+        """Test that questions of a condensed round without an answer are kept in the summary"""
+        messages = detective_turn("Recipient profile: Age=30. Ask 2 questions.", ["Likes tea?", "Owns a bike?"])
+        messages += answer_turn("Likes tea?", "Yes") + answer_turn("Owns a bike?", "No")
+        messages += detective_turn("Ask 2 more specific questions.", ["Likes jazz?", "Plays chess?"])
+        messages += answer_turn("Likes jazz?", "Sometimes")
+        messages += detective_turn("Ask 2 more specific questions.", ["Has a garden?", "Reads novels?"])
+        messages += answer_turn("Has a garden?", "Yes") + answer_turn("Reads novels?", "No")
+
+        shaped = shape_history(messages, budget=10, min_recent_rounds=1)
+
+        summary = shaped[3].parts[0].content
+        assert "- Likes jazz? -> Sometimes" in summary
+        assert f"- Plays chess? -> {UNANSWERED}" in summary
+        assert "Likes tea? -> " + UNANSWERED not in summary
+        assert "Has a garden?" not in summary
@@ -0,0 +1,149 @@
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect
+from src.database.core import Base
+
+
+@pytest.fixture
+def alembic_config(tmp_path):
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", f"sqlite:///{tmp_path / 'migrations.db'}")
+    return config
+
+
+def table_indexes(url):
+    engine = create_engine(url)
+    try:
+        inspector = inspect(engine)
+        return {
+            table: {(index["name"], tuple(index["column_names"])) for index in inspector.get_indexes(table)}
+            for table in inspector.get_table_names() if table != "alembic_version"
+        }
+    finally:
+        engine.dispose()
+
+
+class TestMigrations:
+
+    def test_upgrade_head_matches_models(self, alembic_config):
+        """Test that the migrations create every table and index the models declare"""
+        command.upgrade(alembic_config, "head")
+
+        expected = {
+            table.name: {(index.name, tuple(column.name for column in index.columns)) for index in table.indexes}
+            for table in Base.metadata.sorted_tables
+        }
+        assert table_indexes(alembic_config.get_main_option("sqlalchemy.url")) == expected
+
+    def test_persona_scoped_indexes(self, alembic_config):
+        """Test that the hot persona-scoped lookups are covered by an index"""
+        command.upgrade(alembic_config, "head")
+        indexes = table_indexes(alembic_config.get_main_option("sqlalchemy.url"))
+
+        assert ("ix_questions_persona_id_created_at", ("persona_id", "created_at")) in indexes["questions"]
+        assert ("ix_answers_question_id", ("question_id",)) in indexes["answers"]
+        assert ("ix_message_history_persona_id_sequence", ("persona_id", "sequence", "created_at")) in indexes["message_history"]
+
+    def test_downgrade_base(self, alembic_config):
+        """Test that every migration can be rolled back"""
+        command.upgrade(alembic_config, "head")
+        command.downgrade(alembic_config, "base")
+
+        assert table_indexes(alembic_config.get_main_option("sqlalchemy.url")) == {}
+
+    def test_adopted_baseline_is_backfilled(self, alembic_config):
+        """Test that a stamped pre-migration database gets history sequences and served questions"""
+        from sqlalchemy import text
+
+        command.upgrade(alembic_config, "0001_initial_schema")
+        engine = create_engine(alembic_config.get_main_option("sqlalchemy.url"))
+        persona, other = "a" * 32, "b" * 32
+        with engine.begin() as conn:
+            for persona_id in (persona, other):
+                conn.execute(text(
+                    "INSERT INTO personas (id, occasion, age, relationship, created_at) "
+                    "VALUES (:id, 'birthday', 30, 'friend', '2026-01-01 00:00:00')"
+                ), {"id": persona_id})
+            for i, (persona_id, created_at) in enumerate([
+                (persona, "2026-01-01 00:00:03"),
+                (persona, "2026-01-01 00:00:01"),
+                (other, "2026-01-01 00:00:02"),
+                (persona, "2026-01-01 00:00:02"),
+            ]):
+                conn.execute(text(
+                    "INSERT INTO message_history (id, persona_id, messages_json, created_at) VALUES (:id, :persona_id, :blob, :created_at)"
+                ), {"id": f"{i:032d}", "persona_id": persona_id, "blob": b"[]", "created_at": created_at})
+            conn.execute(text(
+                "INSERT INTO questions (id, persona_id, question_text, choices, created_at) "
+                "VALUES (:id, :persona_id, 'Q?', '[]', '2026-01-01 00:00:05')"
+            ), {"id": "c" * 32, "persona_id": persona})
+
+        command.upgrade(alembic_config, "head")
+        try:
+            with engine.connect() as conn:
+                history = conn.execute(text(
+                    "SELECT persona_id, created_at, sequence, is_snapshot FROM message_history ORDER BY persona_id, created_at"
+                )).all()
+                served_at = conn.execute(text("SELECT served_at FROM questions")).scalar_one()
+        finally:
+            engine.dispose()
+
+        assert [(row[0], row[2], bool(row[3])) for row in history] == [
+            (persona, 1, False), (persona, 2, False), (persona, 3, False), (other, 1, False),
+        ]
+        assert served_at == "2026-01-01 00:00:05"
+
+    def test_duplicate_history_sequences_are_renumbered(self, alembic_config):
+        """Test that rows sharing a sequence get distinct, later sequences before the constraint is added"""
+        from sqlalchemy import text
+
+        command.upgrade(alembic_config, "0010_questions_served_at")
+        engine = create_engine(alembic_config.get_main_option("sqlalchemy.url"))
+        persona = "a" * 32
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO personas (id, occasion, age, relationship, created_at) "
+                "VALUES (:id, 'birthday', 30, 'friend', '2026-01-01 00:00:00')"
+            ), {"id": persona})
+            for i, (sequence, created_at) in enumerate([(1, "2026-01-01 00:00:01"), (2, "2026-01-01 00:00:02"), (2, "2026-01-01 00:00:03")]):
+                conn.execute(text(
+                    "INSERT INTO message_history (id, persona_id, messages_json, sequence, is_snapshot, created_at) "
+                    "VALUES (:id, :persona_id, :blob, :sequence, 0, :created_at)"
+                ), {"id": f"{i:032d}", "persona_id": persona, "blob": b"[]", "sequence": sequence, "created_at": created_at})
+
+        command.upgrade(alembic_config, "head")
+        try:
+            with engine.connect() as conn:
+                sequences = conn.execute(text("SELECT sequence FROM message_history ORDER BY created_at")).scalars().all()
+        finally:
+            engine.dispose()
+
+        assert sequences == [3, 4, 5]
+
+    def test_duplicate_recommendation_pages_are_dropped(self, alembic_config):
+        """Test that only the first stored copy of a page survives before the constraint is added"""
+        from sqlalchemy import text
+
+        command.upgrade(alembic_config, "0011_message_history_unique_sequence")
+        engine = create_engine(alembic_config.get_main_option("sqlalchemy.url"))
+        persona = "b" * 32
+        with engine.begin() as conn:
+            conn.execute(text(
+                "INSERT INTO personas (id, occasion, age, relationship, created_at) "
+                "VALUES (:id, 'birthday', 30, 'friend', '2026-01-01 00:00:00')"
+            ), {"id": persona})
+            for i, (page, created_at) in enumerate([(1, "2026-01-01 00:00:01"), (1, "2026-01-01 00:00:02"), (2, "2026-01-01 00:00:03")]):
+                conn.execute(text(
+                    "INSERT INTO recommendation_batches (id, persona_id, fingerprint, page, recommendations, created_at) "
+                    "VALUES (:id, :persona_id, 'f', :page, '[]', :created_at)"
+                ), {"id": f"{i:032d}", "persona_id": persona, "page": page, "created_at": created_at})
+
+        command.upgrade(alembic_config, "head")
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(text("SELECT page, created_at FROM recommendation_batches ORDER BY created_at")).all()
+        finally:
+            engine.dispose()
+
+        assert [tuple(row) for row in rows] == [(1, "2026-01-01 00:00:01"), (2, "2026-01-01 00:00:03")]
@@ -0,0 +1,82 @@
+import pytest
+
+from src.questions.cache import QuestionSetCacheRepository, bucket_age, build_cache_key
+from src.questions_agent.models import GiftDependencies, GiftQuestions
+
+
+@pytest.fixture
+def deps():
+    return GiftDependencies(age=29, gender="female", occasion="birthday", relationship="friend", budget="25-50€")
+
+
+def make_questions(label: str) -> GiftQuestions:
+    return GiftQuestions(
+        questions=[GiftQuestions.QuestionItem(question=f"{label}?", choices=["A", "B", "C"])],
+        detective_comment=label,
+    )
+
+
+class TestCacheKey:
+    """Test normalization of dependencies into cache keys"""
+
+    def test_bucket_age(self):
+        buckets = [0, 13, 18, 25, 35, 50, 65]
+
+        assert bucket_age(29, buckets) == "25-34"
+        assert bucket_age(25, buckets) == "25-34"
+        assert bucket_age(70, buckets) == "65+"
+        assert bucket_age(5, buckets) == "0-12"
+
+    def test_same_bucket_shares_key(self, deps):
+        other = deps.model_copy(update={"age": 33})
+
+        assert build_cache_key(deps) == build_cache_key(other)
+        assert build_cache_key(deps) != build_cache_key(deps.model_copy(update={"occasion": "wedding"}))
+
+
+class TestQuestionSetCacheRepository:
+    """Test pooling and rotation of cached question sets"""
+
+    async def test_pool_is_filled_before_serving(self, async_db_session, deps):
+        """Test that nothing is served until the key has enough variants"""
+        cache = QuestionSetCacheRepository(async_db_session, enabled=True, variants=2)
+
+        assert await cache.get(deps) is None
+        await cache.put(deps, make_questions("first"))
+        await async_db_session.commit()
+        assert await cache.get(deps) is None
+
+        await cache.put(deps, make_questions("second"))
+        await async_db_session.commit()
+        served = await cache.get(deps)
+
+        assert served is not None
+        assert served.detective_comment in ("first", "second")
+
+    async def test_variants_rotate(self, async_db_session, deps):
+        """Test that the least-served variant is handed out next"""
+        cache = QuestionSetCacheRepository(async_db_session, enabled=True, variants=2)
+        await cache.put(deps, make_questions("first"))
+        await cache.put(deps, make_questions("second"))
+        await async_db_session.commit()
+
+        served = []
+        for _ in range(4):
+            served.append((await cache.get(deps)).detective_comment)
+            await async_db_session.commit()
+
+        assert sorted(served) == ["first", "first", "second", "second"]
+
+    async def test_expired_variants_are_dropped(self, async_db_session, deps):
+        """Test that variants older than the TTL are not served"""
+        cache = QuestionSetCacheRepository(async_db_session, enabled=True, variants=1, ttl_seconds=-1)
+        await cache.put(deps, make_questions("stale"))
+        await async_db_session.commit()
+
+        assert await cache.get(deps) is None
+
+    async def test_disabled_cache(self, async_db_session, deps):
+        cache = QuestionSetCacheRepository(async_db_session, enabled=False, variants=1)
+        await cache.put(deps, make_questions("first"))
+
+        assert await cache.get(deps) is None
@@ -1,7 +1,8 @@
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, AsyncMock, patch
 from uuid import uuid4
 from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.questions.service import QuestionService
 from src.questions.models import BulkAnswerRequest, QuestionAnswerItem, AnswerResponse
@@ -10,35 +11,50 @@ from src.questions.entity import Question, Answer
 
 @pytest.fixture
 def mock_session():
-    """Mock SQLAlchemy session"""
-    return Mock()
+    """Mock SQLAlchemy async session"""
+    return Mock(spec=AsyncSession)
 
 
 @pytest.fixture
 def sample_questions():
     """Sample questions for testing bulk answers"""
     questions = []
+    persona_id = uuid4()
     for i in range(5):
         question = Mock()
         question.id = uuid4()
+        question.persona_id = persona_id
         question.question_text = f"Sample question {i+1}?"
+        question.choices = ["Yes", "No", "Maybe"]
         questions.append(question)
     return questions
 
 
+def mock_question_lookup(mock_session, questions):
+    """Make the IN lookup return the matching questions and record bulk inserts"""
+    inserted = []
+
+    async def mock_execute(statement, params=None):
+        if params is not None:
+            inserted.extend(params)
+            return Mock()
+        requested = statement.whereclause.right.value
+        return [q for q in questions if q.id in requested]
+
+    mock_session.execute.side_effect = mock_execute
+    return inserted
+
+
+def mock_message_repo():
+    return Mock(store_messages=AsyncMock(), commit=AsyncMock())
+
+
 class TestBulkAnswerSubmission:
     
-    def test_submit_bulk_answers_success(self, mock_session, sample_questions):
+    @patch('src.questions.service.followup_prefetcher')
+    async def test_submit_bulk_answers_success(self, mock_prefetcher, mock_session, sample_questions):
         """Test successful submission of multiple answers"""
-        # Setup mock session to return questions when queried
-        def mock_query_filter_first(question_id):
-            # Return the matching question or None
-            for q in sample_questions:
-                if str(q.id) == str(question_id):
-                    return q
-            return None
-        
-        mock_session.query.return_value.filter.return_value.first.side_effect = lambda: mock_query_filter_first(mock_session.query.return_value.filter.call_args[0][0] == Question.id)
+        inserted = mock_question_lookup(mock_session, sample_questions)
         
         # Create bulk answer request
         answer_items = []
@@ -50,38 +66,25 @@ class TestBulkAnswerSubmission:
         
         bulk_request = BulkAnswerRequest(answers=answer_items)
         
-        # Mock the session operations
-        saved_answers = []
-        def mock_add(answer):
-            answer.id = uuid4()  # Simulate DB generating ID
-            saved_answers.append(answer)
-        
-        mock_session.add.side_effect = mock_add
-        mock_session.commit.return_value = None
-        mock_session.refresh.return_value = None
-        
-        # Mock query to return questions
-        def mock_query_side_effect(*args):
-            mock_query = Mock()
-            mock_filter = Mock()
-            
-            def mock_filter_side_effect(*filter_args):
-                # Return the question if it exists in our sample
-                for q in sample_questions:
-                    if hasattr(filter_args[0], 'right') and filter_args[0].right.value == q.id:
-                        mock_filter.first.return_value = q
-                        return mock_filter
-                mock_filter.first.return_value = None
-                return mock_filter
-            
-            mock_query.filter.side_effect = mock_filter_side_effect
-            return mock_query
-        
-        mock_session.query.side_effect = mock_query_side_effect
-        
         # Execute
         service = QuestionService(mock_session)
-        result = service.submit_bulk_answers(bulk_request)
+        service.message_repo = mock_message_repo()
+        service.recommendation_cache = Mock(invalidate=AsyncMock())
+        service.recommendation_batches = Mock(invalidate=AsyncMock())
+        result = await service.submit_bulk_answers(bulk_request)
+        
+        # One lookup and one bulk insert, committed once with the history batch
+        assert mock_session.execute.await_count == 2
+        service.recommendation_cache.invalidate.assert_awaited_once()
+        assert list(service.recommendation_cache.invalidate.call_args[0][0]) == [sample_questions[0].persona_id]
+        assert list(service.recommendation_batches.invalidate.call_args[0][0]) == [sample_questions[0].persona_id]
+        assert len(inserted) == len(sample_questions)
+        service.message_repo.store_messages.assert_awaited_once()
+        assert service.message_repo.store_messages.call_args[0][0] == sample_questions[0].persona_id
+        assert service.message_repo.store_messages.call_args[1]["commit"] is False
+        service.message_repo.commit.assert_awaited_once()
+        mock_session.commit.assert_not_called()
+        mock_prefetcher.schedule.assert_not_called()
         
         # Verify response
         assert result.submitted_count == len(sample_questions)
@@ -89,11 +92,11 @@ class TestBulkAnswerSubmission:
         
         # Verify all answers have IDs and correct choices
         for i, answer_response in enumerate(result.answers):
-            assert answer_response.id is not None
+            assert answer_response.id == inserted[i]["id"]
             expected_choice = "Yes" if i % 2 == 0 else "No"
             assert answer_response.selected_choice == expected_choice
 
-    def test_submit_bulk_answers_with_invalid_questions(self, mock_session):
+    async def test_submit_bulk_answers_with_invalid_questions(self, mock_session):
         """Test bulk submission with some invalid question IDs"""
         # Setup - only first question exists
         valid_question_id = uuid4()
@@ -101,23 +104,11 @@ class TestBulkAnswerSubmission:
         
         valid_question = Mock()
         valid_question.id = valid_question_id
+        valid_question.persona_id = uuid4()
+        valid_question.question_text = "Valid question?"
+        valid_question.choices = ["Yes", "No"]
         
-        def mock_query_side_effect(*args):
-            mock_query = Mock()
-            mock_filter = Mock()
-            
-            def mock_filter_side_effect(*filter_args):
-                # Only return the valid question
-                if hasattr(filter_args[0], 'right') and filter_args[0].right.value == valid_question_id:
-                    mock_filter.first.return_value = valid_question
-                else:
-                    mock_filter.first.return_value = None
-                return mock_filter
-            
-            mock_query.filter.side_effect = mock_filter_side_effect
-            return mock_query
-        
-        mock_session.query.side_effect = mock_query_side_effect
+        inserted = mock_question_lookup(mock_session, [valid_question])
         
         # Create request with valid and invalid question IDs
         answer_items = [
@@ -126,33 +117,60 @@ class TestBulkAnswerSubmission:
         ]
         bulk_request = BulkAnswerRequest(answers=answer_items)
         
-        # Mock session operations
-        def mock_add(answer):
-            answer.id = uuid4()
-        
-        mock_session.add.side_effect = mock_add
-        mock_session.commit.return_value = None
-        mock_session.refresh.return_value = None
-        
         # Execute
         service = QuestionService(mock_session)
-        result = service.submit_bulk_answers(bulk_request)
+        service.message_repo = mock_message_repo()
+        result = await service.submit_bulk_answers(bulk_request)
         
         # Should only process valid question
         assert result.submitted_count == 1
         assert len(result.answers) == 1
         assert result.answers[0].selected_choice == "Yes"
+        assert [row["question_id"] for row in inserted] == [valid_question_id]
+
+    async def test_submit_bulk_answers_rejects_unknown_choice(self, mock_session, sample_questions):
+        """Test that a choice outside the question's stored choices fails the whole batch"""
+        inserted = mock_question_lookup(mock_session, sample_questions)
+        bulk_request = BulkAnswerRequest(answers=[
+            QuestionAnswerItem(question_id=sample_questions[0].id, answer_choice="Yes"),
+            QuestionAnswerItem(question_id=sample_questions[1].id, answer_choice="Absolutely"),
+        ])
+        
+        service = QuestionService(mock_session)
+        service.message_repo = mock_message_repo()
+        with pytest.raises(HTTPException) as exc_info:
+            await service.submit_bulk_answers(bulk_request)
+        
+        assert exc_info.value.status_code == 422
+        assert exc_info.value.detail["invalid_answers"] == {str(sample_questions[1].id): "Absolutely"}
+        assert inserted == []
+        service.message_repo.commit.assert_not_called()
+
+    @patch('src.questions.service.followup_prefetcher')
+    async def test_submit_bulk_answers_schedules_prefetch(self, mock_prefetcher, mock_session, sample_questions):
+        """Test that prefetch starts follow-up generation for the answered persona"""
+        mock_question_lookup(mock_session, sample_questions)
+        bulk_request = BulkAnswerRequest(answers=[
+            QuestionAnswerItem(question_id=sample_questions[0].id, answer_choice="Yes")
+        ])
+        
+        service = QuestionService(mock_session)
+        service.message_repo = mock_message_repo()
+        await service.submit_bulk_answers(bulk_request, prefetch=True)
+        
+        mock_prefetcher.schedule.assert_called_once()
+        assert mock_prefetcher.schedule.call_args[0][0] == sample_questions[0].persona_id
 
-    def test_submit_bulk_answers_empty_request(self, mock_session):
+    async def test_submit_bulk_answers_empty_request(self, mock_session):
         """Test bulk submission with empty answers list"""
         bulk_request = BulkAnswerRequest(answers=[])
         
         service = QuestionService(mock_session)
-        result = service.submit_bulk_answers(bulk_request)
+        result = await service.submit_bulk_answers(bulk_request)
         
         assert result.submitted_count == 0
         assert len(result.answers) == 0
-        mock_session.add.assert_not_called()
+        mock_session.execute.assert_not_called()
 
     
 
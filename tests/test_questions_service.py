@@ -2,18 +2,22 @@ import pytest
 import asyncio
 from unittest.mock import Mock, AsyncMock, patch
 from uuid import uuid4
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.questions.service import QuestionService
+from src.database.core import session_factory_for
+from src.questions.service import QuestionService, prefetch_followup_questions
+from src.questions.prefetch import FollowupPrefetcher
 from src.questions.entity import Question
+from src.llm.executor import Lane, _lane_override
 from src.build_persona.entity import Persona, Occasion, Gender, Relationship
 from src.questions_agent.models import GiftDependencies, GiftQuestions
 
 
 @pytest.fixture
 def mock_session():
-    """Mock SQLAlchemy session"""
-    return Mock(spec=Session)
+    """Mock SQLAlchemy async session"""
+    return Mock(spec=AsyncSession)
 
 
 @pytest.fixture
@@ -25,6 +29,7 @@ def sample_persona():
     persona.gender = Gender.male
     persona.occasion = Occasion.birthday
     persona.relationship = Relationship.friend
+    persona.budget = None
     return persona
 
 
@@ -32,83 +37,96 @@ def sample_persona():
 def sample_agent_response():
     """Sample response from the gift detective agent"""
     from src.questions_agent.models import GiftQuestions
-    
+
     # Create mock question items
     question_item_1 = Mock()
     question_item_1.question = "Does he prefer practical gifts or fun experiences?"
     question_item_1.choices = ["Practical gifts", "Fun experiences", "Both equally"]
-    
+
     question_item_2 = Mock()
     question_item_2.question = "Is he into tech gadgets or outdoor activities?"
     question_item_2.choices = ["Tech gadgets", "Outdoor activities", "Neither really"]
-    
+
     # Create mock agent response
     response = Mock()
     response.output = Mock(spec=GiftQuestions)
     response.output.questions = [question_item_1, question_item_2]
     response.output.detective_comment = "These questions target his lifestyle preferences."
-    
+    response.new_messages_json.return_value = b"[]"
+
     return response
 
 
+def make_service(mock_session, persona):
+    """Build a service whose persona lookup and history repository are mocked"""
+    mock_session.execute.return_value = Mock(scalar_one=Mock(return_value=persona))
+    service = QuestionService(mock_session)
+    service.message_repo = Mock()
+    service.message_repo.load_all_messages = AsyncMock(return_value=[])
+    service.message_repo.store_messages = AsyncMock()
+    service.message_repo.commit = AsyncMock()
+    service.question_cache = Mock(get=AsyncMock(return_value=None), put=AsyncMock())
+    service._take_pending_questions = AsyncMock(return_value=[])
+    return service
+
+
+def bulk_inserted_rows(mock_session):
+    """Return the parameter rows of executemany-style inserts issued on the session"""
+    rows = []
+    for call in mock_session.execute.call_args_list:
+        if len(call.args) > 1 and isinstance(call.args[1], list):
+            rows.extend(call.args[1])
+    return rows
+
+
 class TestQuestionService:
     def test_init(self, mock_session):
         """Test service initialization"""
         service = QuestionService(mock_session)
         assert service.session == mock_session
 
-    @patch('src.questions.service.asyncio.run')
-    @patch('src.questions.service.gift_detective.run')
-    def test_get_next_question_saves_and_returns_questions(
-        self, mock_agent_run, mock_asyncio_run, mock_session, sample_persona, sample_agent_response
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_get_next_question_saves_and_returns_questions(
+        self, mock_agent_run, mock_session, sample_persona, sample_agent_response
     ):
-        """Test that get_next_question saves questions to DB and returns structured response"""
+        """Test that a generated round is saved to DB and returned as a structured response"""
         # Setup mocks
-        mock_session.query.return_value.filter.return_value.one.return_value = sample_persona
-        mock_asyncio_run.return_value = sample_agent_response
-        
-        # Mock question creation and DB operations
-        saved_questions = []
-        def mock_add(question):
-            question.id = uuid4()  # Simulate DB generating ID
-            saved_questions.append(question)
-        
-        mock_session.add.side_effect = mock_add
-        mock_session.commit.return_value = None
-        mock_session.refresh.return_value = None
-        
+        mock_agent_run.return_value = sample_agent_response
+
         # Execute
-        service = QuestionService(mock_session)
-        result = service.get_next_question(sample_persona.id)
-        
-        # Verify agent was called with correct dependencies
-        mock_asyncio_run.assert_called_once()
-        
-        # Verify questions were saved to DB
+        service = make_service(mock_session, sample_persona)
+        result = await service.generate_questions(sample_persona.id)
+
+        # Verify agent was awaited once and the new messages joined the round's transaction
+        mock_agent_run.assert_awaited_once()
+        service.message_repo.store_messages.assert_awaited_once_with(sample_persona.id, b"[]", commit=False)
+
+        # Verify questions were bulk-inserted in a single statement
+        saved_questions = bulk_inserted_rows(mock_session)
         assert len(saved_questions) == 2
-        assert saved_questions[0].persona_id == sample_persona.id
-        assert saved_questions[0].question_text == "Does he prefer practical gifts or fun experiences?"
-        assert saved_questions[1].question_text == "Is he into tech gadgets or outdoor activities?"
-        
-        # Verify DB operations
-        assert mock_session.add.call_count == 2
-        assert mock_session.commit.call_count == 2
-        assert mock_session.refresh.call_count == 2
-        
+        assert saved_questions[0]["persona_id"] == sample_persona.id
+        assert saved_questions[0]["question_text"] == "Does he prefer practical gifts or fun experiences?"
+        assert saved_questions[1]["question_text"] == "Is he into tech gadgets or outdoor activities?"
+
+        # Verify the round costs one commit and no refreshes
+        service.message_repo.commit.assert_awaited_once()
+        mock_session.refresh.assert_not_called()
+
         # Verify returned structure
         assert len(result) == 2
-        
+
         first_item = result[0]
         assert "id" in first_item
         assert first_item["question"] == "Does he prefer practical gifts or fun experiences?"
         assert first_item["choices"] == ["Practical gifts", "Fun experiences", "Both equally"]
-        
+
         second_item = result[1]
         assert "id" in second_item
         assert second_item["question"] == "Is he into tech gadgets or outdoor activities?"
         assert second_item["choices"] == ["Tech gadgets", "Outdoor activities", "Neither really"]
 
-    def test_get_next_question_with_no_gender(self, mock_session, sample_agent_response):
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_get_next_question_with_no_gender(self, mock_agent_run, mock_session, sample_agent_response):
         """Test handling persona with no gender specified"""
         # Setup persona without gender
         persona = Mock(spec=Persona)
@@ -117,25 +135,19 @@ class TestQuestionService:
         persona.gender = None
         persona.occasion = Occasion.christmas
         persona.relationship = Relationship.parent
-        
-        mock_session.query.return_value.filter.return_value.one.return_value = persona
-        
-        with patch('src.questions.service.asyncio.run') as mock_asyncio_run:
-            mock_asyncio_run.return_value = sample_agent_response
-            
-            # Mock DB operations
-            mock_session.add.return_value = None
-            mock_session.commit.return_value = None
-            mock_session.refresh.return_value = None
-            
-            service = QuestionService(mock_session)
-            result = service.get_next_question(persona.id)
-            
-            # Should handle None gender gracefully
-            assert len(result) == 2
-
-    @patch('src.questions.service.asyncio.run')
-    def test_agent_dependency_mapping(self, mock_asyncio_run, mock_session, sample_agent_response):
+        persona.budget = None
+
+        mock_agent_run.return_value = sample_agent_response
+
+        service = make_service(mock_session, persona)
+        result = await service.generate_questions(persona.id)
+
+        # Should handle None gender gracefully
+        assert len(result) == 2
+        assert mock_agent_run.call_args.kwargs["deps"].gender == "unknown"
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_agent_dependency_mapping(self, mock_agent, mock_session, sample_agent_response):
         """Test that persona attributes are correctly mapped to agent dependencies"""
         persona = Mock(spec=Persona)
         persona.id = uuid4()
@@ -143,49 +155,327 @@ class TestQuestionService:
         persona.gender = Gender.female
         persona.occasion = Occasion.wedding
         persona.relationship = Relationship.colleague
-        
-        mock_session.query.return_value.filter.return_value.one.return_value = persona
-        mock_asyncio_run.return_value = sample_agent_response
-        
-        # Mock DB operations
-        mock_session.add.return_value = None
-        mock_session.commit.return_value = None
-        mock_session.refresh.return_value = None
-        
-        service = QuestionService(mock_session)
-        
-        with patch('src.questions.service.gift_detective.run') as mock_agent:
-            mock_agent.return_value = sample_agent_response
-            
-            service.get_next_question(persona.id)
-            
-            # Verify agent was called with correct mapped dependencies
-            mock_agent.assert_called_once()
-            args, kwargs = mock_agent.call_args
-            
-            assert "deps" in kwargs
-            deps = kwargs["deps"]
-            assert isinstance(deps, GiftDependencies)
-            assert deps.age == 35
-            assert deps.gender == "female"
-            assert deps.occasion == "wedding"
-            assert deps.relationship == "colleague"
-
-    def test_empty_agent_response(self, mock_session, sample_persona):
+        persona.budget = None
+
+        mock_agent.return_value = sample_agent_response
+
+        service = make_service(mock_session, persona)
+        await service.generate_questions(persona.id)
+
+        # Verify agent was called with correct mapped dependencies
+        mock_agent.assert_awaited_once()
+        args, kwargs = mock_agent.call_args
+
+        assert "deps" in kwargs
+        deps = kwargs["deps"]
+        assert isinstance(deps, GiftDependencies)
+        assert deps.age == 35
+        assert deps.gender == "female"
+        assert deps.occasion == "wedding"
+        assert deps.relationship == "colleague"
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_empty_agent_response(self, mock_agent_run, mock_session, sample_persona):
         """Test handling when agent returns no questions"""
         # Setup empty agent response
         empty_response = Mock()
         empty_response.output = Mock(spec=GiftQuestions)
         empty_response.output.questions = []
-        
-        mock_session.query.return_value.filter.return_value.one.return_value = sample_persona
-        
-        with patch('src.questions.service.asyncio.run') as mock_asyncio_run:
-            mock_asyncio_run.return_value = empty_response
-            
-            service = QuestionService(mock_session)
-            result = service.get_next_question(sample_persona.id)
-            
-            assert result == []
-            mock_session.add.assert_not_called()
-            mock_session.commit.assert_not_called()
\ No newline at end of file
+
+        mock_agent_run.return_value = empty_response
+
+        service = make_service(mock_session, sample_persona)
+        result = await service.generate_questions(sample_persona.id)
+
+        assert result == []
+        assert bulk_inserted_rows(mock_session) == []
+        service.message_repo.commit.assert_awaited_once()
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_initial_questions_served_from_cache(self, mock_agent_run, mock_session, sample_persona):
+        """Test that a cached question set skips the agent but still records history"""
+        cached = GiftQuestions(
+            questions=[GiftQuestions.QuestionItem(question="Does he cook?", choices=["Yes", "No", "Sometimes"])],
+            detective_comment="Cached set",
+        )
+
+        service = make_service(mock_session, sample_persona)
+        service.question_cache.get.return_value = cached
+        result = await service.generate_questions(sample_persona.id)
+
+        mock_agent_run.assert_not_called()
+        service.question_cache.put.assert_not_called()
+        assert result[0]["question"] == "Does he cook?"
+
+        # The synthesized exchange is stored so follow-up rounds have context
+        persona_id, messages_json = service.message_repo.store_messages.call_args[0]
+        assert persona_id == sample_persona.id
+        assert b"Does he cook?" in messages_json
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_initial_questions_fill_cache_on_miss(
+        self, mock_agent_run, mock_session, sample_persona, sample_agent_response
+    ):
+        """Test that a generated initial set is added to the question-set cache"""
+        mock_agent_run.return_value = sample_agent_response
+
+        service = make_service(mock_session, sample_persona)
+        await service.generate_questions(sample_persona.id)
+
+        service.question_cache.put.assert_awaited_once()
+        assert service.question_cache.put.call_args[0][1] is sample_agent_response.output
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_pending_questions_are_served_first(self, mock_agent_run, async_db_session):
+        """Test that pre-generated follow-ups are returned without a new agent call"""
+        persona = Persona(age=30, gender=Gender.male, occasion=Occasion.birthday, relationship=Relationship.friend)
+        async_db_session.add(persona)
+        await async_db_session.flush()
+        pending = Question(persona_id=persona.id, question_text="Does he like jazz?", choices=["Yes", "No", "Maybe"])
+        async_db_session.add(pending)
+        await async_db_session.commit()
+
+        result = await QuestionService(async_db_session).get_questions(persona.id)
+
+        assert result == [{"id": pending.id, "question": "Does he like jazz?", "choices": ["Yes", "No", "Maybe"]}]
+        mock_agent_run.assert_not_called()
+        await async_db_session.refresh(pending)
+        assert pending.served_at is not None
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_prefetched_questions_are_left_unserved(
+        self, mock_agent_run, mock_session, sample_persona, sample_agent_response
+    ):
+        """Test that background generation stores questions without marking them served"""
+        mock_agent_run.return_value = sample_agent_response
+
+        service = make_service(mock_session, sample_persona)
+        await service.generate_questions(sample_persona.id, served=False)
+
+        saved_questions = bulk_inserted_rows(mock_session)
+        assert len(saved_questions) == 2
+        assert all(q["served_at"] is None for q in saved_questions)
+
+
+class TestQuestionRoundPersistence:
+    """Test that a round's history and questions are written in one transaction"""
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_round_is_persisted_together(self, mock_agent_run, async_db_session):
+        persona = Persona(age=30, gender=Gender.female, occasion=Occasion.birthday, relationship=Relationship.friend)
+        async_db_session.add(persona)
+        await async_db_session.commit()
+
+        mock_agent_run.return_value = Mock(
+            output=GiftQuestions(
+                questions=[
+                    GiftQuestions.QuestionItem(question="Does she cook?", choices=["Yes", "No", "Sometimes"]),
+                    GiftQuestions.QuestionItem(question="Does she travel?", choices=["Often", "Rarely", "Never"]),
+                ],
+                detective_comment="Lifestyle",
+            ),
+            new_messages_json=Mock(return_value=b"[]"),
+        )
+        transaction_during_call = []
+        result = mock_agent_run.return_value
+
+        async def run(*args, **kwargs):
+            transaction_during_call.append(async_db_session.in_transaction())
+            return result
+
+        mock_agent_run.side_effect = run
+
+        service = QuestionService(async_db_session)
+        service.question_cache.enabled = False
+        items = await service.generate_questions(persona.id)
+
+        # The model ran with no transaction open, so no pooled connection was held across it
+        assert mock_agent_run.await_count == 1
+        assert transaction_during_call == [False]
+
+        stored = (await async_db_session.execute(
+            select(Question).where(Question.persona_id == persona.id).order_by(Question.created_at)
+        )).scalars().all()
+        assert [q.id for q in stored] == [item["id"] for item in items]
+        assert await service.message_repo.get_history_version(persona.id) == 1
+
+
+class TestQuestionStreaming:
+    """Test that questions are streamed as soon as each one is complete"""
+
+    def test_complete_question_items_skips_unfinished_question(self):
+        """Test that the question still being generated is not emitted with padded choices"""
+        from pydantic_ai.messages import ModelResponse, ToolCallPart
+        from src.questions_agent.detective import complete_question_items
+
+        def items(raw):
+            return complete_question_items(ModelResponse(parts=[ToolCallPart(tool_name="final_result", args=raw)]))
+
+        partial = '{"questions": [{"question": "Does she cook?", "choices": ["Yes.", "No", "Sometimes"]}, {"question": "Does she tr'
+        assert [q.question for q in items(partial)] == ["Does she cook?"]
+        assert items(partial)[0].choices == ["Yes", "No", "Sometimes", "Maybe"]
+
+        open_array = '{"questions": [{"question": "Does she cook?", "choices": ["Yes", "No"'
+        assert items(open_array) == []
+
+        closed = '{"questions": [{"question": "Does she cook?", "choices": ["Yes", "No", "Sometimes", "Never"]}], "detective_comment": "Hm'
+        assert [q.choices for q in items(closed)] == [["Yes", "No", "Sometimes", "Never"]]
+
+    async def test_stream_emits_questions_before_the_round_completes(self, async_db_session):
+        """Test event order, early delivery and that the streamed ids are the persisted ones"""
+        import json
+        from pydantic_ai.models.function import FunctionModel, DeltaToolCall
+        from src.questions.service import gift_detective
+
+        persona = Persona(age=30, gender=Gender.female, occasion=Occasion.birthday, relationship=Relationship.friend)
+        async_db_session.add(persona)
+        await async_db_session.commit()
+
+        payload = json.dumps({
+            "questions": [
+                {"question": f"Question {i}?", "choices": ["A", "B", "C", "None of the above"]}
+                for i in range(3)
+            ],
+            "detective_comment": "Broad strokes first",
+        })
+        chunks = [payload[i:i + 16] for i in range(0, len(payload), 16)]
+        sent = []
+        transaction_during_call = []
+
+        async def stream_fn(messages, info):
+            transaction_during_call.append(async_db_session.in_transaction())
+            for i, chunk in enumerate(chunks):
+                sent.append(chunk)
+                yield {0: DeltaToolCall(name=info.output_tools[0].name if i == 0 else None, json_args=chunk)}
+
+        service = QuestionService(async_db_session)
+        service.question_cache.enabled = False
+        events = []
+        with gift_detective.override(model=FunctionModel(stream_function=stream_fn)):
+            async for name, data in await service.stream_questions(persona.id):
+                events.append((name, data, len(sent)))
+
+        assert [name for name, _, _ in events] == ["question", "question", "question", "done"]
+        assert events[0][2] < len(chunks)
+        assert events[-1][1]["detective_comment"] == "Broad strokes first"
+
+        stored = (await async_db_session.execute(
+            select(Question).where(Question.persona_id == persona.id).order_by(Question.created_at)
+        )).scalars().all()
+        assert [q.id for q in stored] == [data["id"] for name, data, _ in events[:-1]]
+        assert all(data["provisional"] for name, data, _ in events[:-1])
+        assert events[-1][1]["ids"] == [q.id for q in stored]
+        assert transaction_during_call == [False]
+        assert await service.message_repo.get_history_version(persona.id) == 1
+
+    async def test_stream_replays_pending_questions(self, mock_session, sample_persona):
+        """Test that a pre-generated round is streamed without calling the agent"""
+        service = make_service(mock_session, sample_persona)
+        pending = [{"id": uuid4(), "question": "Q?", "choices": ["A", "B"]}]
+        service._take_pending_questions = AsyncMock(return_value=pending)
+
+        events = [event async for event in await service.stream_questions(sample_persona.id)]
+
+        assert events == [("question", pending[0]), ("done", {"count": 1})]
+        service.message_repo.load_all_messages.assert_not_called()
+
+
+class TestQuestionFlights:
+    """Test that coalesced question requests run outside the leader's session"""
+
+    async def test_flight_opens_its_own_session(self, async_db_session):
+        """Test that the shared generation uses a session from the injected factory"""
+        persona = Persona(age=30, gender=Gender.male, occasion=Occasion.birthday, relationship=Relationship.friend)
+        async_db_session.add(persona)
+        await async_db_session.flush()
+        async_db_session.add(Question(persona_id=persona.id, question_text="Q?", choices=["A", "B"]))
+        await async_db_session.commit()
+
+        factory = session_factory_for(async_db_session)
+        opened = []
+
+        def session_factory():
+            opened.append(factory())
+            return opened[-1]
+
+        result = await QuestionService(async_db_session, session_factory).get_questions(persona.id)
+
+        assert [q["question"] for q in result] == ["Q?"]
+        assert len(opened) == 1 and opened[0] is not async_db_session
+        assert not opened[0].in_transaction()
+
+
+class TestFollowupPrefetcher:
+    """Test the per-persona background generation registry"""
+
+    async def test_schedule_runs_once_per_persona(self):
+        """Test that a second schedule joins the in-flight generation"""
+        prefetcher = FollowupPrefetcher()
+        persona_id = uuid4()
+        release = asyncio.Event()
+        calls = []
+
+        async def generate():
+            calls.append(1)
+            await release.wait()
+
+        assert prefetcher.schedule(persona_id, generate) is True
+        assert prefetcher.schedule(persona_id, generate) is False
+        assert prefetcher.is_running(persona_id)
+
+        release.set()
+        await prefetcher.wait(persona_id)
+
+        assert calls == [1]
+        assert not prefetcher.is_running(persona_id)
+
+    async def test_wait_swallows_generation_errors(self):
+        """Test that a failed prefetch does not fail the joining request"""
+        prefetcher = FollowupPrefetcher()
+        persona_id = uuid4()
+
+        async def generate():
+            raise RuntimeError("LLM unavailable")
+
+        prefetcher.schedule(persona_id, generate)
+        await prefetcher.wait(persona_id)
+
+        assert not prefetcher.is_running(persona_id)
+
+    async def test_prefetch_runs_in_interactive_lane(self):
+        """Test that the prefetch the next GET waits on is not queued behind batch work"""
+        lanes = []
+
+        async def generate_questions(self, persona_id, served=True):
+            lanes.append((_lane_override.get(), served))
+
+        session = AsyncMock()
+        session.__aenter__.return_value = session
+        with patch.object(QuestionService, 'generate_questions', generate_questions):
+            await prefetch_followup_questions(uuid4(), Mock(return_value=session))
+
+        assert lanes == [(Lane.interactive, False)]
+
+    @patch('src.questions.service.gift_detective.run', new_callable=AsyncMock)
+    async def test_prefetch_skips_round_generated_by_another_worker(self, mock_agent_run, async_db_session):
+        """Test that a prefetch that waited for the persona lock does not generate a second round"""
+        from datetime import timedelta
+        from sqlalchemy.ext.asyncio import create_async_engine
+        from src.database.core import utcnow
+        from src.singleflight import AdvisoryLockSingleFlight
+
+        persona = Persona(age=30, gender=Gender.male, occasion=Occasion.birthday, relationship=Relationship.friend)
+        async_db_session.add(persona)
+        await async_db_session.flush()
+        # Stored by a GET that held the lock while this prefetch waited
+        async_db_session.add(Question(
+            persona_id=persona.id, question_text="Q?", choices=["A", "B"], created_at=utcnow() + timedelta(seconds=1),
+        ))
+        await async_db_session.commit()
+
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        with patch('src.questions.service.question_flights', AdvisoryLockSingleFlight("questions", engine=engine)):
+            await prefetch_followup_questions(persona.id, session_factory_for(async_db_session))
+        await engine.dispose()
+
+        mock_agent_run.assert_not_called()
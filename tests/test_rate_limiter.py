@@ -0,0 +1,182 @@
+import pytest
+from unittest.mock import patch
+from fastapi import Depends, FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from src.exceptions import RateLimitExceededError
+from src.rate_limiter import (
+    BucketRule,
+    MemoryBucketBackend,
+    RateLimiter,
+    RateLimitHeadersMiddleware,
+    check_route_costs,
+    create_backend,
+    rate_limit,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    clock = FakeClock()
+    with patch("src.rate_limiter.time.monotonic", clock):
+        yield clock
+
+
+def make_limiter(**kwargs):
+    return RateLimiter(
+        backend=MemoryBucketBackend(),
+        enabled=True,
+        per_ip=kwargs.get("per_ip", BucketRule(10, 1)),
+        per_persona=kwargs.get("per_persona", BucketRule(4, 0.5)),
+    )
+
+
+class TestTokenBucket:
+    """Test bucket accounting, weighted costs and refill"""
+
+    async def test_costs_are_weighted_and_refilled(self, clock):
+        """Test that expensive calls drain the bucket faster and tokens come back over time"""
+        limiter = make_limiter()
+
+        headers = await limiter.hit("1.2.3.4", 5)
+        assert headers == {"X-RateLimit-Limit": "10", "X-RateLimit-Remaining": "5", "X-RateLimit-Reset": "5"}
+        await limiter.hit("1.2.3.4", 5)
+
+        with pytest.raises(RateLimitExceededError) as exc:
+            await limiter.hit("1.2.3.4", 1)
+        assert exc.value.status_code == 429
+        assert exc.value.headers["Retry-After"] == "1"
+
+        clock.now += 3
+        assert (await limiter.hit("1.2.3.4", 1))["X-RateLimit-Remaining"] == "2"
+        # Other clients have their own bucket
+        assert (await limiter.hit("5.6.7.8", 1))["X-RateLimit-Remaining"] == "9"
+
+    async def test_persona_bucket_limits_across_clients(self, clock):
+        """Test that one persona cannot be hammered from several addresses"""
+        limiter = make_limiter()
+
+        headers = await limiter.hit("1.1.1.1", 3, persona_id="p1")
+        # The persona bucket is the tighter one, so it is reported
+        assert headers["X-RateLimit-Limit"] == "4"
+        assert headers["X-RateLimit-Remaining"] == "1"
+
+        with pytest.raises(RateLimitExceededError) as exc:
+            await limiter.hit("2.2.2.2", 3, persona_id="p1")
+        assert exc.value.headers["Retry-After"] == "4"
+
+        await limiter.hit("2.2.2.2", 3, persona_id="p2")
+
+    async def test_rejected_hit_spends_from_no_bucket(self, clock):
+        """Test that a request refused by the persona bucket leaves the IP bucket untouched"""
+        limiter = make_limiter()
+        await limiter.hit("1.1.1.1", 4, persona_id="p1")
+
+        with pytest.raises(RateLimitExceededError):
+            await limiter.hit("2.2.2.2", 3, persona_id="p1")
+
+        assert (await limiter.hit("2.2.2.2", 1))["X-RateLimit-Remaining"] == "9"
+
+    async def test_full_buckets_are_pruned(self, clock):
+        """Test that refilled buckets are dropped once the table is full"""
+        backend = MemoryBucketBackend()
+        backend.max_buckets = 2
+        rule = BucketRule(2, 1)
+
+        await backend.take([("a", rule)], 1)
+        clock.now += 5
+        await backend.take([("b", rule)], 1)
+        await backend.take([("c", rule)], 1)
+
+        assert set(backend._buckets) == {"b", "c"}
+
+    async def test_pruning_uses_each_buckets_own_rule(self, clock):
+        """Test that a slowly refilling bucket is kept even when the triggering rule would call it full"""
+        backend = MemoryBucketBackend()
+        backend.max_buckets = 2
+
+        await backend.take([("slow", BucketRule(30, 0.5))], 10)
+        await backend.take([("fast", BucketRule(2, 1))], 1)
+        clock.now += 5
+        await backend.take([("new", BucketRule(2, 1))], 1)
+
+        assert set(backend._buckets) == {"slow", "new"}
+
+    @pytest.mark.parametrize("capacity,refill_per_second", [(10, 0), (10, -1), (0, 1)])
+    def test_invalid_rules_are_rejected(self, capacity, refill_per_second):
+        """Test that a zero refill rate or empty bucket fails when the limits are loaded"""
+        with pytest.raises(ValueError, match="RATE_LIMIT_"):
+            BucketRule(capacity, refill_per_second)
+
+    def test_route_costs_must_fit_every_bucket(self):
+        """Test that a route costing more than a bucket holds fails when the limits are loaded"""
+        rules = [BucketRule(60, 1), BucketRule(30, 0.5)]
+        check_route_costs({"RATE_LIMIT_COST_QUESTIONS": 30}, rules)
+
+        with pytest.raises(ValueError, match="RATE_LIMIT_COST_RECOMMENDATIONS=31"):
+            check_route_costs({"RATE_LIMIT_COST_QUESTIONS": 5, "RATE_LIMIT_COST_RECOMMENDATIONS": 31}, rules)
+
+    def test_memory_backend_is_the_default(self):
+        assert isinstance(create_backend("memory://"), MemoryBucketBackend)
+
+
+class TestRateLimitRoutes:
+    """Test the route dependency and the header middleware"""
+
+    def _app(self):
+        app = FastAPI()
+        app.add_middleware(RateLimitHeadersMiddleware)
+
+        @app.post("/personas/{persona_id}/work", dependencies=[Depends(rate_limit(3))])
+        async def work(persona_id: str):
+            return {"ok": True}
+
+        @app.get("/stream", dependencies=[Depends(rate_limit(1))])
+        async def stream():
+            async def body():
+                yield b"chunk\n"
+            return StreamingResponse(body())
+
+        @app.get("/free")
+        async def free():
+            return {"ok": True}
+
+        return app
+
+    def test_headers_and_429(self, clock):
+        """Test that limited routes report their budget and reject once it is spent"""
+        with patch("src.rate_limiter.limiter", make_limiter()):
+            client = TestClient(self._app())
+
+            response = client.post("/personas/p1/work")
+            assert response.status_code == 200
+            assert response.headers["X-RateLimit-Remaining"] == "1"
+
+            response = client.post("/personas/p1/work")
+            assert response.status_code == 429
+            assert response.headers["Retry-After"] == "4"
+            assert response.headers["X-RateLimit-Limit"] == "4"
+
+            # Streaming responses get the headers too; unlimited routes get none
+            assert client.get("/stream").headers["X-RateLimit-Limit"] == "10"
+            assert "X-RateLimit-Limit" not in client.get("/free").headers
+
+    def test_disabled_limiter_lets_everything_through(self, clock):
+        """Test that RATE_LIMIT_ENABLED=false skips the buckets and the headers"""
+        limiter = make_limiter()
+        limiter.enabled = False
+        with patch("src.rate_limiter.limiter", limiter):
+            client = TestClient(self._app())
+            for _ in range(5):
+                response = client.post("/personas/p1/work")
+                assert response.status_code == 200
+                assert "X-RateLimit-Limit" not in response.headers
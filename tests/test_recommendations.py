@@ -1,17 +1,41 @@
 import pytest
+import asyncio
 from unittest.mock import Mock, AsyncMock
 from uuid import uuid4
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.recommendations.service import RecommendationService
 from src.recommendations.models import RecommendationRequest, PersonaProfile, QuestionInsight
 from src.build_persona.entity import Persona, Gender, Occasion, Relationship
 from src.questions.entity import Question, Answer
 
+
+def make_recommendations(*titles):
+    from src.recommendations.models import GiftRecommendation
+
+    return [
+        GiftRecommendation(title=title, description="d", price_range="€", reasoning="r", confidence_score=0.9, category="c")
+        for title in titles
+    ]
+
+
+def make_stubbed_service(session, profile, history_version=1, shared_cache=False):
+    """Build a service whose profile and history are stubbed; the shared cache is off unless asked for"""
+    from src.recommendations.cache import SharedRecommendationCacheRepository
+
+    service = RecommendationService(session)
+    if not shared_cache:
+        service.shared_cache = SharedRecommendationCacheRepository(session, enabled=False)
+    service._build_persona_profile = AsyncMock(return_value=profile)
+    service.message_repo = Mock(get_history_version=AsyncMock(return_value=history_version), load_all_messages=AsyncMock(return_value=[]))
+    return service
+
+
 class TestRecommendationService:
     """Test the recommendation service functionality"""
     
     @pytest.fixture
     def mock_session(self):
-        return Mock()
+        return Mock(spec=AsyncSession)
     
     @pytest.fixture
     def service(self, mock_session):
@@ -26,6 +50,7 @@ class TestRecommendationService:
         persona.gender = Gender.male
         persona.occasion = Occasion.birthday
         persona.relationship = Relationship.friend
+        persona.budget = None
         return persona
     
     @pytest.fixture
@@ -47,14 +72,14 @@ class TestRecommendationService:
         
         return [(q1, a1), (q2, a2)]
     
-    def test_build_persona_profile(self, service, mock_session, sample_persona, sample_questions_answers):
+    async def test_build_persona_profile(self, service, mock_session, sample_persona, sample_questions_answers):
         """Test building complete persona profile"""
         # Mock database queries
-        mock_session.query.return_value.filter.return_value.first.return_value = sample_persona
-        mock_session.query.return_value.join.return_value.filter.return_value.all.return_value = sample_questions_answers
+        mock_session.get.return_value = sample_persona
+        mock_session.execute.return_value = Mock(all=Mock(return_value=sample_questions_answers))
         
         # Build profile
-        profile = service._build_persona_profile(sample_persona.id)
+        profile = await service._build_persona_profile(sample_persona.id)
         
         # Verify profile structure
         assert isinstance(profile, PersonaProfile)
@@ -177,4 +202,447 @@ class TestRecommendationModels:
         request = RecommendationRequest(persona_id=uuid4())
         
         assert request.max_recommendations == 5
-        assert request.include_reasoning == True
\ No newline at end of file
+        assert request.include_reasoning == True
+
+class TestRecommendationCoalescing:
+    """Test that identical concurrent recommendation requests share one agent call"""
+
+    async def test_concurrent_requests_share_agent_call(self, async_db_session):
+        from unittest.mock import patch
+
+        persona = Persona(age=30, gender=Gender.female, occasion=Occasion.birthday, relationship=Relationship.friend)
+        async_db_session.add(persona)
+        await async_db_session.commit()
+
+        async def generate(*args, **kwargs):
+            await asyncio.sleep(0.01)
+            return make_recommendations("Mug")
+
+        first = RecommendationService(async_db_session)
+        second = RecommendationService(async_db_session)
+        request = RecommendationRequest(persona_id=persona.id, max_recommendations=1)
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = AsyncMock(side_effect=generate)
+            results = await asyncio.gather(first.get_recommendations(request), second.get_recommendations(request))
+
+        assert mock_agent.generate_recommendations.await_count == 1
+        assert results[0] is results[1]
+
+
+class TestRecommendationCache:
+    """Test reuse of recommendations while the profile and history are unchanged"""
+
+    @pytest.fixture
+    def profile(self):
+        return PersonaProfile(
+            persona_id=uuid4(),
+            age=30,
+            gender="female",
+            occasion="birthday",
+            relationship="friend",
+            question_insights=[
+                QuestionInsight(
+                    question="What do you like?",
+                    selected_choice="Gaming",
+                    available_choices=["Gaming", "Sports"],
+                    insight_category="interests"
+                )
+            ]
+        )
+
+    def make_service(self, session, profile, recommendations):
+        service = make_stubbed_service(session, profile)
+        service.generate = AsyncMock(return_value=make_recommendations(*recommendations))
+        return service
+
+    def test_fingerprint_tracks_profile_and_history(self, profile):
+        """Test that answers, history version and request options all change the fingerprint"""
+        from src.recommendations.cache import build_fingerprint
+
+        request = RecommendationRequest(persona_id=profile.persona_id)
+        fingerprint = build_fingerprint(profile, 1, request)
+
+        answered = profile.model_copy(update={"question_insights": profile.question_insights * 2})
+        assert build_fingerprint(profile.model_copy(), 1, request) == fingerprint
+        assert build_fingerprint(answered, 1, request) != fingerprint
+        assert build_fingerprint(profile, 2, request) != fingerprint
+        # The count is stored next to the cached response instead, so larger requests can top it up
+        assert build_fingerprint(profile, 1, RecommendationRequest(persona_id=profile.persona_id, max_recommendations=3)) == fingerprint
+        assert build_fingerprint(profile, 1, RecommendationRequest(persona_id=profile.persona_id, prompt_mode="profile")) != fingerprint
+
+    async def test_unchanged_profile_is_served_from_cache(self, async_db_session, profile):
+        """Test that a repeat call skips the agent and refresh forces a new generation"""
+        from unittest.mock import patch
+
+        service = self.make_service(async_db_session, profile, ["Console"])
+        request = RecommendationRequest(persona_id=profile.persona_id)
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = service.generate
+            first = await service._generate_recommendations(request)
+            second = await service._generate_recommendations(request)
+            assert mock_agent.generate_recommendations.await_count == 1
+            assert second == first
+
+            await service._generate_recommendations(request, refresh=True)
+            assert mock_agent.generate_recommendations.await_count == 2
+
+    async def test_invalidate_drops_cached_responses(self, async_db_session, profile):
+        """Test that invalidating a persona forces the next call to regenerate"""
+        from unittest.mock import patch
+        from src.recommendations.cache import RecommendationCacheRepository
+
+        service = self.make_service(async_db_session, profile, ["Console"])
+        request = RecommendationRequest(persona_id=profile.persona_id)
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = service.generate
+            await service._generate_recommendations(request)
+
+            await RecommendationCacheRepository(async_db_session).invalidate([profile.persona_id])
+            await async_db_session.commit()
+            await service._generate_recommendations(request)
+
+            assert mock_agent.generate_recommendations.await_count == 2
+
+    async def test_model_runs_without_an_open_transaction(self, async_db_session, profile):
+        """Test that no pooled connection is held while the agent generates"""
+        from unittest.mock import patch
+
+        service = self.make_service(async_db_session, profile, ["Console"])
+        generate = service.generate
+        transaction_during_call = []
+
+        async def record(*args, **kwargs):
+            transaction_during_call.append(async_db_session.in_transaction())
+            return await generate(*args, **kwargs)
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = AsyncMock(side_effect=record)
+            await service._generate_recommendations(RecommendationRequest(persona_id=profile.persona_id))
+            await service._generate_next_recommendations(RecommendationRequest(persona_id=profile.persona_id), None)
+
+        assert transaction_during_call == [False, False]
+
+
+class TestSharedRecommendationCache:
+    """Test reuse of recommendations across personas with matching profiles"""
+
+    def make_profile(self, choices, age=30, occasion="birthday"):
+        return PersonaProfile(
+            persona_id=uuid4(),
+            age=age,
+            gender="female",
+            occasion=occasion,
+            relationship="friend",
+            budget="€25-€50",
+            question_insights=[
+                QuestionInsight(question=f"Question {i}?", selected_choice=choice, available_choices=[choice], insight_category="preferences")
+                for i, choice in enumerate(choices)
+            ]
+        )
+
+    def test_signature_ignores_order_case_and_age_within_bucket(self):
+        """Test that the canonical signature only depends on the normalized profile"""
+        from src.recommendations.cache import build_demographic_key, build_profile_signature, profile_choices
+
+        def signature(profile):
+            return build_profile_signature(build_demographic_key(profile), profile_choices(profile))
+
+        first = self.make_profile(["Loves coffee", "Books"], age=30)
+        second = self.make_profile(["books", "loves  coffee"], age=33)
+
+        assert signature(first) == signature(second)
+        assert signature(first) != signature(self.make_profile(["Loves coffee", "Books"], occasion="wedding"))
+
+    async def test_exact_match_across_personas(self, async_db_session):
+        """Test that another persona with the same normalized profile reuses the list"""
+        from src.recommendations.cache import SharedRecommendationCacheRepository
+
+        cache = SharedRecommendationCacheRepository(async_db_session, similarity=1.0)
+        await cache.put(self.make_profile(["Coffee", "Books", "Hiking"]), make_recommendations("Mug"))
+        await async_db_session.commit()
+
+        found = await cache.find(self.make_profile(["hiking", "coffee", "books"]))
+
+        assert [rec.title for rec in found] == ["Mug"]
+        assert await cache.find(self.make_profile(["coffee", "books", "tea"])) is None
+
+    async def test_near_match_within_threshold(self, async_db_session):
+        """Test that similar choice sets match above the threshold and only within the same demographics"""
+        from src.recommendations.cache import SharedRecommendationCacheRepository
+
+        cache = SharedRecommendationCacheRepository(async_db_session, similarity=0.6)
+        await cache.put(self.make_profile(["coffee", "books", "hiking", "jazz"]), make_recommendations("Mug"))
+        await async_db_session.commit()
+
+        # 3 shared of 5 distinct choices -> 0.6
+        near = await cache.find(self.make_profile(["coffee", "books", "hiking", "cinema"]))
+        far = await cache.find(self.make_profile(["coffee", "cinema", "gaming", "tea"]))
+        other_occasion = await cache.find(self.make_profile(["coffee", "books", "hiking", "jazz"], occasion="wedding"))
+
+        assert [rec.title for rec in near] == ["Mug"]
+        assert far is None
+        assert other_occasion is None
+
+    async def test_service_skips_agent_on_shared_hit(self, async_db_session):
+        """Test that a matching profile is served without calling the agent, unless refreshed"""
+        from unittest.mock import patch
+
+        stored = self.make_profile(["coffee", "books"])
+        profile = self.make_profile(["Books", "Coffee"])
+        service = make_stubbed_service(async_db_session, profile, history_version=0, shared_cache=True)
+        await service.shared_cache.put(stored, make_recommendations("Mug", "Novel"))
+        await async_db_session.commit()
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = AsyncMock(return_value=make_recommendations("Fresh"))
+            request = RecommendationRequest(persona_id=profile.persona_id, max_recommendations=2)
+            response = await service._generate_recommendations(request)
+            assert [rec.title for rec in response.recommendations] == ["Mug", "Novel"]
+            mock_agent.generate_recommendations.assert_not_called()
+
+            refreshed = await service._generate_recommendations(request, refresh=True)
+            assert [rec.title for rec in refreshed.recommendations] == ["Fresh"]
+
+
+class TestStreamingRecommendations:
+    """Test incremental delivery of recommendations"""
+
+    async def test_agent_yields_each_item_once_complete(self):
+        """Test that items are yielded while the model is still streaming the rest"""
+        import json
+        from pydantic_ai.models.function import FunctionModel, DeltaToolCall
+        from src.recommendations.agent import gift_recommendation_agent
+
+        payload = json.dumps({"response": [rec.model_dump() for rec in make_recommendations("Gift 0", "Gift 1", "Gift 2")]})
+        chunks = [payload[i:i + 20] for i in range(0, len(payload), 20)]
+        sent = []
+
+        async def stream_fn(messages, info):
+            for i, chunk in enumerate(chunks):
+                sent.append(chunk)
+                yield {0: DeltaToolCall(name=info.output_tools[0].name if i == 0 else None, json_args=chunk)}
+
+        profile = PersonaProfile(persona_id=uuid4(), age=30, gender="female", occasion="birthday", relationship="friend", question_insights=[])
+        received = []
+        with gift_recommendation_agent.agent.override(model=FunctionModel(stream_function=stream_fn)):
+            async for recommendation in gift_recommendation_agent.stream_recommendations(profile, []):
+                received.append((recommendation, len(sent)))
+
+        assert [rec.title for rec, _ in received] == ["Gift 0", "Gift 1", "Gift 2"]
+        assert received[0][0].category == "c"
+        assert received[0][1] < len(chunks)
+
+    async def test_service_streams_items_then_summary(self, async_db_session):
+        """Test the event order, the max_recommendations limit and that the result is cached"""
+        from unittest.mock import patch
+
+        profile = PersonaProfile(persona_id=uuid4(), age=30, gender="female", occasion="birthday", relationship="friend", question_insights=[])
+        service = make_stubbed_service(async_db_session, profile, history_version=0)
+        request = RecommendationRequest(persona_id=profile.persona_id, max_recommendations=2)
+
+        async def stream(profile, history, prompt_mode, count, exclude):
+            for recommendation in make_recommendations("Gift 0", "Gift 1", "Gift 2"):
+                yield recommendation
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.stream_recommendations = Mock(side_effect=stream)
+            events = [event async for event in await service.stream_recommendations(request)]
+            cached = [event async for event in await service.stream_recommendations(request)]
+
+        assert [name for name, _ in events] == ["recommendation", "recommendation", "summary"]
+        assert events[-1][1]["total_recommendations"] == 2
+        assert "confidence_level" in events[-1][1]
+        assert cached == events
+        assert mock_agent.stream_recommendations.call_count == 1
+
+    async def test_unknown_persona_raises_before_streaming(self):
+        """Test that a missing persona fails before any event is produced"""
+        session = Mock(spec=AsyncSession)
+        session.get.return_value = None
+        service = RecommendationService(session)
+
+        with pytest.raises(ValueError):
+            await service.stream_recommendations(RecommendationRequest(persona_id=uuid4()))
+
+
+class TestProfilePromptMode:
+    """Test recommendations rendered from the structured profile instead of the history"""
+
+    @pytest.fixture
+    def profile(self):
+        return PersonaProfile(
+            persona_id=uuid4(),
+            age=30,
+            gender="female",
+            occasion="birthday",
+            relationship="friend",
+            budget="€25-€50",
+            question_insights=[
+                QuestionInsight(question="Favourite hobby?", selected_choice="Hiking", available_choices=["Hiking", "Gaming", "None of the above"], insight_category="interests"),
+                QuestionInsight(question="Favourite drink?", selected_choice="None of the above", available_choices=["Wine", "Beer", "None of the above"], insight_category="lifestyle"),
+            ],
+        )
+
+    def test_profile_prompt_replaces_history(self, profile):
+        """Test that profile mode sends no history and renders answers, exclusions and budget"""
+        from pydantic_ai.messages import ModelRequest, UserPromptPart
+        from src.recommendations.agent import gift_recommendation_agent
+        from src.recommendations.models import PromptMode
+
+        history = [ModelRequest(parts=[UserPromptPart(content="Favourite hobby?")])]
+
+        prompt, sent_history = gift_recommendation_agent.build_request(profile, history, PromptMode.profile)
+        assert sent_history is None
+        assert "- [interests] Favourite hobby? -> Hiking" in prompt
+        assert "- Favourite drink? (rejected: Wine, Beer)" in prompt
+        assert "Budget: €25-€50" in prompt
+
+        prompt, sent_history = gift_recommendation_agent.build_request(profile, history, PromptMode.history)
+        assert sent_history is history
+        assert "our conversation above" in prompt
+
+    async def test_service_skips_history_in_profile_mode(self, async_db_session, profile):
+        """Test that profile mode never loads the message history"""
+        from unittest.mock import patch
+        from src.recommendations.models import PromptMode
+
+        service = make_stubbed_service(async_db_session, profile)
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = AsyncMock(return_value=[])
+            await service._generate_recommendations(RecommendationRequest(persona_id=profile.persona_id, prompt_mode=PromptMode.profile))
+
+            service.message_repo.load_all_messages.assert_not_called()
+            mock_agent.generate_recommendations.assert_awaited_once_with(profile, None, PromptMode.profile, count=5, exclude=[])
+
+
+class TestRecommendationCount:
+    """Test that the requested count reaches the model and larger requests top up the cached gifts"""
+
+    @pytest.fixture
+    def profile(self):
+        return PersonaProfile(persona_id=uuid4(), age=30, gender="female", occasion="birthday", relationship="friend", question_insights=[])
+
+    def test_count_is_bounded(self):
+        """Test that max_recommendations must be between 1 and the configured maximum"""
+        from pydantic import ValidationError
+        from src.recommendations.models import RECOMMENDATION_MAX_COUNT
+
+        assert RecommendationRequest(persona_id=uuid4(), max_recommendations=RECOMMENDATION_MAX_COUNT).max_recommendations == RECOMMENDATION_MAX_COUNT
+        for count in (0, RECOMMENDATION_MAX_COUNT + 1):
+            with pytest.raises(ValidationError):
+                RecommendationRequest(persona_id=uuid4(), max_recommendations=count)
+
+    async def test_count_flows_into_prompt_and_schema(self, profile):
+        """Test that the prompt and output schema ask for the count and list the excluded titles"""
+        from pydantic_ai.messages import ModelResponse, ToolCallPart
+        from pydantic_ai.models.function import FunctionModel
+        from src.recommendations.agent import gift_recommendation_agent
+
+        captured = {}
+
+        def respond(messages, info):
+            captured["schema"] = info.output_tools[0].parameters_json_schema["properties"]["response"]
+            captured["prompt"] = messages[-1].parts[-1].content
+            items = [rec.model_dump() for rec in make_recommendations("Kite", "Puzzle", "Tea set")]
+            return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, {"response": items})])
+
+        with gift_recommendation_agent.agent.override(model=FunctionModel(respond)):
+            result = await gift_recommendation_agent.generate_recommendations(profile, [], count=3, exclude=make_recommendations("Mug"))
+
+        assert len(result) == 3
+        assert captured["schema"]["minItems"] == captured["schema"]["maxItems"] == 3
+        assert "exactly 3 gift recommendations" in captured["prompt"]
+        assert captured["prompt"].rstrip().endswith("- Mug")
+
+    async def test_larger_request_only_generates_missing_items(self, async_db_session, profile):
+        """Test that smaller requests reuse the cache and larger ones top it up without duplicates"""
+        from unittest.mock import patch
+
+        service = make_stubbed_service(async_db_session, profile)
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = AsyncMock(side_effect=[
+                make_recommendations("Mug", "Novel"),
+                make_recommendations("mug", "Kite", "Puzzle"),
+            ])
+            first = await service._generate_recommendations(RecommendationRequest(persona_id=profile.persona_id, max_recommendations=2))
+            topped_up = await service._generate_recommendations(RecommendationRequest(persona_id=profile.persona_id, max_recommendations=5))
+            smaller = await service._generate_recommendations(RecommendationRequest(persona_id=profile.persona_id, max_recommendations=3))
+
+        calls = mock_agent.generate_recommendations.await_args_list
+        assert [call.kwargs["count"] for call in calls] == [2, 3]
+        assert [rec.title for rec in calls[1].kwargs["exclude"]] == ["Mug", "Novel"]
+        assert [rec.title for rec in first.recommendations] == ["Mug", "Novel"]
+        assert [rec.title for rec in topped_up.recommendations] == ["Mug", "Novel", "Kite", "Puzzle"]
+        assert [rec.title for rec in smaller.recommendations] == ["Mug", "Novel", "Kite"]
+
+
+class TestNextRecommendations:
+    """Test pages of additional recommendations"""
+
+    async def test_pages_only_generate_new_items(self, async_db_session):
+        """Test that each page asks for its own count, excludes served gifts and is stored"""
+        from unittest.mock import patch
+
+        profile = PersonaProfile(persona_id=uuid4(), age=30, gender="female", occasion="birthday", relationship="friend", question_insights=[])
+        service = make_stubbed_service(async_db_session, profile)
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = AsyncMock(side_effect=[
+                make_recommendations("Mug", "Novel"),
+                make_recommendations("Kite", "Puzzle"),
+                make_recommendations("novel", "Tea set"),
+            ])
+            await service._generate_recommendations(RecommendationRequest(persona_id=profile.persona_id, max_recommendations=2))
+
+            request = RecommendationRequest(persona_id=profile.persona_id, max_recommendations=2)
+            first = await service._generate_next_recommendations(request, None)
+            second = await service._generate_next_recommendations(request, None)
+            again = await service._generate_next_recommendations(request, 1)
+
+            with pytest.raises(ValueError):
+                await service._generate_next_recommendations(request, 5)
+
+        calls = mock_agent.generate_recommendations.await_args_list
+        assert len(calls) == 3
+        assert [call.kwargs["count"] for call in calls] == [2, 2, 2]
+        assert [rec.title for rec in calls[2].kwargs["exclude"]] == ["Mug", "Novel", "Kite", "Puzzle"]
+
+        assert (first.page, [rec.title for rec in first.recommendations], first.total_recommendations) == (1, ["Kite", "Puzzle"], 4)
+        assert (second.page, [rec.title for rec in second.recommendations], second.total_recommendations) == (2, ["Tea set"], 5)
+        assert again == first
+
+    async def test_concurrent_page_serves_the_stored_winner(self, async_db_session):
+        """Test that losing the race for a page number returns the page the other request stored"""
+        from unittest.mock import patch
+        from src.recommendations.cache import RecommendationBatchRepository, build_fingerprint
+
+        profile = PersonaProfile(persona_id=uuid4(), age=30, gender="female", occasion="birthday", relationship="friend", question_insights=[])
+        request = RecommendationRequest(persona_id=profile.persona_id, max_recommendations=2)
+        service = make_stubbed_service(async_db_session, profile)
+
+        batches = RecommendationBatchRepository(async_db_session)
+        list_pages = batches.list_pages
+        service.batches = batches
+
+        # The other request commits page 1 after this one has read the (empty) page list
+        async def stale_then_real(persona_id, fingerprint):
+            if batches.list_pages.await_count == 1:
+                await RecommendationBatchRepository(async_db_session).add(persona_id, fingerprint, 1, make_recommendations("Kite"))
+                await async_db_session.commit()
+                return []
+            return await list_pages(persona_id, fingerprint)
+
+        batches.list_pages = AsyncMock(side_effect=stale_then_real)
+
+        with patch('src.recommendations.service.gift_recommendation_agent') as mock_agent:
+            mock_agent.generate_recommendations = AsyncMock(return_value=make_recommendations("Mug", "Novel"))
+            result = await service._generate_next_recommendations(request, None)
+
+        assert result.page == 1
+        assert [rec.title for rec in result.recommendations] == ["Kite"]
+        fingerprint = build_fingerprint(profile, 1, request)
+        assert len(await list_pages(profile.persona_id, fingerprint)) == 1
@@ -0,0 +1,128 @@
+import asyncio
+from uuid import uuid4
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.singleflight import SingleFlight, AdvisoryLockSingleFlight, advisory_lock_id, create_single_flight
+
+
+class TestSingleFlight:
+    """Test coalescing of concurrent calls"""
+
+    async def test_concurrent_calls_share_one_result(self):
+        """Test that callers with the same key share a single call"""
+        flights = SingleFlight("test")
+        calls = []
+
+        async def generate():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return object()
+
+        results = await asyncio.gather(*[flights.do("persona", generate) for _ in range(5)])
+
+        assert len(calls) == 1
+        assert all(result is results[0] for result in results)
+        assert flights.in_flight() == 0
+
+    async def test_different_keys_run_separately(self):
+        flights = SingleFlight("test")
+
+        async def generate(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(
+            flights.do("a", lambda: generate("a")),
+            flights.do("b", lambda: generate("b")),
+        )
+
+        assert results == ["a", "b"]
+
+    async def test_errors_are_shared_and_not_cached(self):
+        """Test that followers see the leader's error and a later call retries"""
+        flights = SingleFlight("test")
+        attempts = []
+
+        async def failing():
+            attempts.append(1)
+            await asyncio.sleep(0.01)
+            raise RuntimeError("LLM unavailable")
+
+        results = await asyncio.gather(
+            flights.do("persona", failing),
+            flights.do("persona", failing),
+            return_exceptions=True,
+        )
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert len(attempts) == 1
+
+        async def succeeding():
+            return "ok"
+
+        assert await flights.do("persona", succeeding) == "ok"
+
+    async def test_cancelled_leader_does_not_cancel_followers(self):
+        """Test that a disconnecting client does not abort the shared call"""
+        flights = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def generate():
+            await release.wait()
+            return "done"
+
+        leader = asyncio.create_task(flights.do("persona", generate))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("persona", generate))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        release.set()
+
+        assert await follower == "done"
+
+    async def test_exclusive_call_is_not_joined(self):
+        """Test that an exclusive call keeps its result from callers of do"""
+        flights = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def prefetch():
+            await release.wait()
+            return "prefetched"
+
+        async def serve():
+            return "served"
+
+        exclusive = asyncio.create_task(flights.exclusive("persona", prefetch))
+        await asyncio.sleep(0)
+
+        assert flights.in_flight() == 0
+        assert await flights.do("persona", serve) == "served"
+        release.set()
+        assert await exclusive == "prefetched"
+
+
+class TestAdvisoryLockSingleFlight:
+    """Test the multi-worker variant"""
+
+    def test_lock_id_is_stable_signed_64_bit(self):
+        persona_id = uuid4()
+        lock_id = advisory_lock_id("questions", persona_id)
+
+        assert lock_id == advisory_lock_id("questions", persona_id)
+        assert lock_id != advisory_lock_id("recommendations", persona_id)
+        assert -(2 ** 63) <= lock_id < 2 ** 63
+
+    async def test_falls_back_to_in_process_on_sqlite(self):
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        flights = AdvisoryLockSingleFlight("test", engine=engine)
+
+        async def generate():
+            return 42
+
+        assert await flights.do("persona", generate) == 42
+        await engine.dispose()
+
+    def test_create_single_flight_backend(self):
+        assert isinstance(create_single_flight("test", "advisory"), AdvisoryLockSingleFlight)
+        assert not create_single_flight("test", "memory").distributed
@@ -0,0 +1,85 @@
+import json
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from src.streaming import encode_event, event_stream_response
+
+
+def make_app(events):
+    app = FastAPI()
+
+    @app.get("/stream")
+    async def stream():
+        return event_stream_response(events())
+
+    @app.get("/stream-sse")
+    async def stream_sse():
+        return event_stream_response(events(), "text/event-stream")
+
+    return app
+
+
+class TestEventEncoding:
+
+    def test_ndjson_line(self):
+        line = encode_event("recommendation", {"title": "Mug"})
+
+        assert line.endswith(b"\n")
+        assert json.loads(line) == {"event": "recommendation", "data": {"title": "Mug"}}
+
+    def test_sse_frame(self):
+        frame = encode_event("summary", {"total": 2}, sse=True)
+
+        assert frame == b'event: summary\ndata: {"total": 2}\n\n'
+
+
+class TestEventStreamResponse:
+
+    def test_streams_ndjson_events(self):
+        """Test that events arrive as NDJSON lines"""
+        async def events():
+            yield "item", 1
+            yield "item", 2
+
+        response = TestClient(make_app(events)).get("/stream")
+
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert [json.loads(line) for line in response.text.splitlines()] == [
+            {"event": "item", "data": 1},
+            {"event": "item", "data": 2},
+        ]
+
+    def test_yield_dependency_outlives_the_stream(self):
+        """Test that a session dependency is closed only after the last event, as the stream endpoints rely on"""
+        log = []
+
+        async def get_session():
+            log.append("open")
+            yield "session"
+            log.append("close")
+
+        async def events():
+            for i in range(2):
+                log.append(f"event {i}")
+                yield "item", i
+
+        app = FastAPI()
+
+        @app.get("/stream")
+        async def stream(session: str = Depends(get_session)):
+            return event_stream_response(events())
+
+        TestClient(app).get("/stream")
+
+        assert log == ["open", "event 0", "event 1", "close"]
+
+    def test_failure_becomes_error_event(self):
+        """Test that an exception mid-stream is reported as a final error event"""
+        async def events():
+            yield "item", 1
+            raise RuntimeError("model unavailable")
+
+        response = TestClient(make_app(events)).get("/stream-sse")
+
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text.endswith('event: error\ndata: {"detail": "model unavailable"}\n\n')